@@ -0,0 +1,165 @@
+"""
+Embedding 後端基準測試 (PyTorch / ONNX Runtime / int8 量化 ONNX)
+
+每個後端在獨立的新行程中量測 (記憶體數字才不會互相影響):
+- 模型載入時間與常駐記憶體 (載入後 RSS 增量、峰值 RSS)
+- 單筆查詢 embedding 延遲 p50/p95/p99 (benchmark_queries_cn.json 的查詢)
+- 物質文件批次 embedding 吞吐量 (docs/sec)
+- 純向量檢索召回率: 以該後端重新 embedding 物質文件，依餘弦相似度取 top-k (不需重建資料庫)
+
+    python3 benchmark_embedding_backends.py
+    python3 benchmark_embedding_backends.py --backends torch onnx-int8 --repeat 5
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from benchmark_rag_cn import QUERIES_FILE, RESULTS_DIR, RECALL_AT, load_queries, percentiles_ms, git_commit
+from embedding_backends import BACKENDS
+
+DOC_BATCH_SIZE = 64
+
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None # Not Linux: only the peak RSS is reported
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def probe(backend: str, queries_path: str, repeat: int) -> Dict[str, Any]:
+    """Run in a fresh process by main(): measure one backend and return the JSON-serializable result."""
+    from build_rag_db_cn import parse_erg_index, INDEX_FILE, EMBEDDING_MODEL, DB_DIR
+    from embedding_backends import load_sentence_transformer, model_cache_dir
+    from embedding_cache import normalize_text
+
+    queries = load_queries(queries_path)
+    materials = parse_erg_index(INDEX_FILE)
+    rss_before = current_rss_mb()
+
+    start = time.perf_counter()
+    model = load_sentence_transformer(EMBEDDING_MODEL, backend, cache_dir=model_cache_dir(DB_DIR))
+    load_sec = time.perf_counter() - start
+    rss_model = current_rss_mb()
+
+    # Single-query latency, as seen by an interactive lookup (first call warms up the runtime)
+    texts = [normalize_text(item["query"]) for item in queries]
+    model.encode(texts[:1], convert_to_numpy=True)
+    samples = []
+    for _ in range(repeat):
+        for text in texts:
+            t0 = time.perf_counter_ns()
+            model.encode([text], convert_to_numpy=True)
+            samples.append(time.perf_counter_ns() - t0)
+
+    start = time.perf_counter()
+    doc_vectors = model.encode([normalize_text(m["full_text"]) for m in materials], batch_size=DOC_BATCH_SIZE,
+                               convert_to_numpy=True)
+    doc_sec = time.perf_counter() - start
+    query_vectors = model.encode(texts, convert_to_numpy=True)
+
+    # Cosine top-k over all material documents
+    doc_vectors = doc_vectors / np.maximum(np.linalg.norm(doc_vectors, axis=1, keepdims=True), 1e-12)
+    query_vectors = query_vectors / np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+    top = np.argsort(-(query_vectors @ doc_vectors.T), axis=1)[:, :max(RECALL_AT)]
+    un_ids = np.array([m["un_id"] for m in materials])
+
+    per_kind: Dict[str, Dict[str, List[float]]] = {}
+    for item, ranked in zip(queries, un_ids[top]):
+        expected = set(item["expected_un_ids"])
+        kind = per_kind.setdefault(item["kind"], {})
+        for k in RECALL_AT:
+            kind.setdefault(f"recall@{k}", []).append(float(any(un in expected for un in ranked[:k])))
+    overall: Dict[str, List[float]] = {}
+    for metrics in per_kind.values():
+        for metric, values in metrics.items():
+            overall.setdefault(metric, []).extend(values)
+
+    summarize = lambda metrics: {metric: round(float(np.mean(values)), 4) for metric, values in metrics.items()}
+    return {
+        "backend": backend,
+        "load_sec": round(load_sec, 3),
+        "rss_model_mb": round(rss_model - rss_before, 1) if rss_model is not None else None,
+        "rss_peak_mb": round(peak_rss_mb(), 1),
+        "query_latency": percentiles_ms(samples),
+        "docs_per_sec": round(len(materials) / doc_sec, 1) if doc_sec > 0 else None,
+        "dim": int(doc_vectors.shape[1]),
+        "recall": {"overall": summarize(overall), "by_kind": {k: summarize(m) for k, m in per_kind.items()}},
+    }
+
+
+def run_probe(backend: str, queries_path: str, repeat: int) -> Dict[str, Any]:
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--probe", backend,
+                           "--queries", queries_path, "--repeat", str(repeat)],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        # e.g. the ONNX backends need `pip install optimum[onnxruntime]`
+        return {"backend": backend, "error": (proc.stderr.strip().splitlines() or ["unknown error"])[-1]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def print_summary(results: List[Dict[str, Any]]):
+    print(f"\n{'後端':<10} {'載入(s)':>8} {'RSS增量(MB)':>11} {'峰值RSS(MB)':>11} {'p50(ms)':>8} {'p95(ms)':>8} "
+          f"{'docs/sec':>9} " + " ".join(f"{f'R@{k}':>6}" for k in RECALL_AT))
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<10} ✖ {r['error']}")
+            continue
+        rss = "n/a" if r["rss_model_mb"] is None else f"{r['rss_model_mb']:.1f}"
+        recall = " ".join(f"{r['recall']['overall'][f'recall@{k}']:>6.2f}" for k in RECALL_AT)
+        print(f"{r['backend']:<10} {r['load_sec']:>8.2f} {rss:>11} {r['rss_peak_mb']:>11.1f} "
+              f"{r['query_latency']['p50_ms']:>8.2f} {r['query_latency']['p95_ms']:>8.2f} {r['docs_per_sec']:>9.1f} {recall}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 embedding 後端的延遲 / 記憶體 / 召回率")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS, help="要比較的後端")
+    parser.add_argument("--queries", default=QUERIES_FILE, help="標註查詢集 (JSON)")
+    parser.add_argument("--repeat", type=int, default=3, help="查詢延遲量測的重複次數")
+    parser.add_argument("--output", help=f"結果 JSON 路徑 (預設存到 {RESULTS_DIR}/)")
+    parser.add_argument("--probe", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(probe(args.probe, args.queries, args.repeat)))
+        return
+
+    results = []
+    for backend in args.backends:
+        print(f"量測後端 '{backend}'...")
+        results.append(run_probe(backend, args.queries, args.repeat))
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "config": {"queries_file": args.queries, "repeat": args.repeat, "cpu_count": os.cpu_count(),
+                   "python": sys.version.split()[0]},
+        "backends": results,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"backends_{result['git_commit'] or 'nogit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print_summary(results)
+    print(f"\n結果已儲存至 '{output}'")
+
+
+if __name__ == "__main__":
+    main()
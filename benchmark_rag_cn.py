@@ -0,0 +1,453 @@
+"""
+ERG RAG 效能與準確度基準測試
+
+以標註好的查詢集 (benchmark_queries_cn.json: UN 編號、中英文名稱、口語化問題及預期指南編號) 量測:
+- 各階段延遲 (embedding / Chroma 查詢 / 篩選排序) 的 p50/p95/p99，分為空快取與熱快取
+- 不同並行度下的吞吐量 (queries/sec)
+- 冷啟動 (新行程) 與熱啟動 (同一行程重新初始化) 到完成第一筆查詢的時間
+- demo_rag_cn 的匯入時間 (最耗時的模組)，以及命令列 UN 編號查詢是否在啟動時間預算內完成
+- search_material 的 top-k 召回率與指南編號正確率
+
+結果存成 JSON，可與其他 commit 的結果比較:
+    python3 benchmark_rag_cn.py
+    python3 benchmark_rag_cn.py --concurrency 1 4 16 --repeat 5
+    python3 benchmark_rag_cn.py --compare benchmark_results/bench_<舊版>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+QUERIES_FILE = "benchmark_queries_cn.json"
+RESULTS_DIR = "benchmark_results"
+RECALL_AT = [1, 3, 5, 10, 20]
+PERCENTILES = [50, 95, 99]
+STAGES = ["embed", "query", "refine"]
+
+# Incident scripts call `demo_rag_cn.py <UN ID>` as a short-lived process; it must answer within this budget
+CLI_LOOKUP_BUDGET_SEC = 1.0
+IMPORT_TOP_MODULES = 8
+
+# Metrics shown by --compare: (section path, label, True if higher is better)
+COMPARE_METRICS = [
+    (("startup", "cold_sec"), "冷啟動 (秒)", False),
+    (("startup", "warm_sec"), "熱啟動 (秒)", False),
+    (("startup", "import_sec"), "匯入時間 (秒)", False),
+    (("startup", "cli_lookup_sec"), "CLI UN 查詢 (秒)", False),
+    (("latency", "cold_cache", "total", "p50_ms"), "空快取 p50 (ms)", False),
+    (("latency", "cold_cache", "total", "p95_ms"), "空快取 p95 (ms)", False),
+    (("latency", "warm_cache", "total", "p50_ms"), "熱快取 p50 (ms)", False),
+    (("latency", "warm_cache", "total", "p95_ms"), "熱快取 p95 (ms)", False),
+    (("accuracy", "overall", "recall@1"), "recall@1", True),
+    (("accuracy", "overall", "recall@5"), "recall@5", True),
+    (("accuracy", "overall", "guide_accuracy"), "指南正確率", True),
+]
+
+
+class StageTimer:
+    """Per-thread nanosecond accumulators, so stage times stay correct when queries run concurrently."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.spans = {stage: 0 for stage in STAGES}
+
+    def add(self, stage: str, ns: int):
+        spans = getattr(self._local, "spans", None)
+        if spans is not None:
+            spans[stage] += ns
+
+    def spans(self) -> Dict[str, int]:
+        return dict(self._local.spans)
+
+
+class TimedEmbedding:
+    """Wraps ERGEngine.ef and records the time spent computing query embeddings."""
+
+    def __init__(self, ef, timer: StageTimer):
+        self._ef = ef
+        self._timer = timer
+
+    def __call__(self, texts):
+        start = time.perf_counter_ns()
+        try:
+            return self._ef(texts)
+        finally:
+            self._timer.add("embed", time.perf_counter_ns() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._ef, name)
+
+
+class TimedCollection:
+    """Wraps the Chroma collection and records the time spent in vector queries."""
+
+    def __init__(self, collection, timer: StageTimer):
+        self._collection = collection
+        self._timer = timer
+
+    def query(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return self._collection.query(*args, **kwargs)
+        finally:
+            self._timer.add("query", time.perf_counter_ns() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def load_queries(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["queries"]
+
+
+def percentiles_ms(samples_ns: List[int]) -> Dict[str, float]:
+    if not samples_ns:
+        return {}
+    values = np.percentile(np.asarray(samples_ns, dtype=np.float64) / 1e6, PERCENTILES)
+    summary = {f"p{p}_ms": round(float(v), 3) for p, v in zip(PERCENTILES, values)}
+    summary["mean_ms"] = round(float(np.mean(samples_ns)) / 1e6, 3)
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_rag(cache: bool):
+    """Build the retrieval engine without its load messages; cache=False starts from an empty in-memory query cache."""
+    from rag_engine import ERGEngine, EMBEDDING_CACHE_DIR
+    with contextlib.redirect_stderr(io.StringIO()):
+        return ERGEngine(embedding_cache_dir=EMBEDDING_CACHE_DIR if cache else None)
+
+
+def startup_probe(query: str):
+    """Run in a fresh process by measure_startup(): time from import to the first answered query."""
+    start = time.perf_counter()
+    rag = create_rag(cache=False)
+    ready = time.perf_counter()
+    rag.find_material(query)
+    done = time.perf_counter()
+    print(json.dumps({"init_sec": ready - start, "first_query_sec": done - ready, "total_sec": done - start}))
+
+
+def measure_startup(rag_factory, query: str, samples: int) -> Dict[str, Any]:
+    cold = []
+    for _ in range(samples):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--startup-probe", query],
+                              capture_output=True, text=True, check=True)
+        cold.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    # Warm start: modules and the embedding model are already loaded in this process
+    start = time.perf_counter()
+    rag = rag_factory()
+    ready = time.perf_counter()
+    rag.find_material(query)
+    done = time.perf_counter()
+
+    return {
+        "cold_sec": round(float(np.median([c["total_sec"] for c in cold])), 3),
+        "cold_init_sec": round(float(np.median([c["init_sec"] for c in cold])), 3),
+        "cold_first_query_sec": round(float(np.median([c["first_query_sec"] for c in cold])), 3),
+        "warm_sec": round(done - start, 3),
+        "warm_init_sec": round(ready - start, 3),
+        "warm_first_query_sec": round(done - ready, 3),
+        "samples": samples,
+    }
+
+
+def measure_import_time(samples: int) -> Dict[str, Any]:
+    """
+    `python -X importtime -c "import demo_rag_cn"` in fresh processes: total import time and the slowest
+    top-level imports (cumulative, from the median sample).
+    """
+    runs = []
+    for _ in range(samples):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import demo_rag_cn"],
+                              capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        # "import time:  self [us] | cumulative | imported package": children are listed (indented) before
+        # their parent, so the direct imports of demo_rag_cn are the one-level entries just above its line
+        modules, children = {}, {}
+        for line in proc.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) != 3 or not parts[0].startswith("import time:") or not parts[1].strip().isdigit():
+                continue
+            name = parts[2][1:]
+            indent = len(name) - len(name.lstrip(" "))
+            if indent == 2:
+                children[name.strip()] = int(parts[1]) / 1e6
+            elif indent == 0:
+                if name.strip() == "demo_rag_cn":
+                    modules = dict(children, demo_rag_cn=int(parts[1]) / 1e6)
+                children = {}
+        runs.append(modules)
+
+    runs.sort(key=lambda modules: modules.get("demo_rag_cn", 0.0))
+    median = runs[len(runs) // 2]
+    top = sorted(((name, sec) for name, sec in median.items() if name != "demo_rag_cn"), key=lambda item: -item[1])
+    return {
+        "import_sec": round(median.get("demo_rag_cn", 0.0), 3),
+        "import_top": [{"module": name, "sec": round(sec, 3)} for name, sec in top[:IMPORT_TOP_MODULES]],
+    }
+
+
+def measure_cli_lookup(query: str, samples: int) -> Dict[str, Any]:
+    """Wall time of `demo_rag_cn.py --json <query>` in a fresh process, as run by incident scripts."""
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(script_dir, "demo_rag_cn.py"), "--json", query],
+                       capture_output=True, text=True, check=True, cwd=script_dir)
+        times.append(time.perf_counter() - start)
+    cli_sec = float(np.median(times))
+    return {
+        "cli_lookup_query": query,
+        "cli_lookup_sec": round(cli_sec, 3),
+        "cli_budget_sec": CLI_LOOKUP_BUDGET_SEC,
+        "cli_within_budget": cli_sec <= CLI_LOOKUP_BUDGET_SEC,
+    }
+
+
+def find_material(rag, item: Dict[str, Any], **kwargs):
+    """Questions take the same path as answer_question / unified_query: mentioned names are extracted first."""
+    return rag.find_material(item["query"], extract_mentions=item["kind"] == "question", **kwargs)
+
+
+def run_pass(rag, timer: StageTimer, queries: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+    """One sequential pass over the query set; returns per-stage samples in nanoseconds."""
+    samples = {stage: [] for stage in STAGES + ["total"]}
+    for item in queries:
+        timer.reset()
+        start = time.perf_counter_ns()
+        find_material(rag, item)
+        total = time.perf_counter_ns() - start
+
+        spans = timer.spans()
+        # Everything that is not embedding or vector search: index lookup, BM25 fusion, refinement
+        spans["refine"] = max(0, total - spans["embed"] - spans["query"])
+        for stage in STAGES:
+            samples[stage].append(spans[stage])
+        samples["total"].append(total)
+    return samples
+
+
+def measure_latency(rag, timer: StageTimer, queries: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    # First pass: empty query-embedding cache. Later passes: every query embedding is cached.
+    cold = run_pass(rag, timer, queries)
+    warm = {stage: [] for stage in cold}
+    for _ in range(repeat):
+        for stage, values in run_pass(rag, timer, queries).items():
+            warm[stage].extend(values)
+
+    return {
+        "cold_cache": {stage: percentiles_ms(values) for stage, values in cold.items()},
+        "warm_cache": {stage: percentiles_ms(values) for stage, values in warm.items()},
+    }
+
+
+def measure_throughput(rag, queries: List[Dict[str, Any]], levels: List[int], repeat: int) -> List[Dict[str, Any]]:
+    items = queries * max(1, repeat)
+    results = []
+    for threads in levels:
+        latencies: List[int] = []
+
+        def timed_query(item: Dict[str, Any]):
+            start = time.perf_counter_ns()
+            find_material(rag, item)
+            return time.perf_counter_ns() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies.extend(pool.map(timed_query, items))
+        elapsed = time.perf_counter() - start
+
+        results.append({"threads": threads, "queries": len(items), "qps": round(len(items) / elapsed, 1),
+                        **percentiles_ms(latencies)})
+    return results
+
+
+def measure_accuracy(rag, queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    per_kind: Dict[str, Dict[str, List[float]]] = {}
+    failures = []
+
+    for item in queries:
+        hit = find_material(rag, item, include_candidates=True)
+        expected = set(item["expected_un_ids"])
+        ranked = [str(meta["un_id"]) for meta in hit.candidates] if hit else []
+        guide = hit.guide_no if hit else None
+
+        scores = {f"recall@{k}": float(any(un in expected for un in ranked[:k])) for k in RECALL_AT}
+        if item.get("expected_guide"):
+            scores["guide_accuracy"] = float(guide is not None and
+                                             guide.rstrip("P") == str(item["expected_guide"]).rstrip("P"))
+
+        kind = per_kind.setdefault(item["kind"], {})
+        for metric, value in scores.items():
+            kind.setdefault(metric, []).append(value)
+
+        if not scores["recall@1"]:
+            failures.append({
+                "query": item["query"],
+                "expected_un_ids": item["expected_un_ids"],
+                "got": hit.name if hit else None,
+                "got_un_id": ranked[0] if ranked else None,
+                "match_method": hit.match_method if hit else None,
+            })
+
+    overall: Dict[str, List[float]] = {}
+    for kind in per_kind.values():
+        for metric, values in kind.items():
+            overall.setdefault(metric, []).extend(values)
+
+    def summarize(metrics: Dict[str, List[float]]) -> Dict[str, float]:
+        summary = {metric: round(float(np.mean(values)), 4) for metric, values in metrics.items()}
+        summary["queries"] = len(next(iter(metrics.values()), []))
+        return summary
+
+    return {
+        "overall": summarize(overall),
+        "by_kind": {kind: summarize(metrics) for kind, metrics in per_kind.items()},
+        "failures": failures,
+    }
+
+
+def lookup(result: Dict[str, Any], path) -> Optional[float]:
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def compare(current: Dict[str, Any], baseline_path: str):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    print(f"\n與基準比較: {baseline_path} (commit {baseline.get('git_commit')}) -> 目前 (commit {current.get('git_commit')})")
+    for path, label, higher_is_better in COMPARE_METRICS:
+        old, new = lookup(baseline, path), lookup(current, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = (new > old) == higher_is_better if new != old else None
+        mark = "" if better is None else (" ✔" if better else " ✖")
+        print(f"  {label:<16} {old:>10.3f} -> {new:>10.3f} ({change:+.1f}%){mark}")
+
+
+def print_summary(result: Dict[str, Any]):
+    startup = result["startup"]
+    if startup:
+        print(f"\n啟動時間: 冷啟動 {startup['cold_sec']:.3f}s, 熱啟動 {startup['warm_sec']:.3f}s")
+        print(f"匯入時間: {startup['import_sec']:.3f}s ("
+              + ", ".join(f"{m['module']} {m['sec']:.3f}s" for m in startup['import_top']) + ")")
+        status = "✔" if startup['cli_within_budget'] else "✖ 超出"
+        print(f"CLI UN 查詢 ('{startup['cli_lookup_query']}'): {startup['cli_lookup_sec']:.3f}s "
+              f"(預算 {startup['cli_budget_sec']:.1f}s {status})")
+
+    for phase, label in (("cold_cache", "空快取"), ("warm_cache", "熱快取")):
+        print(f"\n各階段延遲 ({label}):")
+        for stage, stats in result["latency"][phase].items():
+            print(f"  {stage:<7} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms")
+
+    print("\n吞吐量:")
+    for row in result["throughput"]:
+        print(f"  {row['threads']:>3} 執行緒: {row['qps']:>8.1f} queries/sec (p95 {row['p95_ms']:.3f} ms)")
+
+    accuracy = result["accuracy"]
+    print("\n準確度:")
+    for kind, metrics in [("overall", accuracy["overall"])] + sorted(accuracy["by_kind"].items()):
+        recall = ", ".join(f"{metric} {metrics[metric]:.2f}" for metric in (f"recall@{k}" for k in RECALL_AT))
+        print(f"  {kind:<9} ({metrics['queries']} 筆) {recall}, 指南 {metrics.get('guide_accuracy', 0.0):.2f}")
+    for failure in accuracy["failures"]:
+        print(f"  ✖ '{failure['query']}': 預期 UN {'/'.join(failure['expected_un_ids'])}，"
+              f"得到 {failure['got']} ({failure['match_method']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ERG RAG 延遲 / 吞吐量 / 召回率基準測試")
+    parser.add_argument("--queries", default=QUERIES_FILE, help="標註查詢集 (JSON)")
+    parser.add_argument("--repeat", type=int, default=3, help="熱快取延遲與吞吐量測試的重複次數")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="吞吐量測試的並行執行緒數")
+    parser.add_argument("--startup-samples", type=int, default=1, help="冷啟動量測次數 (0 = 略過啟動時間量測)")
+    parser.add_argument("--output", help=f"結果 JSON 路徑 (預設存到 {RESULTS_DIR}/)")
+    parser.add_argument("--compare", help="與先前的結果 JSON 比較")
+    parser.add_argument("--startup-probe", metavar="QUERY", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_probe:
+        startup_probe(args.startup_probe)
+        return
+
+    queries = load_queries(args.queries)
+    print(f"載入 {len(queries)} 筆標註查詢 ({args.queries})")
+
+    startup = {}
+    if args.startup_samples > 0:
+        print("量測冷/熱啟動時間...")
+        startup = measure_startup(lambda: create_rag(cache=False), queries[0]["query"], args.startup_samples)
+        startup.update(measure_import_time(args.startup_samples))
+        un_query = next((q["query"] for q in queries if q["kind"] == "un_id"), queries[0]["query"])
+        startup.update(measure_cli_lookup(un_query, args.startup_samples))
+
+    # A fresh instance with an empty in-memory cache, so the first latency pass really embeds every query
+    rag = create_rag(cache=False)
+    timer = StageTimer()
+    rag.ef = TimedEmbedding(rag.ef, timer)
+    rag.partitions = {lang: TimedCollection(collection, timer) for lang, collection in rag.partitions.items()}
+
+    print("量測各階段延遲...")
+    latency = measure_latency(rag, timer, queries, args.repeat)
+    print("量測吞吐量...")
+    throughput = measure_throughput(rag, queries, args.concurrency, args.repeat)
+    print("量測召回率...")
+    accuracy = measure_accuracy(rag, queries)
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "config": {
+            "queries_file": args.queries,
+            "query_count": len(queries),
+            "repeat": args.repeat,
+            "concurrency": args.concurrency,
+            "cpu_count": os.cpu_count(),
+            "python": sys.version.split()[0],
+        },
+        "startup": startup,
+        "latency": latency,
+        "throughput": throughput,
+        "accuracy": accuracy,
+    }
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"bench_{result['git_commit'] or 'nogit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print_summary(result)
+    print(f"\n結果已儲存至 '{output}'")
+
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+向量查詢實作基準測試 (Chroma / 匯出的 flat 精確搜尋 / 匯出的 HNSW 索引)
+
+以 benchmark_queries_cn.json 的查詢 embedding，對每種實作量測:
+- 單筆向量查詢延遲 p50/p95/p99 (物質語意搜尋: where type=material，與不加過濾條件)
+- 相對於精確搜尋 (Chroma 內的 float32 向量逐一計算) 的 recall@k
+- HNSW 依 ef (搜尋廣度) 掃描，呈現召回率與延遲的取捨
+
+需先執行 build_rag_db_cn.py 匯出向量 (erg_chroma_db_cn/vector_store/；HNSW 需安裝 hnswlib):
+    python3 benchmark_vector_stores.py
+    python3 benchmark_vector_stores.py --ef 16 32 64 128 --repeat 5
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any
+
+import numpy as np
+
+from benchmark_rag_cn import QUERIES_FILE, RESULTS_DIR, load_queries, percentiles_ms, git_commit
+from vector_store import (FlatVectorStore, HNSWVectorStore, ChromaVectorStore, VECTOR_STORE_DIRNAME,
+                          EXPORT_PAGE_SIZE, collection_space)
+
+DEFAULT_EF = [16, 32, 64, 128, 256]
+# (label, where clause): the semantic material search and an unfiltered search
+WORKLOADS = [("material", {"type": "material"}), ("all", None)]
+
+
+def exact_store(collection) -> FlatVectorStore:
+    """Ground truth: the float32 vectors stored in Chroma, searched exactly."""
+    ids, metadatas, documents, blocks = [], [], [], []
+    for offset in range(0, collection.count(), EXPORT_PAGE_SIZE):
+        page = collection.get(include=["embeddings", "metadatas", "documents"], limit=EXPORT_PAGE_SIZE, offset=offset)
+        ids += page["ids"]
+        metadatas += page["metadatas"]
+        documents += page["documents"]
+        blocks.append(np.asarray(page["embeddings"], dtype=np.float32))
+    vectors = np.concatenate(blocks)
+    space = collection_space(collection)
+    if space == "cosine":
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return FlatVectorStore(vectors, ids, metadatas, documents, space)
+
+
+def measure(store, embeddings: np.ndarray, truth: Dict[str, List[List[str]]], k: int, repeat: int) -> Dict[str, Any]:
+    result = {}
+    for label, where in WORKLOADS:
+        store.query(embeddings[:1].tolist(), n_results=k, where=where) # Warm-up (lazy masks, caches)
+        samples = []
+        recalls = []
+        for _ in range(repeat):
+            for row, expected in zip(embeddings, truth[label]):
+                t0 = time.perf_counter_ns()
+                found = store.query([row.tolist()], n_results=k, where=where)["ids"][0]
+                samples.append(time.perf_counter_ns() - t0)
+                recalls.append(len(set(found) & set(expected)) / max(len(expected), 1))
+        result[label] = {"latency": percentiles_ms(samples), f"recall@{k}": round(float(np.mean(recalls)), 4)}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較向量查詢實作的召回率 / 延遲")
+    parser.add_argument("--queries", default=QUERIES_FILE, help="標註查詢集 (JSON)")
+    parser.add_argument("--ef", type=int, nargs="+", default=DEFAULT_EF, help="HNSW 搜尋廣度 (ef) 掃描值")
+    parser.add_argument("--k", type=int, default=20, help="每筆查詢取回的結果數")
+    parser.add_argument("--repeat", type=int, default=3, help="延遲量測的重複次數")
+    parser.add_argument("--output", help=f"結果 JSON 路徑 (預設存到 {RESULTS_DIR}/)")
+    args = parser.parse_args()
+
+    from rag_engine import ERGEngine, DB_DIR, COLLECTION_CN
+    from response_cache import DBVersion
+    with contextlib.redirect_stderr(io.StringIO()):
+        engine = ERGEngine(embedding_cache_dir=None, vector_store="chroma")
+        collection = engine.partitions["cn"].collection
+    queries = load_queries(args.queries)
+    embeddings = np.asarray(engine.ef([item["query"] for item in queries]), dtype=np.float32)
+
+    print("計算精確搜尋結果 (ground truth)...")
+    exact = exact_store(collection)
+    truth = {label: exact.query(embeddings.tolist(), n_results=args.k, where=where)["ids"] for label, where in WORKLOADS}
+
+    store_dir = os.path.join(DB_DIR, VECTOR_STORE_DIRNAME)
+    version = DBVersion(DB_DIR).current()
+    configs = [("chroma", lambda: ChromaVectorStore(collection)),
+               ("flat", lambda: FlatVectorStore.load(store_dir, COLLECTION_CN, version))]
+    configs += [(f"hnsw ef={ef}", lambda ef=ef: HNSWVectorStore.load(store_dir, COLLECTION_CN, version, ef=ef))
+                for ef in args.ef]
+
+    results = []
+    for label, load in configs:
+        print(f"量測 '{label}'...")
+        start = time.perf_counter()
+        try:
+            store = load()
+        except (ImportError, OSError, ValueError) as e:
+            # No export for this DB version, or hnswlib missing
+            results.append({"store": label, "error": str(e)})
+            continue
+        entry = {"store": label, "load_sec": round(time.perf_counter() - start, 3)}
+        entry.update(measure(store, embeddings, truth, args.k, args.repeat))
+        results.append(entry)
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": git_commit(),
+        "config": {"queries_file": args.queries, "k": args.k, "repeat": args.repeat, "rows": exact.count(),
+                   "space": exact.space, "python": sys.version.split()[0]},
+        "stores": results,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"vector_stores_{result['git_commit'] or 'nogit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print_summary(results, args.k)
+    print(f"\n結果已儲存至 '{output}'")
+
+
+def print_summary(results: List[Dict[str, Any]], k: int):
+    header = " ".join(f"{f'{label} p50':>13} {f'{label} p95':>13} {f'R@{k}':>6}" for label, _ in WORKLOADS)
+    print(f"\n{'實作':<14} {'載入(s)':>8} {header}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['store']:<14} ✖ {r['error']}")
+            continue
+        cells = " ".join(f"{r[label]['latency']['p50_ms']:>13.3f} {r[label]['latency']['p95_ms']:>13.3f} "
+                         f"{r[label][f'recall@{k}']:>6.3f}" for label, _ in WORKLOADS)
+        print(f"{r['store']:<14} {r['load_sec']:>8.3f} {cells}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import deque
+import multiprocessing
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Callable
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from instrumentation import tracer
+
+DEFAULT_BATCH_SIZE = 256
+# Embedded batches waiting for the writer; bounds memory when Chroma writes are slower than embedding
+WRITE_QUEUE_SIZE = 4
+
+# Per-process model handle for pool workers (loaded once by _init_worker)
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads_per_worker: int, backend: str, model_cache_dir: Optional[str]):
+    global _worker_model
+    from embedding_backends import load_sentence_transformer
+
+    # Split the cores between workers instead of letting every process grab all of them
+    # (torch threads for the torch backend, intra-op threads of the ONNX session otherwise)
+    _worker_model = load_sentence_transformer(model_name, backend, cache_dir=model_cache_dir,
+                                              threads=threads_per_worker)
+
+
+def _embed_in_worker(texts: List[str]) -> np.ndarray:
+    # Same settings as chromadb's SentenceTransformerEmbeddingFunction
+    return _worker_model.encode(texts, convert_to_numpy=True, normalize_embeddings=False).astype(np.float32)
+
+
+def batched(records: Iterable[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ProgressReporter:
+    """Prints throughput (docs/sec) for one pipeline stage, at most once per interval."""
+
+    def __init__(self, stage: str, interval: float = 2.0):
+        self.stage = stage
+        self.interval = interval
+        self.count = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+        self._lock = threading.Lock()
+
+    def update(self, n: int):
+        with self._lock:
+            self.count += n
+            now = time.perf_counter()
+            if now - self._last_report >= self.interval:
+                self._last_report = now
+                print(f"  [{self.stage}] {self.count} docs, {self.rate():.1f} docs/sec")
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.start
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return f"[{self.stage}] {self.count} docs in {time.perf_counter() - self.start:.1f}s ({self.rate():.1f} docs/sec)"
+
+
+class EmbeddingPipeline:
+    """
+    Streams records through three overlapping stages:
+    record generator -> batched embedding (process pool or in-process) -> Chroma upsert (writer thread).
+    Each record is a dict with "id", "document" and "metadata".
+    """
+
+    def __init__(self, collection, model_name: str, embedding_function: Optional[Callable] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 0, backend: str = "torch",
+                 model_cache_dir: Optional[str] = None):
+        self.collection = collection
+        self.model_name = model_name
+        self.backend = backend
+        self.model_cache_dir = model_cache_dir
+        self.embedding_function = embedding_function
+        self.batch_size = batch_size
+        self.workers = workers
+
+        self.embed_progress = ProgressReporter("embed")
+        self.write_progress = ProgressReporter("write")
+        self._write_queue: "queue.Queue" = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._write_error: Optional[BaseException] = None
+
+    def _writer(self):
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                return
+            if self._write_error is not None:
+                continue # Drain the queue so the producer never blocks after a failure
+            batch, embeddings = item
+            try:
+                with tracer.span("pipeline.write", size=len(batch)):
+                    self.collection.upsert(
+                        ids=[r["id"] for r in batch],
+                        documents=[r["document"] for r in batch],
+                        metadatas=[r["metadata"] for r in batch],
+                        embeddings=embeddings
+                    )
+                self.write_progress.update(len(batch))
+            except BaseException as e:
+                self._write_error = e
+
+    def _submit(self, pool: Optional[ProcessPoolExecutor], batch: List[Dict[str, Any]]) -> Future:
+        texts = [normalize_text(r["document"]) for r in batch]
+        if pool is not None:
+            return pool.submit(_embed_in_worker, texts)
+
+        future: Future = Future()
+        with tracer.span("pipeline.embed", size=len(batch)):
+            future.set_result(np.asarray(self.embedding_function(texts), dtype=np.float32))
+        return future
+
+    def run(self, records: Iterable[Dict[str, Any]]) -> int:
+        writer = threading.Thread(target=self._writer, name="chroma-writer", daemon=True)
+        writer.start()
+
+        pool = None
+        if self.workers > 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+            # spawn: forking a process that already loaded torch can deadlock its thread pools
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, threads_per_worker, self.backend, self.model_cache_dir)
+            )
+
+        # Keep a bounded number of batches in flight so the generator is consumed lazily
+        max_in_flight = max(2, self.workers * 2)
+        in_flight: "deque" = deque()
+        total = 0
+
+        def drain_one():
+            batch, future = in_flight.popleft()
+            # With worker processes this is the time the main thread waits for an embedded batch
+            with tracer.span("pipeline.wait_embedding", size=len(batch)):
+                embeddings = future.result()
+            self.embed_progress.update(len(batch))
+            self._write_queue.put((batch, embeddings))
+
+        try:
+            for batch in batched(records, self.batch_size):
+                total += len(batch)
+                in_flight.append((batch, self._submit(pool, batch)))
+                while len(in_flight) >= max_in_flight:
+                    drain_one()
+            while in_flight:
+                drain_one()
+        finally:
+            self._write_queue.put(None)
+            writer.join()
+            if pool is not None:
+                pool.shutdown()
+
+        if self._write_error is not None:
+            raise self._write_error
+
+        print(f"  {self.embed_progress.summary()}")
+        print(f"  {self.write_progress.summary()}")
+        return total
@@ -1,19 +1,61 @@
 import chromadb
-from chromadb.utils import embedding_functions
+import argparse
+import hashlib
+import itertools
 import json
 import re
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from material_index import MaterialIndexWriter, INDEX_FILENAME, ALIAS_SEPARATOR, split_bilingual_name, material_names
+from hazard_table import HazardTable, HAZARD_TABLE_FILENAME
+from lexical_index import LexicalIndexBuilder, LEXICAL_INDEX_FILENAME, material_lexical_text
+from entity_extractor import EntityExtractorBuilder, ENTITY_EXTRACTOR_FILENAME
+from embedding_cache import CachedEmbeddingFunction
+from embedding_backends import (BackendEmbeddingFunction, BACKENDS, DEFAULT_BACKEND, METADATA_BACKEND,
+                                METADATA_MODEL, embedding_id, model_cache_dir, recorded_backend)
+from build_pipeline import EmbeddingPipeline, DEFAULT_BATCH_SIZE
+from response_cache import write_db_version, clear_db_version
+from response_cards import ResponseCardWriter, RESPONSE_CARDS_FILENAME
+from vector_store import (export_collection, VECTOR_STORE_DIRNAME, VECTOR_DTYPES, DEFAULT_VECTOR_DTYPE,
+                          DEFAULT_HNSW_M, DEFAULT_HNSW_EF_CONSTRUCTION)
+from guide_sections import split_guide_sections
+from instrumentation import tracer, configure_from_env, HistogramExporter
 
 # Configuration
 DATA_DIR = "Prepared Data_CN"
 DB_DIR = "erg_chroma_db_cn" # Separate DB for Chinese
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
 INDEX_FILE = os.path.join(DATA_DIR, "ERG_Index_Processed_CN.txt")
 GUIDES_FILE = os.path.join(DATA_DIR, "ERG_Guides_Cleaned_CN.txt")
 GREEN_TABLE_1 = os.path.join(DATA_DIR, "green_table_1_CN.json")
 GREEN_TABLE_2 = os.path.join(DATA_DIR, "green_table_2_CN.json")
 GREEN_TABLE_3 = os.path.join(DATA_DIR, "green_table_3_CN.json")
 
+# English corpus, indexed into its own partition by --bilingual builds.
+# Its green tables hold the same numbers as the CN ones, so the shared hazard table covers both.
+EN_DATA_DIR = "Prepared Data"
+EN_INDEX_FILE = os.path.join(EN_DATA_DIR, "ERG_Index_Processed.txt")
+EN_GUIDES_FILE = os.path.join(EN_DATA_DIR, "ERG_Guides_Cleaned.txt")
+
+# Language partitions (demo_rag_cn.py routes each query to one of them)
+COLLECTION_CN = "erg_cn"
+COLLECTION_EN = "erg_en"
+
+# Existing ids / content hashes are read from Chroma in pages of this size during a sync
+SYNC_PAGE_SIZE = 1000
+
+# Index line: "UN ID: 1005 corresponds to Material: Name (CN Name). Emergency Response Guide Number: 125. ..."
+# (robust to spaces); flags are recognised by EN and CN keywords
+INDEX_LINE_PATTERN = re.compile(
+    r"UN ID:\s*(\d{4})\s*corresponds to Material:\s*(.+?)\.\s*Emergency Response Guide Number:\s*(\d+[A-Z]?)\.")
+INDEX_FLAG_PATTERN = re.compile(r"(?P<tih>\*\*\[TIH Material\]\*\*|TIH 物質)|(?P<polymerization>violent polymerization|劇烈聚合反應)")
+# Lines of one UN ID + guide are embedded as one document: the other names are listed after the first one
+ALIAS_CLAUSE = "; also listed as: "
+# Guide file: a line "GUIDE" followed by the guide number line starts each guide
+GUIDE_MARKER = "GUIDE\n"
+GUIDE_NO_PATTERN = re.compile(r'^\d+[A-Z]?$')
+
 # Ensure DB dir exists (chroma creates it, but good to be explicit for logging)
 os.makedirs(DB_DIR, exist_ok=True)
 
@@ -21,199 +63,347 @@ def load_json(path: str) -> Dict:
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
-def parse_erg_index(path: str) -> List[Dict[str, Any]]:
-    materials = []
-    # Pattern: UN ID: 1005 corresponds to Material: Name (CN Name). Emergency Response Guide Number: 125. ...
-    # Be robust to spaces
-    pattern = re.compile(r"UN ID:\s*(\d{4})\s*corresponds to Material:\s*(.+?)\.\s*Emergency Response Guide Number:\s*(\d+[A-Z]?)\.")
-    
+def iter_erg_index(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield one material per index line; only the current line is held in memory."""
     with open(path, 'r', encoding='utf-8') as f:
         for line in f:
             line = line.strip()
             if not line:
                 continue
             
-            match = pattern.search(line)
+            match = INDEX_LINE_PATTERN.search(line)
             if match:
                 un_id, name, guide_no = match.groups()
                 
-                # Check for flags in the text (both EN and CN keywords)
-                is_tih = "**[TIH Material]**" in line or "TIH 物質" in line
-                is_polymerization = "violent polymerization" in line or "劇烈聚合反應" in line
+                # Check for flags in the text (both EN and CN keywords), one scan for all of them
+                flags = {flag.lastgroup for flag in INDEX_FLAG_PATTERN.finditer(line)}
                 
-                materials.append({
+                yield {
                     "un_id": un_id,
                     "name": name.strip(),
                     "guide_no": guide_no,
-                    "is_tih": is_tih,
-                    "is_polymerization": is_polymerization,
+                    "is_tih": "tih" in flags,
+                    "is_polymerization": "polymerization" in flags,
                     "full_text": line # Store the original line as the document text
-                })
-    return materials
+                }
 
-def enrich_materials(materials: List[Dict], gt1: Dict, gt2: Dict, gt3_lookup: Dict) -> List[Dict]:
-    enriched = []
+def parse_erg_index(path: str) -> List[Dict[str, Any]]:
+    return list(iter_erg_index(path))
+
+def group_materials(materials: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """
+    Merge consecutive index lines with the same UN ID and guide (alternative names of one material, with
+    identical flags and green-table data) into one material: the first name is canonical, the others become
+    'aliases'. The index is sorted by UN ID, so only one group is held in memory.
+    """
+    lines = 0
+    groups = 0
+    for _, group in itertools.groupby(materials, key=lambda mat: (mat['un_id'], mat['guide_no'])):
+        group = list(group)
+        lines += len(group)
+        groups += 1
+        mat = group[0]
+        mat['aliases'] = [name for name in dict.fromkeys(line['name'] for line in group) if name != mat['name']]
+        mat['is_tih'] = any(line['is_tih'] for line in group)
+        mat['is_polymerization'] = any(line['is_polymerization'] for line in group)
+        mat['full_text'] = material_document(mat)
+        yield mat
+
+    print(f"Grouped {lines} index lines into {groups} materials ({lines - groups} aliases).")
+
+def material_document(mat: Dict[str, Any]) -> str:
+    # Canonical index line with the aliases inserted after the name, so the group is embedded once
+    if not mat['aliases']:
+        return mat['full_text']
+    name_end = INDEX_LINE_PATTERN.search(mat['full_text']).end(2)
+    return f"{mat['full_text'][:name_end]}{ALIAS_CLAUSE}{'; '.join(mat['aliases'])}{mat['full_text'][name_end:]}"
+
+def enrich_materials(materials: Iterable[Dict], gt1: Dict, gt2: Dict, gt3_lookup: Dict) -> Iterator[Dict]:
+    # Distances and water-reactive gases live in the numeric hazard table (hazard_table.py);
+    # only the flags used for filtering stay on the material records.
+    total = 0
     gt1_cnt = 0
     gt2_cnt = 0
     gt3_cnt = 0
 
     for mat in materials:
         un_id = mat['un_id']
-        
-        # Initialize defaults for Green Table 1 data
-        mat['small_iso'] = ''
-        mat['small_day'] = ''
-        mat['small_night'] = ''
-        mat['large_iso'] = ''
-        mat['large_day'] = ''
-        mat['large_night'] = ''
-        mat['large_note'] = '' # For "Refer to Table 3"
-        mat['table3_content'] = '' # New field for Table 3
-        
-        # Add Green Table 1 info (Isolation Distances)
-        if un_id in gt1:
-            data = gt1[un_id]
-            gt1_cnt += 1
-            
-            # Small Spill
-            if 'small_spill' in data:
-                ss = data['small_spill']
-                mat['small_iso'] = ss.get('isolation_distance', '')
-                mat['small_day'] = ss.get('protect_day', '')
-                mat['small_night'] = ss.get('protect_night', '')
-                
-            # Large Spill
-            if 'large_spill' in data:
-                ls = data['large_spill']
-                if "note" in ls:
-                    mat['large_note'] = ls['note']
-                else:
-                    mat['large_iso'] = ls.get('isolation_distance', '')
-                    mat['large_day'] = ls.get('protect_day', '')
-                    mat['large_night'] = ls.get('protect_night', '')
-        
-        # Add Green Table 2 info (Water Reactive)
-        if un_id in gt2:
-            mat['is_water_reactive'] = True
-            # Assuming GT2 structure is list of objects
-            # Format: [{"material_name": "...", "tih_gases": ["gas1", "gas2"]}]
-            # Or dict? Check GT2 format. Usually list for same UN ID because multiple materials map to one UN.
-            # But here un_id key maps to list.
-            extracted_gases = []
-            if isinstance(gt2[un_id], list):
-                for entry in gt2[un_id]:
-                    extracted_gases.extend(entry.get('tih_gases', []))
-            
-            mat['water_reactive_gases'] = ", ".join(list(set(extracted_gases)))
-            gt2_cnt += 1
-        else:
-            mat['is_water_reactive'] = False
-            mat['water_reactive_gases'] = ""
-            
-        # Add Green Table 3 info (Detailed Large Spills)
-        if un_id in gt3_lookup:
-            t3_data = gt3_lookup[un_id]
-            gt3_cnt += 1
-            
-            # Format Table 3 data as text to append to full_text
-            # Use Chinese labels if possible or just structure clearly
-            t3_text = f"\n[詳細大量洩漏資料 (表3) 針對 {mat['name']}]\n"
-            for container in t3_data.get('containers', []):
-                ctype = container.get('type', 'Unknown Container')
-                init_iso = container.get('initial_isolation_m', '?')
-                
-                day = container.get('day_km', {})
-                night = container.get('night_km', {})
-                
-                t3_text += f"- 容器類型 (Container): {ctype}\n"
-                t3_text += f"  初始隔離 (Initial Isolation): {init_iso} meters\n"
-                t3_text += f"  日間防護距離 (Protective Distance Day): 低風 (Low Wind): {day.get('low_wind','?')}km, 中風 (Moderate): {day.get('moderate_wind','?')}km, 強風 (High): {day.get('high_wind','?')}km\n"
-                t3_text += f"  夜間防護距離 (Protective Distance Night): 低風 (Low Wind): {night.get('low_wind','?')}km, 中風 (Moderate): {night.get('moderate_wind','?')}km, 強風 (High): {night.get('high_wind','?')}km\n"
-            
-            mat['table3_content'] = t3_text
-            mat['full_text'] += t3_text # Append to document content for retrieval
+        total += 1
+        gt1_cnt += un_id in gt1
+        gt3_cnt += un_id in gt3_lookup
 
-        enriched.append(mat)
+        # Green Table 2: water reactive materials
+        mat['is_water_reactive'] = un_id in gt2
+        gt2_cnt += mat['is_water_reactive']
+
+        yield mat
     
+    print(f"Found {total} materials.")
     print(f"Enriched Stats: GT1 matches: {gt1_cnt}, GT2 matches: {gt2_cnt}, GT3 matches: {gt3_cnt}")
-    return enriched
 
-def parse_guides(path: str) -> List[Dict[str, Any]]:
-    print(f"Parsing guides from {path}...")
-    with open(path, 'r', encoding='utf-8') as f:
-        content = f.read()
+def guide_chunks(guide_no: str, guide_body: str, bilingual_labels: bool = True) -> Iterator[Dict[str, Any]]:
+    # Section-level chunks: consult_guide retrieves only the relevant sections instead of the whole guide
+    for section in split_guide_sections(guide_body):
+        yield {
+            "guide_no": guide_no,
+            "type": "guide",
+            "section": section['section'],
+            "content": section['content'],
+            "combined_text": (f"GUIDE {guide_no} (指南 {guide_no}) - {section['heading']}:\n{section['content']}"
+                              if bilingual_labels else f"GUIDE {guide_no} - {section['heading']}:\n{section['content']}")
+        }
 
-    # Split by "GUIDE" line
-    # Since the file starts with intro text, we process it differently
-    chunks = []
+def iter_guides(path: str, bilingual_labels: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Single pass over the guide file: a "GUIDE" line followed by the guide number starts a guide,
+    everything before the first one is the intro. Only the guide being read is held in memory.
+    """
+    print(f"Parsing guides from {path}...")
     seen_guides = set()
-    
-    # 1. Intro (Everything before first GUIDE line)
-    segments = re.split(r'\nGUIDE\n', content)
-    
-    # First segment is Intro
-    intro_text = segments[0]
-    chunks.append({
-        "guide_no": "000",
-        "type": "intro",
-        "content": intro_text.strip(),
-        "combined_text": f"GUIDE 000 (Intro/General Info/如何使用): {intro_text.strip()}"
-    })
-    
-    # Remaining segments are Guides
-    for segment in segments[1:]:
-        lines = segment.split('\n', 1) # Split only first newline to separate number
-        if len(lines) < 2:
-            continue
-            
-        guide_no = lines[0].strip()
-        guide_body = lines[1].strip()
-        
+    chunk_count = 0
+    guide_no = None # None while reading the intro
+    body: List[str] = []
+    expect_number = False
+
+    def finish(guide_no: Optional[str], body: List[str]) -> Iterator[Dict[str, Any]]:
+        text = "".join(body).strip()
+        if guide_no is None:
+            yield {
+                "guide_no": "000",
+                "type": "intro",
+                "section": "intro",
+                "content": text,
+                "combined_text": (f"GUIDE 000 (Intro/General Info/如何使用): {text}" if bilingual_labels
+                                  else f"GUIDE 000 (Intro/General Info): {text}")
+            }
+            return
+
         # Valid guide Check
-        if not re.match(r'^\d+[A-Z]?$', guide_no):
+        if not GUIDE_NO_PATTERN.match(guide_no):
             # Might be some artifact, skip or log
             print(f"Warning: Skipped segment with invalid guide number: {guide_no}")
-            continue
-        
+            return
+
         # Deduplication
         if guide_no in seen_guides:
             print(f"Warning: Duplicate guide {guide_no} found. Keeping first occurrence.")
-            continue
+            return
         seen_guides.add(guide_no)
-            
-        chunks.append({
-            "guide_no": guide_no,
-            "type": "guide",
-            "content": guide_body,
-            "combined_text": f"GUIDE {guide_no} (指南 {guide_no}):\n{guide_body}"
-        })
-        
-    print(f"Parsed {len(chunks)} guide sections.")
-    return chunks
+        yield from guide_chunks(guide_no, text, bilingual_labels)
+
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f):
+            if expect_number:
+                guide_no, expect_number = line.strip(), False
+                if not line.endswith("\n"):
+                    break # Guide number on the last line: no body
+                continue
+            if line == GUIDE_MARKER and line_no > 0:
+                for chunk in finish(guide_no, body):
+                    chunk_count += 1
+                    yield chunk
+                body = []
+                expect_number = True
+                continue
+            body.append(line)
+        else:
+            for chunk in finish(guide_no, body):
+                chunk_count += 1
+                yield chunk
+
+    print(f"Parsed {len(seen_guides)} guides into {chunk_count} sections.")
+
+def parse_guides(path: str, bilingual_labels: bool = True) -> List[Dict[str, Any]]:
+    return list(iter_guides(path, bilingual_labels))
+
+def record_hash(document: str, metadata: Dict[str, Any], backend: str = DEFAULT_BACKEND) -> str:
+    # Hash the embedded text, its metadata and the model / backend so any change forces a re-embed
+    payload = json.dumps({"model": embedding_id(EMBEDDING_MODEL, backend), "document": document, "metadata": metadata},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def material_id(mat: Dict[str, Any], seen_ids: set) -> str:
+    # Stable across rebuilds: derived from UN ID + name instead of the line position
+    base_id = f"mat_{mat['un_id']}_{hashlib.sha1(mat['name'].encode('utf-8')).hexdigest()[:10]}"
+    record_id = base_id
+    suffix = 2
+    while record_id in seen_ids:
+        record_id = f"{base_id}_{suffix}"
+        suffix += 1
+    seen_ids.add(record_id)
+    return record_id
 
-def build_db():
+def material_metadata(mat: Dict[str, Any]) -> Dict[str, Any]:
+    # Metadata must be simple types (str, int, float, bool)
+    metadata = {
+        "type": "material",
+        "un_id": mat['un_id'],
+        "name": mat['name'],
+        "guide_no": mat['guide_no'],
+        "is_tih": mat['is_tih'],
+        "is_polymerization": mat['is_polymerization'],
+        "is_water_reactive": mat['is_water_reactive']
+    }
+    # Only materials with several names carry the key (single-name records keep their content hash)
+    if mat.get('aliases'):
+        metadata["aliases"] = ALIAS_SEPARATOR.join(mat['aliases'])
+    return metadata
+
+def iter_records(gt1: Dict, gt2: Dict, gt3_lookup: Dict) -> Iterator[Dict[str, Any]]:
+    """
+    Stream material and guide records (stable id, document text, metadata) for the embedding pipeline.
+    Records are parsed as they are consumed, so the source files are never held in memory.
+    """
+    print("Parsing ERG Index and enriching materials with Green Table data...")
+    seen_ids = set()
+    for mat in enrich_materials(group_materials(iter_erg_index(INDEX_FILE)), gt1, gt2, gt3_lookup):
+        yield {"id": material_id(mat, seen_ids), "document": mat['full_text'], "metadata": material_metadata(mat)}
+
+    yield from guide_records(iter_guides(GUIDES_FILE))
+
+def guide_records(guides: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    section_counts = {}
+    for g in guides:
+        # A section can repeat within one guide (appendix pages in the source), so number repeats
+        base_id = f"guide_{g['guide_no']}_{g['section']}"
+        section_counts[base_id] = section_counts.get(base_id, 0) + 1
+        yield {
+            "id": base_id if section_counts[base_id] == 1 else f"{base_id}_{section_counts[base_id]}",
+            "document": g['combined_text'],
+            "metadata": {"type": "guide", "guide_no": g['guide_no'], "section": g['section']}
+        }
+
+def iter_english_records(by_en_name: Dict[Tuple[str, str], Dict[str, Any]], gt2: Dict) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the English corpus for the EN partition. Materials (grouped like the CN ones) reuse the id and
+    metadata of the matching CN record (same UN ID + one of its English names, looked up in by_en_name), so a hit
+    in either partition resolves to the same material and the material / lexical indexes serve both; only the
+    embedded document text differs.
+    """
+    print("Parsing English ERG Index...")
+    seen_ids = set()
+    total = 0
+    unmatched = 0
+    for mat in group_materials(iter_erg_index(EN_INDEX_FILE)):
+        total += 1
+        cn_meta = next((by_en_name[(mat['un_id'], name)] for name in [mat['name']] + mat['aliases']
+                        if (mat['un_id'], name) in by_en_name), None)
+        if cn_meta is None:
+            unmatched += 1
+            mat['is_water_reactive'] = mat['un_id'] in gt2
+            metadata = material_metadata(mat)
+        else:
+            metadata = {key: value for key, value in cn_meta.items() if key != "content_hash"}
+        yield {"id": material_id(metadata, seen_ids), "document": mat['full_text'], "metadata": metadata}
+    print(f"Found {total} English materials ({unmatched} without a CN counterpart).")
+
+    yield from guide_records(iter_guides(EN_GUIDES_FILE, bilingual_labels=False))
+
+def sync_collection(collection, records: Iterable[Dict[str, Any]], pipeline: EmbeddingPipeline):
+    """
+    Incremental sync: compare content hashes with what is already stored and only
+    stream added or changed records through the embedding pipeline, then delete records that no longer exist.
+    """
+    # Only id -> hash is kept; the stored metadata is read page by page
+    stored_hashes = {}
+    with tracer.span("build.fetch_existing"):
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=SYNC_PAGE_SIZE, offset=offset)
+            for record_id, meta in zip(page['ids'], page['metadatas']):
+                stored_hashes[record_id] = (meta or {}).get("content_hash")
+            if len(page['ids']) < SYNC_PAGE_SIZE:
+                break
+            offset += SYNC_PAGE_SIZE
+
+    seen_ids = set()
+    stats = {"added": 0, "changed": 0, "unchanged": 0}
+
+    def changed_records() -> Iterator[Dict[str, Any]]:
+        for record in records:
+            seen_ids.add(record["id"])
+            content_hash = record_hash(record["document"], record["metadata"], pipeline.backend)
+            record["metadata"]["content_hash"] = content_hash
+
+            if record["id"] not in stored_hashes:
+                stats["added"] += 1
+            elif stored_hashes[record["id"]] != content_hash:
+                stats["changed"] += 1
+            else:
+                stats["unchanged"] += 1
+                continue
+            yield record
+
+    with tracer.span("build.pipeline"):
+        pipeline.run(changed_records())
+
+    removed_ids = list(set(stored_hashes) - seen_ids)
+    with tracer.span("build.delete"):
+        for i in range(0, len(removed_ids), pipeline.batch_size):
+            collection.delete(ids=removed_ids[i:i+pipeline.batch_size])
+
+    for key, value in stats.items():
+        tracer.count(f"build.{key}", value)
+    tracer.count("build.removed", len(removed_ids))
+
+    print(f"Sync result: {stats['added']} added, {stats['changed']} changed, "
+          f"{len(removed_ids)} removed, {stats['unchanged']} unchanged.")
+
+def existing_backend(client) -> str:
+    # Keep the backend of an existing DB unless --backend asks for another one
+    try:
+        return recorded_backend(client.get_collection(name=COLLECTION_CN, embedding_function=None).metadata)
+    except Exception:
+        return DEFAULT_BACKEND
+
+def record_backend(collection, backend: str):
+    # Stored on the collection so queries can detect a build / query backend mismatch
+    metadata = dict(collection.metadata or {})
+    if metadata.get(METADATA_BACKEND) != backend or metadata.get(METADATA_MODEL) != EMBEDDING_MODEL:
+        metadata.update({METADATA_BACKEND: backend, METADATA_MODEL: EMBEDDING_MODEL})
+        collection.modify(metadata=metadata)
+
+def build_db(full_rebuild: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 0,
+             bilingual: bool = False, backend: Optional[str] = None, vector_dtype: str = DEFAULT_VECTOR_DTYPE,
+             hnsw_m: int = DEFAULT_HNSW_M, hnsw_ef_construction: int = DEFAULT_HNSW_EF_CONSTRUCTION):
     print("Initializing ChromaDB...")
+    client = chromadb.PersistentClient(path=DB_DIR)
+    # Cached query answers are tied to the version stamp: drop it while the DB is being modified
+    clear_db_version(DB_DIR)
+
+    previous_backend = existing_backend(client)
+    backend = backend or previous_backend
+    if backend != previous_backend and not full_rebuild:
+        print(f"Embedding backend changes from '{previous_backend}' to '{backend}': every record will be re-embedded.")
     
     # Use a multilingual embedding model for better Chinese support
-    # try to use sentence-transformers if possible
-    print("Using multilingual-MiniLM model...")
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="paraphrase-multilingual-MiniLM-L12-v2")
-    
-    client = chromadb.PersistentClient(path=DB_DIR)
+    print(f"Using multilingual-MiniLM model ({backend} backend)...")
+    # Memory-only cache: identical documents (e.g. repeated index lines, or records shared by both
+    # language partitions) are embedded once
+    ef = CachedEmbeddingFunction(
+        BackendEmbeddingFunction(EMBEDDING_MODEL, backend, cache_dir=model_cache_dir(DB_DIR)),
+        model_name=embedding_id(EMBEDDING_MODEL, backend)
+    )
     
-    # Delete existing collection if rebuilding to stay clean
-    try:
-        client.delete_collection(name="erg_cn")
-    except:
-        pass
+    # Default is an incremental sync; --full deletes the collections and re-embeds everything.
+    # Without --bilingual an existing EN partition is dropped, so it can never serve stale data.
+    stale = [COLLECTION_CN, COLLECTION_EN] if full_rebuild else ([] if bilingual else [COLLECTION_EN])
+    for name in stale:
+        try:
+            client.delete_collection(name=name)
+            if name == COLLECTION_EN and not bilingual:
+                print(f"Removed the '{COLLECTION_EN}' partition (rebuild with --bilingual to keep it).")
+        except Exception:
+            pass
         
-    collection = client.create_collection(name="erg_cn", embedding_function=ef)
+    collection = client.get_or_create_collection(name=COLLECTION_CN, embedding_function=ef)
     
     # 1. Load Green Tables
     print("Loading Green Tables...")
-    gt1 = load_json(GREEN_TABLE_1)
-    gt2 = load_json(GREEN_TABLE_2)
-    gt3 = load_json(GREEN_TABLE_3)
+    with tracer.span("build.load_tables"):
+        gt1 = load_json(GREEN_TABLE_1)
+        gt2 = load_json(GREEN_TABLE_2)
+        gt3 = load_json(GREEN_TABLE_3)
     
     # Transform GT3 list to lookup dict by UN ID
     gt3_lookup = {}
@@ -226,82 +416,141 @@ def build_db():
                 un_digits = "".join(filter(str.isdigit, full_un))
                 if un_digits:
                     gt3_lookup[un_digits] = chem # Map "1005" -> Object
+
+    # Numeric isolation / protective distances (Table 1 + 3) and water-reactive gases (Table 2), keyed by UN ID
+    hazard_path = os.path.join(DB_DIR, HAZARD_TABLE_FILENAME)
+    with tracer.span("build.hazard_table"):
+        hazard_table = HazardTable.build(gt1, gt2, gt3)
+        hazard_table.save(hazard_path)
+    print(f"Hazard table ({len(hazard_table)} UN IDs, {len(hazard_table.table3)} Table 3 rows) saved to '{hazard_path}'")
     
-    # 2. Parse Index (Materials)
-    print("Parsing ERG Index...")
-    materials = parse_erg_index(INDEX_FILE)
-    print(f"Found {len(materials)} material entries.")
-    
-    # 3. Enrich Materials
-    print("Enriching materials with Green Table data...")
-    enriched_materials = enrich_materials(materials, gt1, gt2, gt3_lookup)
-    
-    # 4. Add Materials to Chroma
-    print("Adding materials to ChromaDB...")
-    
-    mat_ids = []
-    mat_docs = []
-    mat_metas = []
-    
-    for idx, mat in enumerate(enriched_materials):
-        mat_ids.append(f"mat_{mat['un_id']}_{idx}") # Unique ID
-        mat_docs.append(mat['full_text'])
-        
-        # Metadata must be simple types (str, int, float, bool)
-        meta = {
-            "type": "material",
-            "un_id": mat['un_id'],
-            "name": mat['name'],
-            "guide_no": mat['guide_no'],
-            "is_tih": mat['is_tih'],
-            "is_polymerization": mat['is_polymerization'],
-            "is_water_reactive": mat['is_water_reactive'],
-            "water_reactive_gases": mat.get('water_reactive_gases', ""),
-            "small_iso": mat.get('small_iso', ""),
-            "small_day": mat.get('small_day', ""),
-            "small_night": mat.get('small_night', ""),
-            "large_iso": mat.get('large_iso', ""),
-            "large_day": mat.get('large_day', ""),
-            "large_night": mat.get('large_night', ""),
-            "large_note": mat.get('large_note', ""),
-            "table3_content": mat.get('table3_content', "")
-        }
-        mat_metas.append(meta)
-        
-    # Batch add
-    batch_size = 500
-    for i in range(0, len(mat_ids), batch_size):
-        collection.add(
-            ids=mat_ids[i:i+batch_size],
-            documents=mat_docs[i:i+batch_size],
-            metadatas=mat_metas[i:i+batch_size]
-        )
-        print(f"  Added batch {i} to {i+batch_size}")
-
-    # 5. Parse and Add Guides
-    print("Parsing and Adding Guides...")
-    guides = parse_guides(GUIDES_FILE)
-    
-    guide_ids = []
-    guide_docs = []
-    guide_metas = []
-    
-    for g in guides:
-        guide_ids.append(f"guide_{g['guide_no']}")
-        guide_docs.append(g['combined_text'])
-        guide_metas.append({
-            "type": "guide",
-            "guide_no": g['guide_no']
-        })
-        
-    collection.add(
-        ids=guide_ids,
-        documents=guide_docs,
-        metadatas=guide_metas
-    )
-    print("Guides added.")
+    # 2. Stream materials and guides through the embedding pipeline (only changed records are embedded)
+    print(f"Syncing records with ChromaDB (batch size {batch_size}, "
+          f"{f'{workers} embedding worker processes' if workers else 'in-process embedding'})...")
+    # The lookup index (UN ID / EN / CN name -> metadata) is written to disk as records stream past and the
+    # BM25 index and the name extractor (same row order) accumulate term counts / names, so no per-material
+    # list is kept in memory.
+    # Only --bilingual keeps a (UN ID, English name) -> metadata map, to join the English records.
+    # Response cards (per UN ID: materials, green-table data, guide numbers; guide sections per language)
+    # are written to SQLite the same way.
+    index_path = os.path.join(DB_DIR, INDEX_FILENAME)
+    index_writer = MaterialIndexWriter(index_path)
+    lexical_builder = LexicalIndexBuilder()
+    extractor_builder = EntityExtractorBuilder()
+    cards_path = os.path.join(DB_DIR, RESPONSE_CARDS_FILENAME)
+    card_writer = ResponseCardWriter(cards_path, hazard_table.lookup)
+    by_en_name: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def collect_materials(records: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for record in records:
+            yield record
+            # Resumed once the sync has consumed the record, i.e. after it stamped the content hash
+            meta = record["metadata"]
+            if meta["type"] == "material":
+                index_writer.add(meta)
+                lexical_builder.add(material_lexical_text(material_names(meta), record["document"]))
+                extractor_builder.add(meta)
+                card_writer.add_material(meta)
+                if bilingual:
+                    for name in material_names(meta):
+                        by_en_name.setdefault((meta['un_id'], split_bilingual_name(name)[0]), meta)
+            else:
+                card_writer.add_guide_section("cn", meta["guide_no"], meta["section"], record["document"])
+
+    def collect_guides(records: Iterator[Dict[str, Any]], lang: str) -> Iterator[Dict[str, Any]]:
+        for record in records:
+            yield record
+            meta = record["metadata"]
+            if meta["type"] == "guide":
+                card_writer.add_guide_section(lang, meta["guide_no"], meta["section"], record["document"])
+
+    pipeline = EmbeddingPipeline(collection, EMBEDDING_MODEL, embedding_function=ef,
+                                 batch_size=batch_size, workers=workers, backend=backend,
+                                 model_cache_dir=model_cache_dir(DB_DIR))
+    try:
+        sync_collection(collection, collect_materials(iter_records(gt1, gt2, gt3_lookup)), pipeline)
+    except BaseException:
+        index_writer.discard()
+        card_writer.discard()
+        raise
+    record_backend(collection, backend)
+
+    with tracer.span("build.material_index"):
+        index_writer.close()
+    print(f"Material lookup index ({index_writer.count} materials) saved to '{index_path}'")
+
+    # BM25 index over the same materials (rows follow the material index order) for hybrid search
+    lexical_path = os.path.join(DB_DIR, LEXICAL_INDEX_FILENAME)
+    with tracer.span("build.lexical_index"):
+        lexical_builder.build().save(lexical_path)
+    print(f"Lexical (BM25) index saved to '{lexical_path}'")
+
+    # Aho-Corasick automaton over all material names and synonyms, to spot materials in free-text questions
+    extractor_path = os.path.join(DB_DIR, ENTITY_EXTRACTOR_FILENAME)
+    with tracer.span("build.entity_extractor"):
+        extractor = extractor_builder.build()
+        extractor.save(extractor_path)
+    print(f"Entity extractor ({len(extractor_builder.synonyms())} synonyms, {extractor.states} states) "
+          f"saved to '{extractor_path}'")
+
+    if bilingual:
+        # English partition: same ids / metadata as the CN records, English documents
+        print(f"Syncing English partition '{COLLECTION_EN}'...")
+        en_collection = client.get_or_create_collection(name=COLLECTION_EN, embedding_function=ef)
+        en_pipeline = EmbeddingPipeline(en_collection, EMBEDDING_MODEL, embedding_function=ef,
+                                        batch_size=batch_size, workers=workers, backend=backend,
+                                        model_cache_dir=model_cache_dir(DB_DIR))
+        with tracer.span("build.english_partition"):
+            try:
+                sync_collection(en_collection, collect_guides(iter_english_records(by_en_name, gt2), "en"),
+                                en_pipeline)
+            except BaseException:
+                card_writer.discard()
+                raise
+        record_backend(en_collection, backend)
+
+    with tracer.span("build.response_cards"):
+        card_writer.close()
+    print(f"Response cards ({card_writer.cards} UN IDs, {card_writer.guides} guides) saved to '{cards_path}'")
+
+    version = write_db_version(DB_DIR, backend=backend, bilingual=bilingual)
+    print(f"Database version stamp: {version}")
+
+    # Vectors for the flat / HNSW query stores (ERG_RAG_VECTOR_STORE), stamped with the version above
+    store_dir = os.path.join(DB_DIR, VECTOR_STORE_DIRNAME)
+    with tracer.span("build.vector_export"):
+        for partition in [collection] + ([en_collection] if bilingual else []):
+            manifest = export_collection(partition, store_dir, partition.name, version, dtype=vector_dtype,
+                                         hnsw_m=hnsw_m, hnsw_ef_construction=hnsw_ef_construction)
+            hnsw = (f", HNSW M={manifest['hnsw']['M']} ef_construction={manifest['hnsw']['ef_construction']}"
+                    if manifest["hnsw"] else " (hnswlib not installed: no HNSW index)")
+            print(f"Exported {manifest['count']} {vector_dtype} vectors of '{partition.name}' to '{store_dir}'{hnsw}")
 
     print(f"RAG Build Complete! Database saved to '{DB_DIR}'")
 
+    histogram = tracer.find_exporter(HistogramExporter)
+    if histogram:
+        print("\nStage timings:")
+        print(histogram.format_table())
+
 if __name__ == "__main__":
-    build_db()
+    parser = argparse.ArgumentParser(description="Build or incrementally sync the ERG Chinese RAG database.")
+    parser.add_argument("--full", action="store_true", help="Delete the collection and re-embed every record")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Documents per embedding batch")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Embedding worker processes (0 = embed in the main process)")
+    parser.add_argument("--bilingual", action="store_true",
+                        help=f"Also index '{EN_DATA_DIR}' into the English partition '{COLLECTION_EN}'")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        help="Embedding runtime (default: the backend the existing DB was built with, else torch)")
+    parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default=DEFAULT_VECTOR_DTYPE,
+                        help="Storage type of the exported vectors used by the flat / HNSW query stores")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M, help="HNSW graph degree (exported index)")
+    parser.add_argument("--hnsw-ef-construction", type=int, default=DEFAULT_HNSW_EF_CONSTRUCTION,
+                        help="HNSW build-time search breadth (exported index)")
+    args = parser.parse_args()
+    # Optional tracing, e.g. ERG_RAG_TRACE=histogram,jsonl:build_trace.jsonl
+    configure_from_env()
+    build_db(full_rebuild=args.full, batch_size=args.batch_size, workers=args.workers, bilingual=args.bilingual,
+             backend=args.backend, vector_dtype=args.vector_dtype, hnsw_m=args.hnsw_m,
+             hnsw_ef_construction=args.hnsw_ef_construction)
@@ -0,0 +1,166 @@
+"""
+物質搜尋候選層級 (candidate cascade) 的信心分數校正
+
+以標註查詢集 (benchmark_queries_cn.json) 收集樣本，寫入 erg_chroma_db_cn/cascade_calibration.json:
+- 記憶體索引可回答的查詢: 各匹配方式 (UN 編號 / 精確 / 前綴 / 問句名稱擷取) 是否正確
+- 每筆查詢另外略過索引，在每個層級 (只用 BM25 候選的 lexical 層級，與 match_confidence.CASCADE_TIERS 的向量候選層級)
+  篩選排序，記錄匹配方式、排名特徵 (向量距離差距、BM25 是否同意) 與是否正確
+- 各層級的平均延遲 (BM25、embedding、各候選數的向量查詢 + 篩選排序)
+據此選出提前結束門檻與要使用的向量候選層級 (在標註查詢集上不降低正確率的前提下，預期延遲最低)，
+並實際量測「固定取最多候選」與「候選層級遞增」的平均延遲。
+門檻是在同一批查詢上選出的，因此另以交叉驗證 (每一折以其餘查詢校正後重播) 估計正確率；
+交叉驗證的正確率下降超過容許值時，寫入不提前結束的設定 (每筆查詢都使用最多候選)。重新建置資料庫或更換 embedding 模型後應重新執行:
+    python3 calibrate_cascade.py
+    python3 calibrate_cascade.py --repeat 10 --dry-run
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from benchmark_rag_cn import QUERIES_FILE, load_queries, git_commit
+from match_confidence import (CascadeCalibration, TierResult, CASCADE_CALIBRATION_FILENAME, CASCADE_TIERS,
+                              CROSS_VALIDATION_FOLDS, MAX_ACCURACY_LOSS, tier_label)
+
+Sample = Tuple[str, Optional[List[float]], bool]
+
+
+def collect_samples(engine, queries: List[Dict[str, Any]]) -> Tuple[List[List[Sample]], List[Dict[str, TierResult]]]:
+    """回傳 (各查詢的校正樣本 [(匹配類型, 排名特徵, 是否正確)], 各查詢在每個層級的結果 {層級: 結果})。"""
+    samples: List[List[Sample]] = [[] for _ in queries]
+    for pos, item in enumerate(queries):
+        index_hit, _ = engine._resolve_from_index(item["query"], extract_mentions=item["kind"] == "question")
+        if index_hit:
+            meta, _, kind = index_hit
+            samples[pos].append((kind, None, str(meta["un_id"]) in item["expected_un_ids"]))
+
+    records: List[Dict[str, TierResult]] = [{} for _ in queries]
+    by_partition: Dict[str, List[int]] = {}
+    for pos, item in enumerate(queries):
+        by_partition.setdefault(engine._partition(item["query"]), []).append(pos)
+    for partition, positions in by_partition.items():
+        texts = [queries[pos]["query"] for pos in positions]
+        lexical_hits = engine._lexical_candidates(texts)
+        embeddings = engine.ef(texts)
+        tier_runs = [("lexical", engine._lexical_tier(texts, lexical_hits))]
+        tier_runs += [(tier_label(k), engine._cascade_tier(engine.partitions[partition], texts, embeddings, lexical_hits, k))
+                      for k in CASCADE_TIERS]
+        for label, results in tier_runs:
+            for pos, found in zip(positions, results):
+                if found is None:
+                    records[pos][label] = None
+                    continue
+                meta, _, kind, features, _ = found
+                correct = str(meta["un_id"]) in queries[pos]["expected_un_ids"]
+                records[pos][label] = (kind, features, correct)
+                # The lexical tier only answers name matches
+                if label != "lexical" or kind != "ranking":
+                    samples[pos].append((kind, features, correct))
+    return samples, records
+
+
+def mean_ms(func, args_list: List[Tuple], repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter_ns()
+            func(*args)
+            samples.append(time.perf_counter_ns() - start)
+    return round(float(np.mean(samples)) / 1e6, 3)
+
+
+def measure_tier_costs(engine, texts: List[str], partitions: List[str], repeat: int) -> Dict[str, float]:
+    """單筆查詢在各層級的平均耗時 (ms)；embedding 為未快取時的計算時間 (須在其他步驟計算 embedding 之前執行)。"""
+    # Runs before anything else embeds these texts, so every call computes (and caches) its embedding
+    costs = {"embed": mean_ms(lambda text: engine.ef([text]), [(text,) for text in texts], 1)}
+    lexical_hits = [engine._lexical_candidates([text]) for text in texts]
+    costs["lexical"] = mean_ms(lambda text: engine._lexical_tier([text], engine._lexical_candidates([text])),
+                               [(text,) for text in texts], repeat)
+    embeddings = [engine.ef([text]) for text in texts]
+    for k in CASCADE_TIERS:
+        costs[tier_label(k)] = mean_ms(
+            lambda text, partition, embedding, hits: engine._cascade_tier(engine.partitions[partition], [text],
+                                                                          embedding, hits, k),
+            list(zip(texts, partitions, embeddings, lexical_hits)), repeat)
+    return costs
+
+
+def measure_latency(engine, texts: List[str], partitions: List[str], repeat: int) -> Dict[str, float]:
+    """
+    每筆查詢單獨執行 (與 find_material 的語意搜尋路徑相同)，比較平均延遲 (ms)：
+    固定取最多候選 (BM25 + embedding + 一次向量查詢) 與候選層級遞增。embedding 已快取，兩者相同。
+    """
+    def fixed(text: str, partition: str):
+        embeddings = engine.ef([text])
+        return engine._cascade_tier(engine.partitions[partition], [text], embeddings,
+                                    engine._lexical_candidates([text]), CASCADE_TIERS[-1])
+
+    def cascade(text: str, partition: str):
+        return engine._semantic_cascade([text], partition, "material", {})
+
+    return {"fixed_mean_ms": mean_ms(fixed, list(zip(texts, partitions)), repeat),
+            "cascade_mean_ms": mean_ms(cascade, list(zip(texts, partitions)), repeat)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以標註查詢集校正物質搜尋候選層級的信心分數、提前結束門檻與候選層級")
+    parser.add_argument("--queries", default=QUERIES_FILE, help="標註查詢集 (JSON)")
+    parser.add_argument("--repeat", type=int, default=5, help="延遲量測的重複次數")
+    parser.add_argument("--folds", type=int, default=CROSS_VALIDATION_FOLDS, help="交叉驗證的折數")
+    parser.add_argument("--dry-run", action="store_true", help="只顯示校正結果，不寫入資料庫目錄")
+    args = parser.parse_args()
+
+    from rag_engine import ERGEngine, DB_DIR
+    from response_cache import DBVersion
+    with contextlib.redirect_stderr(io.StringIO()):
+        engine = ERGEngine(embedding_cache_dir=None)
+        engine.partitions # Load the model, collections and BM25 index up front
+    queries = load_queries(args.queries)
+    texts = [item["query"] for item in queries]
+    partitions = [engine._partition(text) for text in texts]
+
+    print(f"量測各層級耗時 (lexical、embedding、向量候選 {CASCADE_TIERS})...")
+    tier_costs = measure_tier_costs(engine, texts, partitions, args.repeat)
+    print(f"收集 {len(queries)} 筆標註查詢在各層級的樣本...")
+    query_samples, records = collect_samples(engine, queries)
+    samples = [sample for per_query in query_samples for sample in per_query]
+    calibration = CascadeCalibration.fit(samples, records, tier_costs)
+    evaluation = calibration.simulate(records, tier_costs)
+    held_out = CascadeCalibration.cross_validate(query_samples, records, tier_costs, args.folds)
+    evaluation["cross_validation"] = held_out
+    overfitted = held_out["accuracy"] < held_out["fixed_accuracy"] - MAX_ACCURACY_LOSS
+    if overfitted:
+        calibration = calibration.without_early_stops()
+        evaluation.update(calibration.simulate(records, tier_costs))
+    engine.calibration = calibration
+    evaluation.update(measure_latency(engine, texts, partitions, args.repeat))
+
+    print(f"\n樣本數: {len(samples)} (容許正確率下降 {MAX_ACCURACY_LOSS:.2f})")
+    print("各層級耗時 (ms): " + ", ".join(f"{label} {ms:.3f}" for label, ms in tier_costs.items()))
+    print("各匹配方式的正確率: " + ", ".join(f"{kind} {value:.3f}" for kind, value in calibration.kind_precision.items()))
+    print(f"排名模型權重: {calibration.to_dict()['weights']}")
+    print(f"提前結束門檻: {calibration.stop_confidence:.4f}，向量候選層級: {calibration.tiers}")
+    print(f"各層級回答數: {evaluation['answered_by_tier']}")
+    print(f"正確率: 遞增 {evaluation['accuracy']:.3f} / 固定 {evaluation['fixed_accuracy']:.3f}")
+    print(f"交叉驗證 ({held_out['folds']} 折) 正確率: 遞增 {held_out['accuracy']:.3f} / "
+          f"固定 {held_out['fixed_accuracy']:.3f}，預期延遲 {held_out['expected_ms']:.3f} ms")
+    if overfitted:
+        print("[warning] 交叉驗證的正確率下降超過容許值：提前結束門檻無法推廣到未見過的查詢，改用不提前結束的設定。")
+    print(f"平均延遲 (ms): 遞增 {evaluation['cascade_mean_ms']:.3f} / 固定 {evaluation['fixed_mean_ms']:.3f} "
+          f"(預期 {evaluation['expected_ms']:.3f})")
+
+    if args.dry_run:
+        return
+    path = os.path.join(DB_DIR, CASCADE_CALIBRATION_FILENAME)
+    calibration.save(path, timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"), git_commit=git_commit(),
+                     queries_file=args.queries, db_version=DBVersion(DB_DIR).current(), tier_costs_ms=tier_costs,
+                     evaluation=evaluation)
+    print(f"\n校正結果已儲存至 '{path}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
-import chromadb
-from chromadb.utils import embedding_functions
+import argparse
 import sys
 import time
 import os
-import re
-from typing import Optional, Dict, Any
+import json
+from typing import Optional, List, Tuple
 
-# Configuration
-DB_DIR = "erg_chroma_db_cn"
+from rag_engine import ERGEngine, DB_DIR, EMBEDDING_CACHE_DIR
+from vector_store import VECTOR_STORES
+from rag_results import MaterialHit, DistanceInfo, SpillDistance, GuideResult, IncidentAnswer, to_dict
+from hazard_table import WIND_CLASSES, format_distance
+from guide_sections import SECTION_LABELS
+from instrumentation import tracer, configure_from_env, HistogramExporter
+
+STAGE_LABELS = {"filter": "索引", "embed": "embedding", "query": "向量查詢", "refine": "篩選排序"}
+TIER_LABELS = {"index": "記憶體索引", "un_filter": "UN 編號過濾查詢", "card": "回應卡", "lexical": "BM25 關鍵字候選"}
 
 class Color:
     HEADER = '\033[95m'
@@ -29,284 +35,334 @@ def print_result(key, value):
 def print_info(msg):
     print(f"  ℹ {msg}")
 
-class ERG_RAG_Demo:
-    def __init__(self):
-        print(f"{Color.HEADER}[系統初始化] 正在連接至 ChromaDB 資料庫...{Color.ENDC}")
+class ERG_RAG_Demo(ERGEngine):
+    """
+    主控台演示：查詢邏輯全部由 ERGEngine 完成，此類別只負責把結果物件輸出為彩色文字。
+    服務與批次作業請直接使用 ERGEngine (不需格式化與終端輸出)。
+    """
+
+    def __init__(self, embedding_cache_dir: Optional[str] = EMBEDDING_CACHE_DIR, warmup: bool = False,
+                 embedding_backend: Optional[str] = None, response_cache_path: Optional[str] = None,
+                 vector_store: Optional[str] = None, hnsw_ef: Optional[int] = None):
+        print(f"{Color.HEADER}[系統初始化] 正在載入查詢索引...{Color.ENDC}")
         
         if not os.path.exists(DB_DIR):
             print(f"{Color.FAIL}錯誤: 找不到資料庫目錄 '{DB_DIR}'。請先執行 build_rag_db_cn.py。{Color.ENDC}")
             sys.exit(1)
-            
-        # 使用與建立資料庫時相同的 Embedding 模型
-        ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="paraphrase-multilingual-MiniLM-L12-v2")
-        
-        self.client = chromadb.PersistentClient(path=DB_DIR)
-        try:
-            self.collection = self.client.get_collection(name="erg_cn", embedding_function=ef)
-            print(f"{Color.HEADER}資料庫連接成功。集合 'erg_cn' 包含 {self.collection.count()} 筆文件。\n{Color.ENDC}")
-        except Exception as e:
-            print(f"{Color.FAIL}載入集合時發生錯誤: {e}{Color.ENDC}")
-            sys.exit(1)
 
-    def search_material(self, query: str) -> Optional[Dict[str, Any]]:
+        super().__init__(embedding_cache_dir, warmup, embedding_backend, response_cache_path, vector_store, hnsw_ef)
+
+    def notify(self, level: str, message: str):
+        if level == "error":
+            print(f"{Color.FAIL}{message}{Color.ENDC}")
+        elif level == "warning":
+            print(f"{Color.WARNING}  ⚠ {message}{Color.ENDC}")
+        else:
+            print(f"{Color.HEADER}{message}\n{Color.ENDC}")
+
+    def search_material(self, query: str) -> Optional[MaterialHit]:
         """
-        示範如何搜尋物質：
-        1. 優先檢查是否為 UN 編號
-        2. 若非編號，則進行語意搜尋 + 關鍵字過濾
+        示範如何搜尋物質 (輸出查詢過程)，回傳識別結果。
         """
         print_step(f"執行查詢: 搜尋物質 '{query}'")
-        
-        start_time = time.time()
-        
-        # 策略 1: 檢查查詢字串中是否包含 UN 編號 (例如 "UN 1017")
-        un_id_match = re.search(r"(?:UN\s?|ID\s?)?(\d{4})\b", query, re.IGNORECASE)
-        
-        results = None
-        match_method = "Unknown"
-        
-        if un_id_match and "Guide" not in query and "指南" not in query:
-            un_id = un_id_match.group(1)
-            match_method = "UN ID 精確匹配"
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=5,
-                where={"$and": [{"un_id": un_id}, {"type": "material"}]}
-            )
-        else:
-            # Semantic search
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=20, # Fetch more to filter
-                where={"type": "material"}
-            )
-            
-        elapsed = time.time() - start_time
-        
-        if not results or not results['ids'] or not results['ids'][0]:
+
+        hit = self.find_material(query)
+        if not hit:
             print(f"{Color.FAIL}  ✖ 未找到相關物質。{Color.ENDC}")
             return None
 
-        candidates = []
-        for i in range(len(results['ids'][0])):
-            candidates.append({
-                'meta': results['metadatas'][0][i],
-                'dist': results['distances'][0][i] if results['distances'] else 0,
-                'text': results['documents'][0][i]
-            })
-
-        best_match = None
-        
-        # Refinement Logic
-        # If we didn't match by UN ID already
-        if match_method != "UN ID 精確匹配":
-            query_clean = query.replace("UN", "").replace("ID", "").strip().lower()
-            
-            # 1. Exact Name Match
-            for cand in candidates:
-                if cand['meta']['name'].strip().lower() == query_clean:
-                    best_match = cand
-                    match_method = f"精確名稱匹配 ('{cand['meta']['name']}')"
-                    break
-            
-            # 2. Un ID match (if query was just a number but regex missed it somehow or mixed)
-            if not best_match and query_clean.isdigit():
-                 for cand in candidates:
-                    if str(cand['meta']['un_id']) == query_clean:
-                        best_match = cand
-                        match_method = "UN ID 匹配"
-                        break
-            
-            # 3. Contains Match (prioritize shorter/simpler names)
-            if not best_match:
-                 contains_cands = [c for c in candidates if query_clean in c['meta']['name'].lower()]
-                 if contains_cands:
-                     contains_cands.sort(key=lambda x: len(x['meta']['name']))
-                     best_match = contains_cands[0]
-                     match_method = f"部分名稱匹配 ('{best_match['meta']['name']}')"
-            
-            # 4. Fallback to vector similarity
-            if not best_match:
-                best_match = candidates[0]
-                match_method = "向量語意相似度 (最相關結果)"
-        else:
-            best_match = candidates[0] # From UN ID query types
-
-        meta = best_match['meta']
-        
-        print_info(f"匹配方式: {match_method}")
-        print_result("識別物質", f"{meta['name']} (UN: {meta['un_id']})")
-        print_result("參考指南", f"Guide {meta['guide_no']}")
-        print_result("信心水準", f"高 (耗時 {elapsed:.4f}秒)")
-        
-        return meta
+        with tracer.span("material.format"):
+            self._print_material(hit)
+        return hit
 
-    def consult_guide(self, guide_no: str, specific_question: str):
+    def search_manifest(self, queries: List[str]) -> List[Optional[MaterialHit]]:
+        """
+        示範批次搜尋物質 (例如列車貨單)，輸出每筆的識別結果。
+        search_materials_batch 本身不輸出訊息 (多物質事故查詢會在背景執行緒呼叫它)，因此在呼叫端依回傳結果輸出。
+        """
+        print_step(f"執行批次查詢: 搜尋 {len(queries)} 筆物質")
+        hits = self.search_materials_batch(queries)
+        for query, hit in zip(queries, hits):
+            if hit:
+                print_result(query, f"{hit.name} (UN: {hit.un_id}, Guide {hit.guide_no}) - {hit.match_method}")
+            else:
+                print(f"{Color.FAIL}  ✖ {query}: 未找到相關物質。{Color.ENDC}")
+        return hits
+
+    def _print_material(self, hit: MaterialHit):
+        print_info(f"匹配方式: {hit.match_method}")
+        print_result("識別物質", f"{hit.name} (UN: {hit.un_id})")
+        if hit.aliases:
+            print_result("其他列名", "; ".join(hit.aliases))
+        print_result("參考指南", f"Guide {hit.guide_no}")
+        if hit.confidence is not None:
+            # 低於提前結束門檻：最寬的候選層級仍無法確定，建議人工確認
+            level = "高" if self.calibration.accepts(hit.confidence) else "低，請人工確認"
+            tier = TIER_LABELS.get(hit.tier) or f"語意搜尋 (候選 {hit.tier.partition('@')[2]} 筆)"
+            print_result("信心水準", f"{hit.confidence:.2f} ({level}; {tier})")
+        stages = ", ".join(f"{STAGE_LABELS.get(stage, stage)} {ms:.2f}ms" for stage, ms in hit.timings_ms.items())
+        print_result("查詢耗時", f"{hit.elapsed * 1000:.2f}ms" + (f" ({stages})" if stages else ""))
+
+    def consult_guide(self, guide_no: str, specific_question: str) -> Optional[GuideResult]:
         """
         示範如何檢索指南內容：
-        根據指南編號 (Guide No) 檢索完整的應變指南文本。
+        根據指南編號 (Guide No) 與問題，檢索指南中相關的章節。
         """
         
         # 處理指南編號格式 (例如去除 'P' 後綴)
-        search_guide_no = guide_no
-        if guide_no.endswith('P'):
-            search_guide_no = guide_no.rstrip('P')
+        search_guide_no = guide_no.rstrip('P')
+        if search_guide_no != guide_no:
             print_info(f"注意: 將搜尋指南從 {guide_no} 調整為 {search_guide_no} (忽略 P 後綴)")
             
         print_step(f"執行查詢: 檢索指南 {search_guide_no} 的內容 (針對問題: {specific_question})")
         
-        # 這裡是使用語意搜尋，同時限制 guide_no 以確保只搜尋該指南的範圍
-        # 實務上，如果您只需要整篇指南，可以直接 filter guide_no 並取回所有 chunks
+        guide = self.find_guide(guide_no, specific_question)
+        self._print_guide(search_guide_no, guide)
+        return guide
 
-        
-        results = self.collection.query(
-            query_texts=[f"Guide {search_guide_no} {specific_question}"], 
-            n_results=5, 
-            where={"$and": [{"guide_no": search_guide_no}, {"type": "guide"}]}
-        )
-        
-        if not results['ids'][0]:
+    @staticmethod
+    def _print_guide(search_guide_no: str, guide: Optional[GuideResult]):
+        if not guide:
             print(f"{Color.WARNING}  ⚠ 找不到指南內容。{Color.ENDC}")
             return
 
-        doc_text = results['documents'][0][0]
-        
-        print_result("檢索結果", "成功獲取指南全文資料")
-        print(f"\n{Color.BOLD}[指南 {search_guide_no} 內容預覽]{Color.ENDC}")
-        print("------------------------------------------------")
-        
-        # 僅顯示前 1000 個字元作為示範
-        print(doc_text[:1000] + "...\n(下略)\n")
-        
-        print("------------------------------------------------\n")
+        with tracer.span("guide.format"):
+            labels = ", ".join(SECTION_LABELS.get(s.section, s.section) for s in guide.sections)
+            print_result("檢索結果", f"相關章節: {labels}")
+            print(f"\n{Color.BOLD}[指南 {search_guide_no} 相關章節]{Color.ENDC}")
+            print("------------------------------------------------")
+            
+            print(guide.text + "\n")
+            
+            print("------------------------------------------------\n")
 
+    def consult_guides_batch(self, pairs: List[Tuple[str, str]]) -> List[GuideResult]:
+        print_step(f"執行批次查詢: 檢索 {len(pairs)} 筆指南問題")
+        return self.find_guides_batch(pairs)
 
-    def unified_query(self, user_question: str):
+    def unified_query(self, user_question: str, incident: bool = False):
         """
         示範整合式查詢：
         使用者只需輸入一個自然語言問題 (包含物質名稱與情境)，
         系統自動識別物質 -> 顯示安全距離 -> 查詢對應指南。
+        查詢鏈由 answer_question 完成 (結果存入回應快取)，此處只負責輸出。
+        incident=True 時為多物質事故模式 (answer_incident)：問題中提到的所有物質都會識別並合併危害。
         """
+        if incident:
+            self._print_incident(self.answer_incident(user_question))
+            return
+
         print(f"{Color.BOLD}{Color.UNDERLINE}整合查詢演示: '{user_question}'{Color.ENDC}")
         print("------------------------------------------------")
 
         # 步驟 1: 嘗試從問題中識別物質
         # 直接拿整句去搜尋物質集合，通常 Embeddings 能抓到關鍵實體
         print_step("步驟 1: 這是針對特定物質的查詢嗎？(嘗試識別物質)")
-        material_data = self.search_material(user_question)
+        print_step(f"執行查詢: 搜尋物質 '{user_question}'")
+        answer = self.answer_question(user_question)
+        material = answer.material
 
-        if material_data:
+        if material:
+            with tracer.span("material.format"):
+                self._print_material(material)
             # 找到物質 -> 顯示關鍵數據 (Table 1/3)
             print_info("已識別相關物質，載入安全數據...")
             
             # 顯示 TIH / 距離資訊 (重用邏輯)
-            if material_data.get('is_tih', False):
+            if material.flags.is_tih:
                 print(f"  {Color.WARNING}⚠ 警告: 這是吸入性中毒危害 (TIH) 物質{Color.ENDC}")
                 
-                small_iso = material_data.get('small_iso', 'N/A')
-                large_note = material_data.get('large_note', '')
-                table3 = material_data.get('table3_content', '')
+                hazard = answer.hazard
+                small = (hazard.small_spill if hazard else None) or SpillDistance()
 
-                print(f"    [初始隔離距離 (小量洩漏)]: {small_iso}")
+                print(f"    [初始隔離距離 (小量洩漏)]: {format_distance(small.iso_m, small.iso_ft, 'm', 'ft') or 'N/A'}")
                 
-                if large_note and table3:
+                if hazard and hazard.large_spill_see_table3 and hazard.table3:
                      print(f"    [大量洩漏距離]: 請參考下方詳細表格")
-                     print(f"{Color.CYAN}{table3}{Color.ENDC}")
-                elif large_note:
-                     print(f"    [大量洩漏]: {large_note}")
+                     print(f"{Color.CYAN}{self._format_table3(hazard)}{Color.ENDC}")
+                elif hazard and hazard.large_spill_see_table3:
+                     print(f"    [大量洩漏]: Refer to Table 3 (請參閱表3)")
             
             # 步驟 2: 查詢指南
-            print_step(f"步驟 2: 根據識別結果 Guide {material_data['guide_no']}，回答應變問題")
-            self.consult_guide(str(material_data['guide_no']), user_question)
+            print_step(f"步驟 2: 根據識別結果 Guide {material.guide_no}，回答應變問題")
+            search_guide_no = material.guide_no.rstrip('P')
+            print_step(f"執行查詢: 檢索指南 {search_guide_no} 的內容 (針對問題: {user_question})")
+            self._print_guide(search_guide_no, answer.guide)
             
         else:
+            print(f"{Color.FAIL}  ✖ 未找到相關物質。{Color.ENDC}")
             print_result("識別結果", "未發現明確化學品名稱，轉為全域指南搜索...")
             # Fallback (略)
         
         print("\n")
 
 
+    def _print_incident(self, answer: IncidentAnswer):
+        print(f"{Color.BOLD}{Color.UNDERLINE}整合查詢演示 (多物質事故): '{answer.question}'{Color.ENDC}")
+        print("------------------------------------------------")
+
+        print_step("步驟 1: 找出問題中提到的所有物質 (UN 編號、名稱索引、語意搜尋)")
+        if not answer.materials:
+            print(f"{Color.FAIL}  ✖ 未找到相關物質。{Color.ENDC}\n")
+            return
+        with tracer.span("material.format"):
+            for hit in answer.materials:
+                print_info(f"'{hit.query}'")
+                self._print_material(hit)
+
+        # 步驟 2: 合併所有物質的危害標記
+        print_step(f"步驟 2: 合併 {len(answer.materials)} 種物質的危害標記")
+        names = lambda flag: ", ".join(f"UN {hit.un_id}" for hit in answer.materials if getattr(hit.flags, flag))
+        if answer.flags.is_tih:
+            print(f"  {Color.WARNING}⚠ 吸入性中毒危害 (TIH) 物質: {names('is_tih')}{Color.ENDC}")
+            for hit, hazard in zip(answer.materials, answer.hazards):
+                if hit.flags.is_tih:
+                    small = (hazard.small_spill if hazard else None) or SpillDistance()
+                    print(f"    [UN {hit.un_id} 初始隔離距離 (小量洩漏)]: "
+                          f"{format_distance(small.iso_m, small.iso_ft, 'm', 'ft') or 'N/A'}")
+        if answer.flags.is_water_reactive:
+            print(f"  {Color.WARNING}⚠ 禁水性 (遇水反應) 物質: {names('is_water_reactive')}{Color.ENDC}")
+            print(f"    遇水產生氣體: {', '.join(answer.water_reactive_gases) or '未知氣體'}")
+        if answer.flags.is_polymerization:
+            print(f"  {Color.WARNING}⚠ 聚合反應危害: {names('is_polymerization')}{Color.ENDC}")
+        if not answer.flags.has_hazard:
+            print(f"  {Color.GREEN}✔ 未發現特殊危害標記 (非 TIH/禁水/聚合反應物質){Color.ENDC}")
+
+        # 步驟 3: 各指南只檢索一次 (平行檢索)
+        print_step(f"步驟 3: 檢索 {len(answer.guides)} 份指南 (共用同一指南的物質只檢索一次)")
+        for guide in answer.guides:
+            self._print_guide(guide.guide_no, guide if guide.text else None)
+        print("\n")
+
+    @staticmethod
+    def _print_spill(spill: Optional[SpillDistance]):
+        spill = spill or SpillDistance()
+        na = lambda text: text or 'N/A'
+        print(f"      - 隔離距離: {na(format_distance(spill.iso_m, spill.iso_ft, 'm', 'ft'))}")
+        print(f"      - 防護距離 (日間): {na(format_distance(spill.day_km, spill.day_mi, 'km', 'mi'))}")
+        print(f"      - 防護距離 (夜間): {na(format_distance(spill.night_km, spill.night_mi, 'km', 'mi'))}")
+
+    @staticmethod
+    def _format_table3(hazard: DistanceInfo) -> str:
+        """將表3 數值資料排成文字 (各容器類型的初始隔離距離與各風速的日/夜防護距離)。"""
+        wind_labels = {"low_wind": "低風 (Low Wind)", "moderate_wind": "中風 (Moderate)", "high_wind": "強風 (High)"}
+        km = lambda value: "?" if value is None else f"{value:g}"
+        lines = []
+        for row in hazard.table3:
+            day = ", ".join(f"{wind_labels[w]}: {km(row.day_km[w])}km" for w in WIND_CLASSES)
+            night = ", ".join(f"{wind_labels[w]}: {km(row.night_km[w])}km" for w in WIND_CLASSES)
+            lines.append(f"- 容器類型 (Container): {row.container}")
+            lines.append(f"  初始隔離 (Initial Isolation): {km(row.initial_isolation_m)} meters")
+            lines.append(f"  日間防護距離 (Protective Distance Day): {day}")
+            lines.append(f"  夜間防護距離 (Protective Distance Night): {night}")
+        return "\n".join(lines)
+
     def run_scenario(self, title: str, material_query: str, guide_query: Optional[str] = None):
         print(f"{Color.BOLD}{Color.UNDERLINE}測試案例: {title}{Color.ENDC}")
         print("------------------------------------------------")
         
         # 1. 搜尋並識別物質
-        material_data = self.search_material(material_query)
-        if not material_data:
+        material = self.search_material(material_query)
+        if not material:
             print("\n")
             return
 
         # 2. 檢查 Metadata 中的關鍵危害 (TIH, 禁水, 聚合)
         print_info("檢查物質 Metadata 中的危害標記...")
-        has_hazard = False
+        flags = material.flags
+        hazard = self.hazard_info(material.un_id)
         
-        # 從 Metadata 讀取 TIH 資訊
-        if material_data.get('is_tih', False):
-            has_hazard = True
+        # 從綠色表格數值資料讀取 TIH 距離
+        if flags.is_tih:
             print(f"  {Color.WARNING}⚠ 吸入性中毒危害 (TIH) 物質{Color.ENDC}")
-            
-            # Safe access to fields (they might be empty strings)
-            # Metadata keys in build_rag_db_cn.py were: small_iso, small_day, etc.
-            small_iso = material_data.get('small_iso', 'N/A') or 'N/A'
-            small_day = material_data.get('small_day', 'N/A') or 'N/A'
-            small_night = material_data.get('small_night', 'N/A') or 'N/A'
-
-            large_iso = material_data.get('large_iso', 'N/A') or 'N/A'
-            large_day = material_data.get('large_day', 'N/A') or 'N/A'
-            large_night = material_data.get('large_night', 'N/A') or 'N/A'
-            large_note = material_data.get('large_note', '')
-            
+
             print(f"    {Color.BOLD}小量洩漏 (Small Spill):{Color.ENDC}")
-            print(f"      - 隔離距離: {small_iso}")
-            print(f"      - 防護距離 (日間): {small_day}")
-            print(f"      - 防護距離 (夜間): {small_night}")
+            self._print_spill(hazard.small_spill if hazard else None)
             
             print(f"    {Color.BOLD}大量洩漏 (Large Spill):{Color.ENDC}")
-            if large_note:
-                print(f"      - 注意: {large_note}")
+            if hazard and hazard.large_spill_see_table3:
+                print(f"      - 注意: Refer to Table 3 (請參閱表3)")
                 
                 # 若有 Table 3 資料，顯示之
-                table3_data = material_data.get('table3_content', '')
-                if table3_data:
+                if hazard.table3:
                     print(f"\n{Color.CYAN}    [其他參考資料: 表3 (大洩漏詳細距離)]{Color.ENDC}")
-                    # table3_data 在建立資料庫時已格式化為字串，直接印出即可
-                    # (去除前兩行標題以免重複，因為它包含了 "[詳細大量洩漏資料...]" )
-                    lines = table3_data.strip().splitlines()
-                    for line in lines:
+                    for line in self._format_table3(hazard).splitlines():
                         if line.strip():
                              print(f"      {line}")
                 else: 
                      print(f"      (雖然提示參閱表3，但資料庫中未找到此物質的表3詳細數據)")
 
             else:
-                print(f"      - 隔離距離: {large_iso}")
-                print(f"      - 防護距離 (日間): {large_day}")
-                print(f"      - 防護距離 (夜間): {large_night}")
+                self._print_spill(hazard.large_spill if hazard else None)
         
-        if material_data.get('is_water_reactive', False):
-             has_hazard = True
+        if flags.is_water_reactive:
              print(f"  {Color.WARNING}⚠ 禁水性 (遇水反應) 物質{Color.ENDC}")
-             gases = material_data.get('water_reactive_gases', '未知氣體')
-             if gases:
-                 print(f"    遇水產生氣體: {gases}")
+             gases = hazard.water_reactive_gases if hazard else None
+             print(f"    遇水產生氣體: {', '.join(gases) if gases else '未知氣體'}")
 
-        if material_data.get('is_polymerization', False):
-             has_hazard = True
+        if flags.is_polymerization:
              print(f"  {Color.WARNING}⚠ 聚合反應危害{Color.ENDC}")
 
-        if not has_hazard:
+        if not flags.has_hazard:
             print(f"  {Color.GREEN}✔ 未發現特殊危害標記 (非 TIH/禁水/聚合反應物質){Color.ENDC}")
 
         # 3. Guide Consultation (if needed)
         if guide_query:
-            self.consult_guide(str(material_data['guide_no']), guide_query)
+            self.consult_guide(material.guide_no, guide_query)
         else:
             print_info("此案例不包含指南內容檢索。")
         
         print("\n")
 
+def lookup_cli(queries: List[str], as_json: bool, backend: Optional[str] = None, vector_store: Optional[str] = None):
+    """
+    命令列快速查詢 (供事故處理腳本呼叫)：識別物質並列出綠色表格距離，不執行指南檢索。
+    UN 編號與名稱查詢由記憶體索引回答，不會載入 embedding 模型；只有索引未命中的查詢才載入。
+    """
+    if as_json:
+        # 直接使用引擎: 結果物件序列化為 JSON，載入訊息只寫到 stderr
+        engine = ERGEngine(embedding_backend=backend, vector_store=vector_store)
+        answers = []
+        for query in queries:
+            hit = engine.find_material(query)
+            answers.append({"query": query, "material": to_dict(hit),
+                            "hazard": to_dict(engine.hazard_info(hit.un_id)) if hit else None})
+        print(json.dumps(answers, ensure_ascii=False, indent=2))
+        return
+
+    rag = ERG_RAG_Demo(embedding_backend=backend, vector_store=vector_store)
+    for query in queries:
+        hit = rag.search_material(query)
+        hazard = rag.hazard_info(hit.un_id) if hit else None
+        if hazard:
+            for spill, label in (("small_spill", "小量洩漏 (Small Spill)"), ("large_spill", "大量洩漏 (Large Spill)")):
+                print(f"    {Color.BOLD}{label}:{Color.ENDC}")
+                if spill == "large_spill" and hazard.large_spill_see_table3:
+                    print(f"      - 注意: Refer to Table 3 (請參閱表3)")
+                    for line in rag._format_table3(hazard).splitlines():
+                        print(f"      {line}")
+                else:
+                    rag._print_spill(getattr(hazard, spill))
+        print()
+
+
 def main():
-    # 初始化測試類別
-    tester = ERG_RAG_Demo()
+    # 依 ERG_RAG_TRACE 環境變數註冊追蹤輸出 (例如 ERG_RAG_TRACE=histogram,jsonl:trace.jsonl)
+    configure_from_env()
+
+    parser = argparse.ArgumentParser(description="ERG RAG 演示；指定查詢時改為快速查詢物質與隔離/防護距離")
+    parser.add_argument("queries", nargs="*", help="物質查詢 (例如 'UN 1017'、'Chlorine')；省略時執行完整演示")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出查詢結果")
+    parser.add_argument("--backend", help="查詢用的 embedding 後端 (torch / onnx / onnx-int8)；預設沿用建置時的後端")
+    parser.add_argument("--vector-store", choices=VECTOR_STORES,
+                        help="向量查詢實作 (chroma / flat / hnsw)；預設使用 ERG_RAG_VECTOR_STORE 環境變數，未設定則為 chroma")
+    args = parser.parse_args()
+    if args.queries:
+        lookup_cli(args.queries, args.json, args.backend, args.vector_store)
+        return
+
+    # 初始化測試類別 (模型與向量資料庫在背景載入，第一個案例的索引查詢不必等待)
+    tester = ERG_RAG_Demo(warmup=True, embedding_backend=args.backend, vector_store=args.vector_store)
     
     # --- 測試案例 1 ---
     tester.run_scenario(
@@ -359,6 +415,53 @@ def main():
     
     tester.unified_query("工廠通報 UN 1005 (氨氣) 外洩，請提供並解釋疏散距離")
 
+    # 相同問題再次查詢: 整個查詢鏈直接由回應快取回傳 (資料庫重建後自動失效)
+    start = time.perf_counter()
+    tester.answer_question("附近發生氯氣 (Chlorine) 大量外洩，我該怎麼辦？")
+    print_result("重複查詢 (回應快取)", f"{(time.perf_counter() - start) * 1000:.2f}ms\n")
+
+    # 多物質事故: 同時識別所有物質、平行檢索各自的指南並合併危害
+    tester.unified_query("硫酸和汽油的槽車翻覆，現場還有氯氣與三氯矽烷外洩", incident=True)
+
+    # --- 測試案例 8 (批次查詢) ---
+    # 模擬列車貨單: 一次解析多個物質，並批次檢索各自指南的應變問題
+    print(f"\n{Color.BOLD}=== 進階功能演示: 批次查詢 (列車貨單) ==={Color.ENDC}")
+    manifest = ["UN 1005", "UN 1017", "Gasoline", "三氯矽烷", "Sulfuric acid", "UN 1203"]
+    materials = tester.search_manifest(manifest)
+
+    guides = tester.consult_guides_batch([
+        (hit.guide_no, "發生洩漏時應如何處置？") for hit in materials if hit
+    ])
+    for item in guides:
+        status = f"{len(item.text)} 字元" if item.text else "找不到指南內容"
+        print_result(f"指南 {item.guide_no}", status)
+    print("\n")
+
+    # --- 測試案例 9 (現場條件計算防護距離) ---
+    # 氯氣鐵路槽車大量洩漏: 依日/夜與風速直接計算，不經過向量檢索
+    if tester.distance_engine is not None:
+        print(f"{Color.BOLD}=== 進階功能演示: 依現場條件計算防護距離 (UN 1017 鐵路槽車) ==={Color.ENDC}")
+        for night in (False, True):
+            for wind in (5.0, 15.0, 30.0, None):
+                d = tester.protective_distance("1017", container="rail", night=night, wind_kmh=wind)
+                label = f"{'夜間' if night else '日間'}, 風速 {'未知' if wind is None else f'{wind:g} km/h'}"
+                note = " (最保守值)" if d["worst_case"] else ""
+                print_result(label, f"隔離 {d['isolation_m']:g} m, 防護 {d['protective_km']:g} km{note}")
+        print("\n")
+
+    info = tester.ef.cache_info()
+    print(f"{Color.HEADER}[Embedding 快取統計] 命中: {info['hits']}, 磁碟命中: {info['disk_hits']}, "
+          f"未命中: {info['misses']} (命中率 {info['hit_rate']:.0%}){Color.ENDC}")
+
+    info = tester.response_cache.cache_info()
+    print(f"{Color.HEADER}[回應快取統計] 命中: {info['hits']}, 共用快取命中: {info['shared_hits']}, "
+          f"未命中: {info['misses']} (命中率 {info['hit_rate']:.0%}){Color.ENDC}")
+
+    histogram = tracer.find_exporter(HistogramExporter)
+    if histogram:
+        print(f"\n{Color.HEADER}[各階段耗時統計]{Color.ENDC}")
+        print(histogram.format_table())
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,229 @@
+from typing import List, Dict, Any, Optional, Sequence, Union
+
+import numpy as np
+
+from hazard_table import HazardTable, WIND_CLASSES, FLAG_SEE_TABLE3
+from material_index import split_bilingual_name
+
+# Green Table 3 wind definitions: low < 10 km/h, moderate 10 - 20 km/h, high > 20 km/h
+LOW_WIND_MAX_KMH = 10.0
+HIGH_WIND_MIN_KMH = 20.0
+MPH_TO_KMH = 1.609344
+
+# Result sources
+SOURCE_NONE = 0    # No green table data for the UN ID (or no distance for that spill size)
+SOURCE_TABLE1 = 1
+SOURCE_TABLE3 = 2
+SOURCE_NAMES = {SOURCE_NONE: None, SOURCE_TABLE1: "table1", SOURCE_TABLE3: "table3"}
+
+# Extra keywords for container types, on top of the EN / CN names stored in the table
+CONTAINER_ALIASES = {
+    "rail": "Rail tank car",
+    "train": "Rail tank car",
+    "火車": "Rail tank car",
+    "truck": "Highway tank truck",
+    "trailer": "Highway tank truck",
+    "tanker": "Highway tank truck",
+    "槽車": "Highway tank truck",
+    "卡車": "Highway tank truck",
+    "nurse": "Agricultural nurse tank",
+    "農業": "Agricultural nurse tank",
+    "ton cylinders": "Multiple ton cylinders",
+    "噸級鋼瓶": "Multiple ton cylinders",
+    "small cylinder": "Multiple small cylinders",
+    "小型鋼瓶": "Multiple small cylinders",
+}
+
+
+def wind_class(wind_kmh: np.ndarray) -> np.ndarray:
+    """Wind speed (km/h) -> index into WIND_CLASSES; NaN (unknown) -> -1."""
+    wind_kmh = np.asarray(wind_kmh, dtype=np.float64)
+    classes = (wind_kmh >= LOW_WIND_MAX_KMH).astype(np.int8) + (wind_kmh > HIGH_WIND_MIN_KMH)
+    return np.where(np.isnan(wind_kmh), -1, classes).astype(np.int8)
+
+
+class ProtectiveDistanceEngine:
+    """
+    防護距離計算引擎：輸入 UN 編號、洩漏規模、容器類型、日/夜與風速，直接回傳初始隔離距離 (公尺) 與防護距離 (公里)。
+    所有輸入皆可為陣列 (可廣播)，一次計算整份貨單或整組風速情境，不經過 RAG / embedding。
+
+    選用規則 (依 ERG 綠色頁面)：
+    - 小量洩漏，或 Table 1 已列出大量洩漏距離者：使用 Table 1 (日/夜)。
+    - Table 1 註明「請參閱表3」的大量洩漏：使用 Table 3 (容器類型 x 日/夜 x 風速)。
+      容器或風速未知時取所有容器/風速中的最大值 (最保守)，並標記 worst_case。
+    """
+
+    def __init__(self, table: HazardTable):
+        self.table = table
+        mats = table.materials
+        count = len(mats)
+
+        # Table 1 as dense float arrays: [spill (small, large), row] and [spill, time (day, night), row]
+        self.t1_iso = np.stack([np.asarray(mats[f"{spill}_iso_m"], dtype=np.float32) for spill in ("small", "large")])
+        self.t1_protect = np.stack([
+            np.stack([np.asarray(mats[f"{spill}_{time}_km"], dtype=np.float32) for time in ("day", "night")])
+            for spill in ("small", "large")
+        ])
+        self.see_table3 = (np.asarray(mats["flags"]) & FLAG_SEE_TABLE3) > 0
+
+        # Table 3: (material row, container) -> table3 row, and per-row [time, wind] distances
+        t3 = table.table3
+        # A trailing NaN row keeps the gathers below valid even for a table without Table 3 data
+        self.t3_iso = np.append(np.asarray(t3["initial_isolation_m"], dtype=np.float32), np.nan)
+        self.t3_protect = np.concatenate([
+            np.stack([np.asarray(t3["day_km"]), np.asarray(t3["night_km"])], axis=1).astype(np.float32),
+            np.full((1, 2, len(WIND_CLASSES)), np.nan, dtype=np.float32)
+        ])
+        self.t3_index = np.full((count, max(1, len(table.containers))), -1, dtype=np.int32)
+
+        # Worst case over all containers of a material, used when the container is unknown
+        self.t3_max_iso = np.full(count, np.nan, dtype=np.float32)
+        self.t3_max_protect = np.full((count, 2, len(WIND_CLASSES)), np.nan, dtype=np.float32)
+        for row in range(count):
+            start, n = int(mats[row]["t3_start"]), int(mats[row]["t3_count"])
+            if not n:
+                continue
+            rows = np.arange(start, start + n)
+            self.t3_index[row, np.asarray(t3["container"][start:start + n], dtype=np.int64)] = rows
+            self.t3_max_iso[row] = self.t3_iso[rows].max()
+            self.t3_max_protect[row] = self.t3_protect[rows].max(axis=0)
+
+        self._container_keys = self._build_container_keys(table.containers)
+
+    @staticmethod
+    def _build_container_keys(containers: List[str]) -> List[tuple]:
+        keys = []
+        for pos, name in enumerate(containers):
+            # Full bilingual name, English part and Chinese part
+            keys.extend((key.lower(), pos) for key in {name, *split_bilingual_name(name)} if key)
+        for alias, prefix in CONTAINER_ALIASES.items():
+            for pos, name in enumerate(containers):
+                if name.lower().startswith(prefix.lower()):
+                    keys.append((alias.lower(), pos))
+                    break
+        # Longest key first, so "multiple small cylinders or single ton cylinder" wins over "small cylinder"
+        return sorted(keys, key=lambda item: -len(item[0]))
+
+    def _lookup_rows(self, un_ids: np.ndarray) -> np.ndarray:
+        if un_ids.dtype.kind in "iu":
+            ids = un_ids.astype(np.int64)
+            in_range = (ids >= 0) & (ids < len(self.table.un_lookup))
+            return np.where(in_range, self.table.un_lookup[np.where(in_range, ids, 0)], -1)
+        # Strings ("UN1017", "1017"): parse each distinct value once, a manifest repeats the same few IDs
+        unique, inverse = np.unique(un_ids.astype(str), return_inverse=True)
+        return self.table.rows(list(unique))[inverse].reshape(un_ids.shape)
+
+    def _lookup_containers(self, container: np.ndarray) -> np.ndarray:
+        if container.dtype.kind in "iu":
+            return container.astype(np.int64)
+        unique, inverse = np.unique(container.astype(str), return_inverse=True)
+        return np.array([self.resolve_container(c) for c in unique], dtype=np.int64)[inverse].reshape(container.shape)
+
+    def resolve_container(self, container: Union[str, int, None]) -> int:
+        """容器名稱 (中/英文，可為部分名稱或別名，例如 'rail'、'槽車') 或索引 -> 容器索引；無法辨識時回傳 -1。"""
+        if container is None:
+            return -1
+        if isinstance(container, (int, np.integer)):
+            return int(container) if 0 <= container < len(self.table.containers) else -1
+        text = container.strip().lower()
+        if not text or text == "none":
+            return -1
+        for key, pos in self._container_keys:
+            if text == key:
+                return pos
+        # Abbreviated name ("multiple ton"), a known name / alias inside free text ("chlorine rail car"),
+        # then any partial container name ("鋼瓶")
+        for key, pos in self._container_keys:
+            if key.startswith(text):
+                return pos
+        for key, pos in self._container_keys:
+            if key in text:
+                return pos
+        for pos, name in enumerate(self.table.containers):
+            if text in name.lower():
+                return pos
+        return -1
+
+    def evaluate(self, un_ids: Sequence, large_spill: Any = True, container: Any = -1,
+                 night: Any = False, wind_kmh: Any = np.nan) -> Dict[str, np.ndarray]:
+        """
+        向量化計算：各參數可為純量或陣列 (依 NumPy 規則廣播)。
+        un_ids 可為 UN 編號字串或整數；container 為容器索引 (-1 = 未知) 或名稱；wind_kmh 為 NaN 表示風速未知。
+        回傳各情境的陣列: isolation_m, protective_km (NaN = 無資料), source, container, wind_class, worst_case, found。
+        """
+        rows = self._lookup_rows(np.asarray(un_ids))
+        container = self._lookup_containers(np.asarray(container))
+
+        rows, large, container, night, wind = np.broadcast_arrays(
+            rows, np.asarray(large_spill, dtype=bool), container,
+            np.asarray(night, dtype=bool), np.asarray(wind_kmh, dtype=np.float64))
+
+        found = rows >= 0
+        row = np.where(found, rows, 0)
+        spill = large.astype(np.int64)
+        time = night.astype(np.int64)
+        wind_idx = wind_class(wind)
+        wind_known = wind_idx >= 0
+
+        # Table 1
+        iso = self.t1_iso[spill, row]
+        protect = self.t1_protect[spill, time, row]
+
+        # Table 3: known container -> that row; unknown container -> worst case over containers
+        use_t3 = found & large & self.see_table3[row]
+        valid_container = (container >= 0) & (container < self.t3_index.shape[1])
+        t3_row = np.where(valid_container, self.t3_index[row, np.clip(container, 0, self.t3_index.shape[1] - 1)], -1)
+        has_t3_row = t3_row >= 0
+        t3_row_safe = np.maximum(t3_row, 0)
+        safe_wind = np.maximum(wind_idx, 0)
+
+        t3_iso = np.where(has_t3_row, self.t3_iso[t3_row_safe], self.t3_max_iso[row])
+        by_row = np.where(wind_known, self.t3_protect[t3_row_safe, time, safe_wind],
+                          self.t3_protect[t3_row_safe, time].max(axis=-1))
+        by_max = np.where(wind_known, self.t3_max_protect[row, time, safe_wind],
+                          self.t3_max_protect[row, time].max(axis=-1))
+        t3_protect = np.where(has_t3_row, by_row, by_max)
+
+        iso = np.where(use_t3, t3_iso, iso)
+        protect = np.where(use_t3, t3_protect, protect)
+
+        iso = np.where(found, iso, np.nan).astype(np.float32)
+        protect = np.where(found, protect, np.nan).astype(np.float32)
+        has_value = ~np.isnan(iso) | ~np.isnan(protect)
+        source = np.where(has_value, np.where(use_t3, SOURCE_TABLE3, SOURCE_TABLE1), SOURCE_NONE).astype(np.int8)
+
+        return {
+            "isolation_m": iso,
+            "protective_km": protect,
+            "source": source,
+            "container": np.where(use_t3 & has_t3_row, container, -1).astype(np.int16),
+            "wind_class": np.where(use_t3, wind_idx, -1).astype(np.int8),
+            "worst_case": use_t3 & has_value & (~has_t3_row | ~wind_known),
+            "found": found,
+        }
+
+    def protective_distance(self, un_id: Union[str, int], large_spill: bool = True,
+                            container: Union[str, int, None] = None, night: bool = False,
+                            wind_kmh: Optional[float] = None) -> Dict[str, Any]:
+        """單一情境的便利介面，回傳可直接序列化為 JSON 的結果。"""
+        result = self.evaluate([un_id], large_spill, self.resolve_container(container), night,
+                               np.nan if wind_kmh is None else wind_kmh)
+        return self.to_records(result)[0]
+
+    def to_records(self, result: Dict[str, np.ndarray]) -> List[Dict[str, Any]]:
+        """將 evaluate() 的陣列結果轉為每個情境一個 dict (NaN -> None)。"""
+        optional = lambda value: None if np.isnan(value) else round(float(value), 3)
+        records = []
+        for pos in range(result["isolation_m"].size):
+            container = int(result["container"].flat[pos])
+            wind = int(result["wind_class"].flat[pos])
+            records.append({
+                "found": bool(result["found"].flat[pos]),
+                "isolation_m": optional(result["isolation_m"].flat[pos]),
+                "protective_km": optional(result["protective_km"].flat[pos]),
+                "source": SOURCE_NAMES[int(result["source"].flat[pos])],
+                "container": self.table.containers[container] if container >= 0 else None,
+                "wind_class": WIND_CLASSES[wind] if wind >= 0 else None,
+                "worst_case": bool(result["worst_case"].flat[pos]),
+            })
+        return records
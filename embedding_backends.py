@@ -0,0 +1,124 @@
+import os
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+
+# Runtime used to compute embeddings:
+# - torch:     sentence-transformers on PyTorch (original setup)
+# - onnx:      ONNX Runtime export of the same weights (fp32, much smaller memory footprint)
+# - onnx-int8: dynamically quantized ONNX export (int8 weights, fastest on CPU)
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+DEFAULT_BACKEND = "torch"
+BACKEND_ENV_VAR = "ERG_RAG_EMBEDDING_BACKEND"
+
+# torch and onnx run the same fp32 weights, so their vectors are interchangeable; int8 vectors are not
+VECTOR_SPACES = {"torch": "fp32", "onnx": "fp32", "onnx-int8": "int8"}
+
+# Collection metadata keys written by build_rag_db_cn.py
+METADATA_BACKEND = "embedding_backend"
+METADATA_MODEL = "embedding_model"
+
+# Quantized exports are created once and kept next to the DB (see model_cache_dir)
+MODEL_CACHE_DIRNAME = "models"
+# Instruction set targeted by the int8 export (avx2 runs on practically every x86 field laptop)
+QUANTIZATION_CONFIG = "avx2"
+
+
+def check_backend(backend: str) -> str:
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown embedding backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    return backend
+
+
+def embedding_id(model_name: str, backend: str) -> str:
+    """Identifies the vectors a (model, backend) pair produces; torch keeps the bare model name used so far."""
+    return model_name if backend == DEFAULT_BACKEND else f"{model_name}@{backend}"
+
+
+def recorded_backend(collection_metadata: Optional[Dict[str, Any]]) -> str:
+    """Backend a collection was built with; collections from before backends were recorded used torch."""
+    return (collection_metadata or {}).get(METADATA_BACKEND, DEFAULT_BACKEND)
+
+
+def check_compatible(build_backend: str, query_backend: str):
+    """Query vectors must live in the same space as the stored ones (e.g. onnx may query a torch-built DB)."""
+    if VECTOR_SPACES[check_backend(build_backend)] != VECTOR_SPACES[check_backend(query_backend)]:
+        raise ValueError(
+            f"embedding backend mismatch: the database was built with '{build_backend}' and cannot be queried "
+            f"with '{query_backend}'. Rebuild with `build_rag_db_cn.py --backend {query_backend}` or query with "
+            f"a {VECTOR_SPACES[build_backend]} backend."
+        )
+
+
+def model_cache_dir(db_dir: str) -> str:
+    """Where the quantized exports of a database live: inside its directory, wherever it is run from."""
+    return os.path.join(db_dir, MODEL_CACHE_DIRNAME)
+
+
+def load_sentence_transformer(model_name: str, backend: str, device: str = "cpu",
+                              cache_dir: Optional[str] = None, threads: Optional[int] = None):
+    """
+    cache_dir (model_cache_dir of the database) holds the onnx-int8 export; the other backends do not need it.
+    threads limits the intra-op threads of the runtime (None keeps its default of one per core).
+    With threads=1 neither runtime starts a thread pool, so the loaded model can be shared with forked workers.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    check_backend(backend)
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name, device=device)
+    model_kwargs = {}
+    if threads:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        model_kwargs["session_options"] = options
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device=device, backend="onnx", model_kwargs=model_kwargs or None)
+
+    # onnx-int8: export and quantize once, then load the quantized file from the local copy
+    if cache_dir is None:
+        raise ValueError("the onnx-int8 backend needs the model cache directory of the database (model_cache_dir)")
+    local_dir = os.path.join(cache_dir, f"{model_name.replace('/', '_')}-onnx")
+    file_name = os.path.join("onnx", f"model_qint8_{QUANTIZATION_CONFIG}.onnx")
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        model = SentenceTransformer(model_name, device=device, backend="onnx")
+        model.save(local_dir)
+        export_dynamic_quantized_onnx_model(model, QUANTIZATION_CONFIG, local_dir)
+    return SentenceTransformer(local_dir, device=device, backend="onnx",
+                               model_kwargs={"file_name": file_name, **model_kwargs})
+
+
+class BackendEmbeddingFunction(SentenceTransformerEmbeddingFunction):
+    """
+    chromadb's sentence-transformers embedding function with a selectable runtime backend.
+    Models are shared per (model, backend) within a process (and with processes forked after loading);
+    threads only applies when the model is first loaded.
+    """
+
+    _models: Dict[Tuple[str, str], Any] = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_name: str, backend: str = DEFAULT_BACKEND, threads: Optional[int] = None,
+                 cache_dir: Optional[str] = None):
+        self.model_name = model_name
+        self.backend = check_backend(backend)
+        self.device = "cpu"
+        self.normalize_embeddings = False
+        # Persisted in the collection configuration; torch matches chromadb's own function exactly
+        self.kwargs = {} if backend == DEFAULT_BACKEND else {"backend": "onnx"}
+
+        with self._models_lock:
+            key = (model_name, backend)
+            if key not in self._models:
+                self._models[key] = load_sentence_transformer(model_name, backend, self.device, cache_dir=cache_dir,
+                                                                threads=threads)
+            self._model = self._models[key]
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction, Documents, Embeddings
+
+from instrumentation import tracer
+
+# Default sizes: the dispatch center only repeats a few hundred distinct phrases per shift
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_DISK_CAPACITY = 16384
+
+DISK_META_FILE = "meta.json"
+DISK_KEYS_FILE = "keys.tsv"
+DISK_VECTORS_FILE = "vectors.f32"
+# The key log is rewritten (one line per live row) on open and whenever it grows past this many times the capacity
+DISK_LOG_COMPACT_FACTOR = 2
+
+
+def normalize_text(text: str) -> str:
+    # Only fold width/whitespace; the multilingual model is case-sensitive so case is kept
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(text: str, model_name: str) -> str:
+    return hashlib.sha1(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class DiskEmbeddingStore:
+    """
+    Memory-mapped on-disk tier: a fixed-size float32 matrix plus an append-only key log.
+    Rows are reused ring-buffer style once the capacity is reached; the latest log line for a row wins.
+    Opening compacts the log and drops keys whose vector did not reach the matrix (interrupted writes).
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, capacity: int = DEFAULT_DISK_CAPACITY):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.capacity = capacity
+        self.dim: Optional[int] = None
+        self.rows: Dict[str, int] = {}
+        self._owners: Dict[int, str] = {}
+        self._next_row = 0
+        self._vectors: Optional[np.memmap] = None
+        self._keys_file = None
+        self._log_lines = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, DISK_META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model_name") == model_name and meta.get("capacity") == capacity:
+                stored_rows = self._open(meta["dim"], mode="r+")
+                self._load_keys(stored_rows)
+            else:
+                # Different model or size: the stored vectors are unusable
+                self._reset()
+
+    def _open(self, dim: int, mode: str) -> int:
+        """Map the matrix; returns how many rows the file held before (all of them for a fresh "w+" matrix)."""
+        self.dim = dim
+        path = os.path.join(self.cache_dir, DISK_VECTORS_FILE)
+        size = self.capacity * dim * 4
+        stored_rows = self.capacity
+        if mode == "r+":
+            stored = os.path.getsize(path) if os.path.exists(path) else 0
+            stored_rows = min(stored // (dim * 4), self.capacity)
+            if stored < size:
+                # Interrupted before the matrix was allocated: grow it back (zeros), the missing rows are lost
+                with open(path, "ab") as f:
+                    f.truncate(size)
+        self._vectors = np.memmap(path, dtype=np.float32, mode=mode, shape=(self.capacity, dim))
+        if mode == "w+":
+            # A fresh matrix also starts a fresh key log
+            self._keys_file = open(os.path.join(self.cache_dir, DISK_KEYS_FILE), "w", encoding="utf-8")
+        return stored_rows
+
+    def _load_keys(self, stored_rows: int):
+        # Row -> key in log order of each row's latest line
+        owners: Dict[int, str] = {}
+        path = os.path.join(self.cache_dir, DISK_KEYS_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 2 or not parts[1].isdigit() or int(parts[1]) >= self.capacity:
+                        continue # Truncated write from an interrupted run
+                    row = int(parts[1])
+                    owners.pop(row, None)
+                    owners[row] = parts[0]
+
+        # Keep only rows the matrix actually holds: a key line can outlive its vector write (never-written rows
+        # are all zeros, and no embedding is)
+        rows = [row for row in owners if row < stored_rows]
+        written = np.any(self._vectors[rows] != 0, axis=1) if rows else []
+        self._owners = {row: owners[row] for row, ok in zip(rows, written) if ok}
+        self.rows = {key: row for row, key in self._owners.items()}
+        # The ring continues after the most recently written row that survived
+        self._next_row = (next(reversed(self._owners)) + 1) % self.capacity if self._owners else 0
+        self._compact()
+
+    def _compact(self):
+        """Rewrite the key log as one line per live row, oldest first, so the ring position survives a reopen."""
+        if self._keys_file is not None:
+            self._keys_file.close()
+        path = os.path.join(self.cache_dir, DISK_KEYS_FILE)
+        order = sorted(self._owners, key=lambda row: (row - self._next_row) % self.capacity)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(f"{self._owners[row]}\t{row}\n" for row in order)
+        os.replace(path + ".tmp", path)
+        self._keys_file = open(path, "a", encoding="utf-8")
+        self._log_lines = len(order)
+
+    def _reset(self):
+        for name in (DISK_META_FILE, DISK_KEYS_FILE, DISK_VECTORS_FILE):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _init_storage(self, dim: int):
+        with open(os.path.join(self.cache_dir, DISK_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"model_name": self.model_name, "dim": dim, "capacity": self.capacity}, f)
+        self._open(dim, mode="w+")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._vectors[row])
+
+    def put(self, key: str, vector: np.ndarray):
+        if self._vectors is None:
+            self._init_storage(len(vector))
+
+        row = self._next_row
+        self._next_row = (row + 1) % self.capacity
+
+        # Evict whichever key previously owned this row
+        old_key = self._owners.get(row)
+        if old_key is not None:
+            self.rows.pop(old_key, None)
+
+        self._vectors[row] = vector
+        self.rows[key] = row
+        self._owners[row] = key
+        self._keys_file.write(f"{key}\t{row}\n")
+        self._log_lines += 1
+
+    def flush(self):
+        if self._vectors is not None:
+            # Vectors first: a key must never reach the disk before its vector
+            self._vectors.flush()
+            if self._log_lines > DISK_LOG_COMPACT_FACTOR * self.capacity:
+                self._compact()
+            else:
+                self._keys_file.flush()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    包裝既有的 embedding function，為查詢文字加上 LRU 快取 (可選擇搭配磁碟快取)。
+    快取鍵為「正規化文字 + 模型名稱」，只有未命中的文字才會送進模型 (一次批次計算)。
+    """
+
+    def __init__(self, embedding_function: EmbeddingFunction, model_name: str,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, cache_dir: Optional[str] = None,
+                 disk_capacity: int = DEFAULT_DISK_CAPACITY):
+        self._ef = embedding_function
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._disk = DiskEmbeddingStore(cache_dir, model_name, disk_capacity) if cache_dir else None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = [normalize_text(t) for t in input]
+        keys = [cache_key(t, self.model_name) for t in texts]
+        vectors: List[Optional[np.ndarray]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+        hits = disk_hits = 0
+
+        with self._lock:
+            for pos, key in enumerate(keys):
+                vec = self._memory.get(key)
+                if vec is not None:
+                    self._memory.move_to_end(key)
+                    hits += 1
+                elif self._disk is not None and (vec := self._disk.get(key)) is not None:
+                    self._remember(key, vec)
+                    disk_hits += 1
+
+                if vec is not None:
+                    vectors[pos] = vec
+                elif key in pending:
+                    # Duplicate text inside the same batch: embed once
+                    pending[key].append(pos)
+                    hits += 1
+                else:
+                    pending[key] = [pos]
+            self.hits += hits
+            self.disk_hits += disk_hits
+            self.misses += len(pending)
+
+        tracer.count("embedding_cache.hit", hits)
+        tracer.count("embedding_cache.disk_hit", disk_hits)
+        tracer.count("embedding_cache.miss", len(pending))
+
+        if pending:
+            miss_keys = list(pending)
+            with tracer.span("embedding.model", size=len(miss_keys)):
+                embedded = self._ef([texts[pending[k][0]] for k in miss_keys])
+            with self._lock:
+                for key, vec in zip(miss_keys, embedded):
+                    vec = np.asarray(vec, dtype=np.float32)
+                    self._remember(key, vec)
+                    if self._disk is not None:
+                        self._disk.put(key, vec)
+                    for pos in pending[key]:
+                        vectors[pos] = vec
+                if self._disk is not None:
+                    self._disk.flush()
+
+        return vectors
+
+    def _remember(self, key: str, vec: np.ndarray):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def cache_info(self) -> Dict[str, Any]:
+        total = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self._disk) if self._disk is not None else 0,
+        }
+
+    # Chroma checks these against the persisted collection config, so mirror the wrapped function
+    def name(self) -> str:
+        return self._ef.name()
+
+    def get_config(self) -> Dict[str, Any]:
+        return self._ef.get_config()
+
+    def default_space(self):
+        return self._ef.default_space()
+
+    def supported_spaces(self):
+        return self._ef.supported_spaces()
+
+    def is_legacy(self) -> bool:
+        return self._ef.is_legacy()
@@ -0,0 +1,236 @@
+from collections import deque
+from typing import List, Dict, Any, Iterable, Tuple, Set
+
+import numpy as np
+
+from material_index import normalize_name, split_bilingual_name, material_names, CJK_PATTERN, MIN_PREFIX_LEN
+
+# Saved next to the Chroma DB by build_rag_db_cn.py; material rows follow material_index.json order
+ENTITY_EXTRACTOR_FILENAME = "entity_extractor.npz"
+
+# Chinese names put the qualifier in front ("無水氨" = "Ammonia, anhydrous") or append the form ("苯乙烯單體");
+# without it they are the common name
+CN_QUALIFIER_PREFIXES = ("無水", "精製")
+CN_QUALIFIER_SUFFIXES = ("單體",)
+
+# Row of a synonym shared by materials under different guides: it is matched (so a shorter synonym inside it,
+# e.g. "氨" in "氨水溶液", does not claim the text) but reported as no material
+AMBIGUOUS_ROW = -2
+
+# A one-character CJK name (氯, 鈉, 碳) inside other CJK text is usually part of a compound name (氯化鈉, 碳酸鈣);
+# it only counts next to a common-name affix (液氯, 氯氣) or with non-CJK characters / a conjunction on both sides
+CN_COMMON_NAME_PREFIXES = "液"
+CN_COMMON_NAME_SUFFIXES = "氣"
+CN_CONJUNCTIONS = "與和及或"
+# An acid name followed by a cation names its salt (硫酸銅 is copper sulfate, not sulfuric acid)
+CN_SALT_CATIONS = "鈉鉀鋰鈣鎂鋇鍶鋁鋅銅鐵錳鉻鎳鈷鉛銀汞錫銨"
+CN_NOT_SALTS = ("鐵路", "鐵桶")
+
+# Transitions are keyed by (state << CODE_BITS | code point) in one flat dict (code points < 2**21)
+CODE_BITS = 21
+
+
+def _is_word_char(text: str, pos: int) -> bool:
+    return 0 <= pos < len(text) and (text[pos].isascii() and text[pos].isalnum())
+
+
+def _is_cjk_char(text: str, pos: int) -> bool:
+    return 0 <= pos < len(text) and CJK_PATTERN.match(text[pos]) is not None
+
+
+def _stands_alone_cjk(text: str, start: int, end: int) -> bool:
+    """Whether the CJK name text[start:end] is not just part of a longer compound name around it."""
+    if end - start == 1:
+        before = text[start - 1] if start else ""
+        after = text[end] if end < len(text) else ""
+        if (before and before in CN_COMMON_NAME_PREFIXES) or (after and after in CN_COMMON_NAME_SUFFIXES):
+            return True
+        return ((not _is_cjk_char(text, start - 1) or before in CN_CONJUNCTIONS)
+                and (not _is_cjk_char(text, end) or after in CN_CONJUNCTIONS))
+    return not (text[end - 1] == "酸" and end < len(text) and text[end] in CN_SALT_CATIONS
+                and not text.startswith(CN_NOT_SALTS, end))
+
+
+def common_names(part: str) -> List[str]:
+    """Shorter names a normalized EN or CN name is commonly known by: its head before a comma, without a CN qualifier."""
+    head = part.split(",", 1)[0].strip()
+    names = [head] if head != part else []
+    for prefix in CN_QUALIFIER_PREFIXES:
+        if head.startswith(prefix) and len(head) > len(prefix):
+            names.append(head[len(prefix):])
+    for suffix in CN_QUALIFIER_SUFFIXES:
+        if head.endswith(suffix) and len(head) > len(suffix):
+            names.append(head[:-len(suffix)])
+    return [name for name in names if any(ch.isalpha() for ch in name)]
+
+
+class EntityExtractorBuilder:
+    """
+    Collects the material names and aliases (full / EN / CN, as in MaterialIndex.by_name) one record at a time
+    and compiles them into an Aho-Corasick automaton. Names of the form "Hydrogen, compressed" also register their
+    head ("hydrogen", "氫") as a synonym, and CN names lose a qualifier ("無水氨" -> "氨", "苯乙烯單體" -> "苯乙烯");
+    a one-character name is only extracted with a common-name affix or standing apart ("氨氣", "液氨", see extract),
+    Synonyms shared by materials under different guides are kept only to block the shorter names inside them.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._names: Dict[str, int] = {}
+        # head -> (row of its shortest full name, that name's length, guide numbers)
+        self._heads: Dict[str, Tuple[int, int, Set[str]]] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, meta: Dict[str, Any]):
+        row = self.count
+        self.count += 1
+        guide_no = str(meta["guide_no"]).rstrip("P")
+        for name in material_names(meta):
+            en_name, cn_name = split_bilingual_name(name)
+            for key in (normalize_name(name), normalize_name(en_name), normalize_name(cn_name)):
+                if key:
+                    self._names.setdefault(key, row)
+
+            for part in (en_name, cn_name):
+                # NFKC turns the full-width "，" of CN names into ","
+                for head in common_names(normalize_name(part)):
+                    best_row, best_len, guides = self._heads.get(head, (row, len(name), set()))
+                    if len(name) < best_len:
+                        best_row, best_len = row, len(name)
+                    guides.add(guide_no)
+                    self._heads[head] = (best_row, best_len, guides)
+
+    def synonyms(self) -> Dict[str, int]:
+        return {head: row for head, (row, _, guides) in self._heads.items()
+                if len(guides) == 1 and head not in self._names}
+
+    def ambiguous(self) -> Dict[str, int]:
+        return {head: AMBIGUOUS_ROW for head, (_, _, guides) in self._heads.items()
+                if len(guides) > 1 and head not in self._names}
+
+    def build(self) -> "EntityExtractor":
+        patterns = {**self.ambiguous(), **self.synonyms(), **self._names}
+
+        # Trie
+        goto: List[Dict[str, int]] = [{}]
+        rows = [-1]
+        depths = [0]
+        for key in sorted(patterns):
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    rows.append(-1)
+                    depths.append(depths[state] + 1)
+                state = nxt
+            rows[state] = patterns[key]
+
+        # Failure links (longest proper suffix that is a trie path) and output links (nearest name on that chain),
+        # breadth first so every suffix state is linked before the states that point to it
+        fail = [0] * len(goto)
+        output = [-1] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                link = fail[state]
+                while link and ch not in goto[link]:
+                    link = fail[link]
+                fail[nxt] = goto[link].get(ch, 0) if state else 0
+                output[nxt] = fail[nxt] if rows[fail[nxt]] != -1 else output[fail[nxt]]
+                queue.append(nxt)
+
+        edges = [(state, ord(ch), nxt) for state, table in enumerate(goto) for ch, nxt in table.items()]
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 3)
+        return EntityExtractor(edges[:, 0], edges[:, 1], edges[:, 2], np.array(fail, dtype=np.int32),
+                               np.array(output, dtype=np.int32), np.array(rows, dtype=np.int32),
+                               np.array(depths, dtype=np.int32), self.count)
+
+
+class EntityExtractor:
+    """
+    物質名稱擷取器：建置時編譯的 Aho-Corasick 自動機 (所有中英文物質名稱與同義詞)，
+    單次線性掃描即可找出問句中提到的所有物質，不需呼叫 embedding 模型。
+    """
+
+    def __init__(self, edge_states: np.ndarray, edge_codes: np.ndarray, edge_targets: np.ndarray, fail: np.ndarray,
+                 output: np.ndarray, rows: np.ndarray, depths: np.ndarray, count: int):
+        self._arrays = {"edge_states": edge_states, "edge_codes": edge_codes, "edge_targets": edge_targets,
+                        "fail": fail, "output": output, "rows": rows, "depths": depths}
+        self.count = count
+        # Plain Python containers: the scan does one dict lookup per character
+        keys = (edge_states.astype(np.int64) << CODE_BITS) | edge_codes.astype(np.int64)
+        self._goto = dict(zip(keys.tolist(), edge_targets.tolist()))
+        self._fail = fail.tolist()
+        self._output = output.tolist()
+        self._rows = rows.tolist()
+        self._depths = depths.tolist()
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def states(self) -> int:
+        return len(self._rows)
+
+    @classmethod
+    def build(cls, materials: Iterable[Dict[str, Any]]) -> "EntityExtractor":
+        builder = EntityExtractorBuilder()
+        for meta in materials:
+            builder.add(meta)
+        return builder.build()
+
+    def save(self, path: str):
+        np.savez_compressed(path, count=np.array(self.count), **self._arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "EntityExtractor":
+        with np.load(path) as f:
+            arrays = {name: f[name] for name in f.files if name != "count"}
+            return cls(count=int(f["count"]), **arrays)
+
+    def extract(self, key: str) -> List[Tuple[int, int, int]]:
+        """
+        找出文字中提到的所有物質，回傳 [(物質索引列, 起點, 終點)]，依出現順序排列。
+        key 須先經過 normalize_name()，位置即為其中的字元位置。
+        重疊時由左至右取最長的名稱 (「硫酸」優先於「硫」)；英文名稱須為完整單字 ("tin" 不匹配 "containing")。
+        中文名稱不可只是更長化學名稱的一部分：單字名稱須有常用詞綴 (液氯、氯氣) 或前後不是中文字
+        (「氯化鈉」不匹配「氯」與「鈉」)，酸名稱後接陽離子時為其鹽類 (「硫酸銅」不匹配「硫酸」)。
+        """
+        goto, fail, output, rows, depths = self._goto, self._fail, self._output, self._rows, self._depths
+        found = []
+        state = 0
+        for end, ch in enumerate(key, 1):
+            code = ord(ch)
+            while True:
+                nxt = goto.get(state << CODE_BITS | code)
+                if nxt is not None or not state:
+                    state = nxt or 0
+                    break
+                state = fail[state]
+            match = state if rows[state] != -1 else output[state]
+            while match > 0:
+                start = end - depths[match]
+                name = key[start:end]
+                if CJK_PATTERN.search(name):
+                    accepted = _stands_alone_cjk(key, start, end)
+                else:
+                    accepted = (len(name) >= MIN_PREFIX_LEN and not _is_word_char(key, start - 1)
+                                and not _is_word_char(key, end))
+                if accepted:
+                    found.append((start, -end, rows[match]))
+                match = output[match]
+
+        # Leftmost-longest, non-overlapping
+        mentions = []
+        last_end = 0
+        for start, neg_end, row in sorted(found):
+            if start >= last_end:
+                if row != AMBIGUOUS_ROW:
+                    mentions.append((row, start, -neg_end))
+                last_end = -neg_end
+        return mentions
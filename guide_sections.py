@@ -0,0 +1,84 @@
+import re
+from typing import List, Dict, Tuple
+
+# Top-level ERG guide headings -> section key.
+# HEALTH / FIRE OR EXPLOSION stay inside potential_hazards; PROTECTIVE CLOTHING / EVACUATION inside public_safety.
+SECTION_HEADINGS = [
+    ("potential_hazards", re.compile(r"^POTENTIAL HAZARDS(\s*\(|$)")),
+    ("public_safety", re.compile(r"^PUBLIC SAFETY(\s*\(|$)")),
+    ("fire", re.compile(r"^FIRE(\s*\(|$)")),
+    ("spill", re.compile(r"^SPILL OR LEAK(\s*\(|$)")),
+    ("first_aid", re.compile(r"^FIRST AID(\s*\(|$)")),
+]
+# "EMERGENCY RESPONSE" only groups FIRE / SPILL OR LEAK / FIRST AID, so it carries no text of its own
+GROUP_HEADING = re.compile(r"^EMERGENCY RESPONSE(\s*\(|$)")
+
+SECTION_ORDER = [key for key, _ in SECTION_HEADINGS]
+SECTION_LABELS = {
+    "intro": "如何使用 (HOW TO USE)",
+    "potential_hazards": "潛在危害 (POTENTIAL HAZARDS)",
+    "public_safety": "公共安全 (PUBLIC SAFETY)",
+    "fire": "火災 (FIRE)",
+    "spill": "洩漏 (SPILL OR LEAK)",
+    "first_aid": "急救 (FIRST AID)",
+}
+
+# Question keywords (CN / EN) -> sections worth retrieving
+SECTION_KEYWORDS = {
+    "first_aid": ["急救", "吸入", "誤食", "喝", "吞", "皮膚", "眼睛", "接觸", "中毒", "傷者", "就醫",
+                  "first aid", "inhal", "swallow", "ingest", "skin", "eye", "victim"],
+    "fire": ["火災", "滅火", "起火", "著火", "燃燒", "滅火劑", "fire", "extinguish", "burning"],
+    "spill": ["洩漏", "外洩", "溢出", "漏出", "滲漏", "spill", "leak"],
+    "public_safety": ["疏散", "撤離", "距離", "隔離", "防護衣", "防護裝備", "居民", "民眾",
+                      "evacuat", "distance", "isolat", "protective", "clothing"],
+    "potential_hazards": ["危害", "危險", "健康", "爆炸", "毒性", "hazard", "health", "explo", "toxic"],
+}
+
+
+def split_guide_sections(guide_body: str) -> List[Dict[str, str]]:
+    """
+    將單一指南內文依章節標題切成 chunks: [{"section", "heading", "content"}, ...]。
+    第一個標題前的文字 (例如指南標題) 併入第一個章節；同一章節重複出現時 (資料中的附錄頁) 各自保留為獨立 chunk。
+    """
+    chunks: List[Dict[str, str]] = []
+    preamble: List[str] = []
+    current = None
+
+    for line in guide_body.split("\n"):
+        stripped = line.strip()
+        if GROUP_HEADING.match(stripped):
+            continue
+
+        section = next((key for key, pattern in SECTION_HEADINGS if pattern.match(stripped)), None)
+        if section:
+            current = {"section": section, "heading": stripped, "lines": []}
+            chunks.append(current)
+        elif current is None:
+            if stripped:
+                preamble.append(stripped)
+        else:
+            current["lines"].append(line)
+
+    if not chunks:
+        return [{"section": "potential_hazards", "heading": "", "content": guide_body.strip()}]
+
+    if preamble:
+        chunks[0]["lines"] = preamble + chunks[0]["lines"]
+
+    return [
+        {"section": c["section"], "heading": c["heading"], "content": "\n".join(c["lines"]).strip()}
+        for c in chunks
+    ]
+
+
+def route_question(question: str) -> List[str]:
+    """依問題關鍵字挑選相關章節 (依指南中的章節順序)；沒有關鍵字時回傳空列表，交由向量搜尋決定。"""
+    text = question.lower()
+    return [section for section in SECTION_ORDER
+            if any(keyword in text for keyword in SECTION_KEYWORDS[section])]
+
+
+def order_sections(sections: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """Sort retrieved (section, text) pairs into guide order so the answer reads top to bottom."""
+    rank = {key: pos for pos, key in enumerate(["intro"] + SECTION_ORDER)}
+    return sorted(sections, key=lambda item: rank.get(item[0], len(rank)))
@@ -0,0 +1,248 @@
+import json
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# Saved next to the Chroma DB by build_rag_db_cn.py
+HAZARD_TABLE_FILENAME = "hazard_table.bin"
+
+FILE_MAGIC = b"ERGHZT01"
+FILE_VERSION = 1
+ALIGNMENT = 64
+
+# UN IDs are 4-digit numbers, so a direct-address array maps UN ID -> row in O(1)
+UN_ID_SLOTS = 10000
+
+WIND_CLASSES = ["low_wind", "moderate_wind", "high_wind"]
+SPILLS = ["small", "large"]
+
+# Row flags
+FLAG_TABLE1 = 1           # Has Green Table 1 distances
+FLAG_SEE_TABLE3 = 2       # Table 1 large spill says "Refer to Table 3"
+FLAG_WATER_REACTIVE = 4   # Listed in Green Table 2
+FLAG_TABLE3 = 8           # Has Green Table 3 container rows
+
+# "30 m (100 ft)" / "0.2 km (0.1 mi)"
+DISTANCE_PATTERN = re.compile(r"^\s*([\d.]+)\s*(m|km)\s*\(\s*([\d.]+)\s*(ft|mi)\s*\)\s*$")
+
+# Table 1 columns per spill size: isolation (m / ft), protective distance day and night (km / mi).
+# Missing values are NaN.
+TABLE1_FIELDS = [
+    ("isolation_distance", "iso_m", "iso_ft"),
+    ("protect_day", "day_km", "day_mi"),
+    ("protect_night", "night_km", "night_mi"),
+]
+
+MATERIAL_DTYPE = np.dtype(
+    [("un_id", "<u2"), ("flags", "u1"), ("gas_mask", "<u4")]
+    + [(f"{spill}_{column}", "<f4") for spill in SPILLS for _, metric, imperial in TABLE1_FIELDS
+       for column in (metric, imperial)]
+    + [("t3_start", "<u2"), ("t3_count", "<u2")]
+)
+TABLE3_DTYPE = np.dtype([
+    ("container", "<u2"),
+    ("initial_isolation_m", "<f4"),
+    ("day_km", "<f4", (len(WIND_CLASSES),)),
+    ("night_km", "<f4", (len(WIND_CLASSES),)),
+])
+UN_LOOKUP_DTYPE = np.dtype("<i2") # At most UN_ID_SLOTS rows
+
+# Array layout of the binary file; changing a dtype means bumping FILE_VERSION
+FILE_ARRAYS = [("materials", MATERIAL_DTYPE), ("table3", TABLE3_DTYPE), ("un_lookup", UN_LOOKUP_DTYPE)]
+
+
+def parse_distance(text: str) -> Tuple[float, float]:
+    """'30 m (100 ft)' -> (30.0, 100.0); unparseable text -> (nan, nan)."""
+    match = DISTANCE_PATTERN.match(text or "")
+    if not match:
+        return float("nan"), float("nan")
+    return float(match.group(1)), float(match.group(3))
+
+
+def format_distance(metric: Optional[float], imperial: Optional[float], metric_unit: str, imperial_unit: str) -> str:
+    """Inverse of parse_distance, e.g. (0.2, 0.1, 'km', 'mi') -> '0.2 km (0.1 mi)'. Missing values (None / NaN) -> ''."""
+    if metric is None or np.isnan(metric):
+        return ""
+    text = f"{metric:g} {metric_unit}"
+    return text if imperial is None or np.isnan(imperial) else f"{text} ({imperial:g} {imperial_unit})"
+
+
+def _un_digits(value: Any) -> str:
+    return "".join(filter(str.isdigit, str(value)))
+
+
+def _optional(value: float) -> Optional[float]:
+    # float32 storage: round away the representation noise (ERG distances have at most one decimal)
+    return None if np.isnan(value) else round(float(value), 3)
+
+
+class HazardTable:
+    """
+    綠色表格 (Table 1/2/3) 的數值化儲存：以 UN 編號直接定址，O(1) 取得隔離與防護距離。
+    資料存成單一二進位檔 (JSON 標頭 + 對齊的 NumPy 結構化陣列)，載入時以 memory-map 開啟，不需解析字串。
+    """
+
+    def __init__(self, materials: np.ndarray, table3: np.ndarray, un_lookup: np.ndarray,
+                 gases: List[str], containers: List[str]):
+        self.materials = materials
+        self.table3 = table3
+        self.un_lookup = un_lookup
+        self.gases = gases
+        self.containers = containers
+
+    def __len__(self) -> int:
+        return len(self.materials)
+
+    @classmethod
+    def build(cls, gt1: Dict[str, Any], gt2: Dict[str, Any], gt3: Dict[str, Any]) -> "HazardTable":
+        gt3_by_un = {_un_digits(chem.get("un_number", "")): chem for chem in gt3.get("chemicals", [])}
+        gt3_by_un.pop("", None)
+
+        gases = sorted({gas for entries in gt2.values() for entry in entries for gas in entry.get("tih_gases", [])})
+        gas_bits = {gas: 1 << pos for pos, gas in enumerate(gases)}
+        container_ids: Dict[str, int] = {}
+
+        un_ids = sorted(set(gt1) | set(gt2) | set(gt3_by_un), key=int)
+        materials = np.zeros(len(un_ids), dtype=MATERIAL_DTYPE)
+        t3_rows = []
+
+        for row, un_id in enumerate(un_ids):
+            rec = materials[row]
+            rec["un_id"] = int(un_id)
+            flags = 0
+
+            for spill in SPILLS:
+                for _, metric, imperial in TABLE1_FIELDS:
+                    rec[f"{spill}_{metric}"] = rec[f"{spill}_{imperial}"] = np.nan
+            if un_id in gt1:
+                flags |= FLAG_TABLE1
+                for spill in SPILLS:
+                    data = gt1[un_id].get(f"{spill}_spill", {})
+                    if "note" in data:
+                        flags |= FLAG_SEE_TABLE3
+                    for source, metric, imperial in TABLE1_FIELDS:
+                        rec[f"{spill}_{metric}"], rec[f"{spill}_{imperial}"] = parse_distance(data.get(source, ""))
+
+            if un_id in gt2:
+                flags |= FLAG_WATER_REACTIVE
+                mask = 0
+                for entry in gt2[un_id]:
+                    for gas in entry.get("tih_gases", []):
+                        mask |= gas_bits[gas]
+                rec["gas_mask"] = mask
+
+            rec["t3_start"] = len(t3_rows)
+            for container in gt3_by_un.get(un_id, {}).get("containers", []):
+                flags |= FLAG_TABLE3
+                ctype = container.get("type", "Unknown Container")
+                day, night = container.get("day_km", {}), container.get("night_km", {})
+                t3_rows.append((
+                    container_ids.setdefault(ctype, len(container_ids)),
+                    float(container.get("initial_isolation_m", np.nan)),
+                    [float(day.get(wind, np.nan)) for wind in WIND_CLASSES],
+                    [float(night.get(wind, np.nan)) for wind in WIND_CLASSES],
+                ))
+            rec["t3_count"] = len(t3_rows) - rec["t3_start"]
+            rec["flags"] = flags
+
+        containers = sorted(container_ids, key=container_ids.get)
+        table3 = np.array(t3_rows, dtype=TABLE3_DTYPE)
+
+        un_lookup = np.full(UN_ID_SLOTS, -1, dtype=UN_LOOKUP_DTYPE)
+        un_lookup[materials["un_id"]] = np.arange(len(materials), dtype=UN_LOOKUP_DTYPE)
+        return cls(materials, table3, un_lookup, gases, containers)
+
+    def save(self, path: str):
+        arrays = {"materials": self.materials, "table3": self.table3, "un_lookup": self.un_lookup}
+        for name, dtype in FILE_ARRAYS:
+            arrays[name] = np.asarray(arrays[name], dtype=dtype)
+
+        # Header offsets are relative to the start of the data section, which follows the aligned header
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            layout[name] = {"offset": offset, "length": len(array)}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header = json.dumps({"version": FILE_VERSION, "arrays": layout, "gases": self.gases,
+                             "containers": self.containers, "wind_classes": WIND_CLASSES}).encode("utf-8")
+        data_start = -(-(len(FILE_MAGIC) + 4 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        with open(path, "wb") as f:
+            f.write(FILE_MAGIC + len(header).to_bytes(4, "little") + header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+
+    @classmethod
+    def load(cls, path: str) -> "HazardTable":
+        with open(path, "rb") as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError(f"{path} is not a hazard table file")
+            header_len = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        if header.get("version") != FILE_VERSION:
+            raise ValueError(f"{path} has hazard table version {header.get('version')}, expected {FILE_VERSION}")
+        data_start = -(-(len(FILE_MAGIC) + 4 + header_len) // ALIGNMENT) * ALIGNMENT
+
+        arrays = {}
+        for name, dtype in FILE_ARRAYS:
+            spec = header["arrays"][name]
+            # np.memmap cannot map zero-length arrays
+            arrays[name] = (np.memmap(path, dtype=dtype, mode="r", offset=data_start + spec["offset"],
+                                      shape=(spec["length"],))
+                            if spec["length"] else np.zeros(0, dtype=dtype))
+        return cls(arrays["materials"], arrays["table3"], arrays["un_lookup"], header["gases"], header["containers"])
+
+    def row(self, un_id: str) -> Optional[int]:
+        digits = _un_digits(un_id)
+        if not digits or int(digits) >= UN_ID_SLOTS:
+            return None
+        row = int(self.un_lookup[int(digits)])
+        return row if row >= 0 else None
+
+    def rows(self, un_ids: List[str]) -> np.ndarray:
+        """Vectorized row lookup; -1 for UN IDs without green table data."""
+        ids = np.array([int(d) if (d := _un_digits(u)) and int(d) < UN_ID_SLOTS else 0 for u in un_ids], dtype=np.int64)
+        return self.un_lookup[ids]
+
+    def has(self, un_id: str) -> bool:
+        return self.row(un_id) is not None
+
+    def gases_for(self, mask: int) -> List[str]:
+        return [gas for pos, gas in enumerate(self.gases) if mask >> pos & 1]
+
+    def lookup(self, un_id: str) -> Optional[Dict[str, Any]]:
+        """
+        回傳該 UN 編號的數值化綠色表格資料，沒有資料時回傳 None：
+        {"un_id", "small_spill", "large_spill" (各為 {iso_m, iso_ft, day_km, day_mi, night_km, night_mi} 或 None),
+         "large_spill_see_table3", "water_reactive_gases", "table3": [{container, initial_isolation_m, day_km, night_km}]}
+        """
+        row = self.row(un_id)
+        if row is None:
+            return None
+        rec = self.materials[row]
+        flags = int(rec["flags"])
+
+        spills = {}
+        for spill in SPILLS:
+            values = {column: _optional(rec[f"{spill}_{column}"])
+                      for _, metric, imperial in TABLE1_FIELDS for column in (metric, imperial)}
+            spills[spill] = values if any(v is not None for v in values.values()) else None
+
+        start, count = int(rec["t3_start"]), int(rec["t3_count"])
+        table3 = [{
+            "container": self.containers[int(t3["container"])],
+            "initial_isolation_m": _optional(t3["initial_isolation_m"]),
+            "day_km": {wind: _optional(v) for wind, v in zip(WIND_CLASSES, t3["day_km"])},
+            "night_km": {wind: _optional(v) for wind, v in zip(WIND_CLASSES, t3["night_km"])},
+        } for t3 in self.table3[start:start + count]]
+
+        return {
+            "un_id": f"{int(rec['un_id']):04d}",
+            "small_spill": spills["small"],
+            "large_spill": spills["large"],
+            "large_spill_see_table3": bool(flags & FLAG_SEE_TABLE3),
+            "water_reactive_gases": self.gases_for(int(rec["gas_mask"])),
+            "table3": table3,
+        }
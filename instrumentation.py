@@ -0,0 +1,191 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Iterator, TextIO
+
+import numpy as np
+
+# Configure exporters without code changes, e.g. ERG_RAG_TRACE="histogram,jsonl:trace.jsonl,prometheus"
+TRACE_ENV_VAR = "ERG_RAG_TRACE"
+
+# Samples kept per span name by the in-process histogram (older samples are dropped)
+HISTOGRAM_RESERVOIR = 4096
+# Prometheus histogram bucket upper bounds, in seconds
+PROMETHEUS_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+PROMETHEUS_PREFIX = "erg_rag"
+
+
+class Exporter:
+    """Receives finished spans and counter increments. Subclasses override what they need."""
+
+    def on_span(self, name: str, duration_ns: int, attrs: Dict[str, Any]):
+        pass
+
+    def on_count(self, name: str, value: int, attrs: Dict[str, Any]):
+        pass
+
+
+class HistogramExporter(Exporter):
+    """In-process latency histogram: per-span percentiles over a bounded reservoir, plus counter totals."""
+
+    def __init__(self, reservoir: int = HISTOGRAM_RESERVOIR):
+        self.reservoir = reservoir
+        self._samples: Dict[str, deque] = {}
+        self._totals: Dict[str, List[int]] = {} # name -> [count, sum_ns]
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def on_span(self, name: str, duration_ns: int, attrs: Dict[str, Any]):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.reservoir)).append(duration_ns)
+            totals = self._totals.setdefault(name, [0, 0])
+            totals[0] += 1
+            totals[1] += duration_ns
+
+    def on_count(self, name: str, value: int, attrs: Dict[str, Any]):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = {}
+            for name, samples in self._samples.items():
+                p50, p95, p99 = np.percentile(np.asarray(samples, dtype=np.float64) / 1e6, [50, 95, 99])
+                count, total_ns = self._totals[name]
+                spans[name] = {"count": count, "mean_ms": round(total_ns / count / 1e6, 3),
+                               "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3),
+                               "p99_ms": round(float(p99), 3)}
+            return {"spans": spans, "counters": dict(self._counters)}
+
+    def format_table(self) -> str:
+        summary = self.summary()
+        lines = [f"{'span':<28} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)"]
+        for name, s in sorted(summary["spans"].items()):
+            lines.append(f"{name:<28} {s['count']:>7} {s['mean_ms']:>9.3f} {s['p50_ms']:>9.3f} "
+                         f"{s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f}")
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<28} {value:>7}")
+        return "\n".join(lines)
+
+
+class JsonLinesExporter(Exporter):
+    """Appends one JSON object per span / counter increment, for offline analysis."""
+
+    def __init__(self, path: Optional[str] = None, stream: Optional[TextIO] = None):
+        self._stream = stream if stream is not None else open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def _write(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            self._stream.write(line + "\n")
+
+    def on_span(self, name: str, duration_ns: int, attrs: Dict[str, Any]):
+        self._write({"type": "span", "name": name, "ts": time.time(),
+                     "duration_ms": round(duration_ns / 1e6, 4), **attrs})
+
+    def on_count(self, name: str, value: int, attrs: Dict[str, Any]):
+        self._write({"type": "counter", "name": name, "ts": time.time(), "value": value, **attrs})
+
+
+class PrometheusExporter(Exporter):
+    """Cumulative histograms and counters rendered in the Prometheus text exposition format."""
+
+    def __init__(self, buckets: List[float] = PROMETHEUS_BUCKETS, prefix: str = PROMETHEUS_PREFIX):
+        self.buckets = buckets
+        self._bucket_ns = np.asarray(buckets) * 1e9
+        self.prefix = prefix
+        self._histograms: Dict[str, List[Any]] = {} # name -> [bucket counts, count, sum_ns]
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def on_span(self, name: str, duration_ns: int, attrs: Dict[str, Any]):
+        bucket = int(np.searchsorted(self._bucket_ns, duration_ns))
+        with self._lock:
+            hist = self._histograms.setdefault(name, [[0] * (len(self.buckets) + 1), 0, 0])
+            hist[0][bucket] += 1
+            hist[1] += 1
+            hist[2] += duration_ns
+
+    def on_count(self, name: str, value: int, attrs: Dict[str, Any]):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def render(self) -> str:
+        duration = f"{self.prefix}_span_duration_seconds"
+        lines = [f"# HELP {duration} Time spent per instrumented stage.", f"# TYPE {duration} histogram"]
+        with self._lock:
+            for name, (counts, count, sum_ns) in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{duration}_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{duration}_bucket{{span="{name}",le="+Inf"}} {count}')
+                lines.append(f'{duration}_sum{{span="{name}"}} {sum_ns / 1e9:.9f}')
+                lines.append(f'{duration}_count{{span="{name}"}} {count}')
+
+            total = f"{self.prefix}_events_total"
+            lines += [f"# HELP {total} Instrumented event counters.", f"# TYPE {total} counter"]
+            for name, value in sorted(self._counters.items()):
+                lines.append(f'{total}{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """
+    Lightweight spans (perf_counter_ns) and counters dispatched to pluggable exporters.
+    With no exporter registered, spans still measure time (for callers that want the duration) but nothing is recorded.
+    """
+
+    def __init__(self):
+        self.exporters: List[Exporter] = []
+
+    def add_exporter(self, exporter: Exporter) -> Exporter:
+        self.exporters.append(exporter)
+        return exporter
+
+    def find_exporter(self, exporter_type: type) -> Optional[Exporter]:
+        return next((e for e in self.exporters if isinstance(e, exporter_type)), None)
+
+    @contextmanager
+    def span(self, name: str, timings: Optional[Dict[str, float]] = None, **attrs) -> Iterator[None]:
+        """Time a block. If `timings` is given, the duration (ms) is also stored there under the last part of the name."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter_ns() - start
+            if timings is not None:
+                key = name.rsplit(".", 1)[-1]
+                timings[key] = timings.get(key, 0.0) + duration / 1e6
+            for exporter in self.exporters:
+                exporter.on_span(name, duration, attrs)
+
+    def count(self, name: str, value: int = 1, **attrs):
+        if value:
+            for exporter in self.exporters:
+                exporter.on_count(name, value, attrs)
+
+
+tracer = Tracer()
+
+
+def configure_from_env(env_var: str = TRACE_ENV_VAR) -> Tracer:
+    """
+    Register exporters listed in the environment variable (comma separated):
+    "histogram", "prometheus", "jsonl:<path>". Exporters that are already registered are not added twice.
+    """
+    for item in filter(None, (part.strip() for part in os.environ.get(env_var, "").split(","))):
+        kind, _, arg = item.partition(":")
+        if kind == "histogram" and not tracer.find_exporter(HistogramExporter):
+            tracer.add_exporter(HistogramExporter())
+        elif kind == "prometheus" and not tracer.find_exporter(PrometheusExporter):
+            tracer.add_exporter(PrometheusExporter())
+        elif kind == "jsonl" and arg:
+            tracer.add_exporter(JsonLinesExporter(arg))
+        elif kind not in ("histogram", "prometheus", "jsonl"):
+            print(f"Warning: unknown exporter '{item}' in {env_var}")
+    return tracer
@@ -0,0 +1,155 @@
+import re
+from array import array
+from typing import List, Dict, Tuple, Iterator, Iterable
+
+import numpy as np
+from scipy import sparse
+
+from material_index import normalize_name, split_bilingual_name
+
+# Saved next to the Chroma DB by build_rag_db_cn.py; rows follow material_index.json order
+LEXICAL_INDEX_FILENAME = "lexical_index.npz"
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Names are short compared to full_text, so their terms are repeated to dominate the score
+NAME_WEIGHT = 3
+# Reciprocal-rank fusion constant (standard value from the RRF paper)
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """English: word tokens. CJK: character unigrams + bigrams (Chinese names are not space-delimited)."""
+    for match in TOKEN_PATTERN.finditer(normalize_name(text)):
+        run = match.group()
+        if run[0].isascii():
+            yield run
+            continue
+        yield from run
+        for pos in range(len(run) - 1):
+            yield run[pos:pos + 2]
+
+
+def material_lexical_text(names: List[str], full_text: str) -> str:
+    # Canonical name and aliases (material_index.material_names)
+    name_text = " ".join(f"{en_name} {cn_name}" for en_name, cn_name in map(split_bilingual_name, names))
+    return " ".join([name_text] * NAME_WEIGHT + [full_text])
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index stored as a sparse (documents x vocabulary) matrix of precomputed term weights.
+    Scoring a query is a single sparse matrix-vector product, so all materials are scored at once.
+    """
+
+    def __init__(self, weights: sparse.csr_matrix, vocab: Dict[str, int]):
+        self.weights = weights
+        self.vocab = vocab
+
+    def __len__(self) -> int:
+        return self.weights.shape[0]
+
+    @classmethod
+    def build(cls, documents: Iterable[str]) -> "LexicalIndex":
+        builder = LexicalIndexBuilder()
+        for doc in documents:
+            builder.add(doc)
+        return builder.build()
+
+    def save(self, path: str):
+        terms = np.array(sorted(self.vocab, key=self.vocab.get))
+        np.savez_compressed(
+            path,
+            data=self.weights.data, indices=self.weights.indices, indptr=self.weights.indptr,
+            shape=np.array(self.weights.shape), vocab=terms
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path) as f:
+            weights = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            vocab = {term: col for col, term in enumerate(f["vocab"].tolist())}
+        return cls(weights, vocab)
+
+    def _query_matrix(self, queries: List[str]) -> np.ndarray:
+        # Dense (vocabulary x queries) indicator matrix: sparse @ dense is much cheaper than sparse @ sparse here
+        matrix = np.zeros((len(self.vocab), len(queries)), dtype=np.float32)
+        for col, query in enumerate(queries):
+            # Each distinct query term counts once (BM25 query-term frequency is usually ignored)
+            terms = [self.vocab[t] for t in tokenize(query) if t in self.vocab]
+            matrix[terms, col] = 1.0
+        return matrix
+
+    def search_batch(self, queries: List[str], k: int = 20) -> List[List[Tuple[int, float]]]:
+        """回傳每個查詢的前 k 筆 (文件位置, BM25 分數)，分數為 0 的文件不列入。"""
+        scores = np.asarray(self.weights @ self._query_matrix(queries)).T # (queries x documents)
+        results = []
+        for row in scores:
+            k_eff = min(k, len(row))
+            top = np.argpartition(-row, k_eff - 1)[:k_eff] if k_eff else np.array([], dtype=int)
+            top = top[np.argsort(-row[top], kind="stable")]
+            results.append([(int(pos), float(row[pos])) for pos in top if row[pos] > 0])
+        return results
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[int, float]]:
+        return self.search_batch([query], k)[0]
+
+
+class LexicalIndexBuilder:
+    """
+    Accumulates term counts one document at a time (documents are not kept), in compact typed arrays,
+    so the build holds only the growing sparse matrix itself.
+    """
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self._rows = array("I")
+        self._cols = array("I")
+        self._counts = array("f")
+        self._doc_lengths = array("f")
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, doc: str):
+        row = len(self._doc_lengths)
+        term_counts: Dict[int, int] = {}
+        for token in tokenize(doc):
+            col = self.vocab.setdefault(token, len(self.vocab))
+            term_counts[col] = term_counts.get(col, 0) + 1
+        self._doc_lengths.append(sum(term_counts.values()))
+        self._rows.extend([row] * len(term_counts))
+        self._cols.extend(term_counts.keys())
+        self._counts.extend(term_counts.values())
+
+    def build(self) -> LexicalIndex:
+        n_docs = len(self._doc_lengths)
+        tf = sparse.csr_matrix(
+            (np.frombuffer(self._counts, dtype=np.float32),
+             (np.frombuffer(self._rows, dtype=np.uint32), np.frombuffer(self._cols, dtype=np.uint32))),
+            shape=(n_docs, len(self.vocab))
+        )
+        doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.float32)
+
+        # idf per term, BM25 length normalisation per document
+        df = np.bincount(tf.indices, minlength=len(self.vocab)).astype(np.float32)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        avg_len = doc_lengths.mean() if n_docs else 1.0
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_lengths / avg_len)
+
+        # Term counts are replaced by their BM25 weights in place (no second matrix)
+        row_norm = np.repeat(norm, np.diff(tf.indptr))
+        tf.data = idf[tf.indices] * tf.data * (BM25_K1 + 1.0) / (tf.data + row_norm)
+        return LexicalIndex(tf.astype(np.float32, copy=False), self.vocab)
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = RRF_K) -> List[int]:
+    """Merge several ranked lists of document positions: score = sum(1 / (k + rank))."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, pos in enumerate(ranking):
+            scores[pos] = scores.get(pos, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda pos: -scores[pos])
@@ -0,0 +1,228 @@
+import itertools
+import json
+import math
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Written by calibrate_cascade.py next to the Chroma DB
+CASCADE_CALIBRATION_FILENAME = "cascade_calibration.json"
+
+# First tier: the top BM25 candidates alone, no embedding or vector query (name matches only)
+LEXICAL_TIER_K = 5
+# Vector candidate counts the cascade may try in turn after it; the last one (the former fixed n_results)
+# is always kept, calibration drops intermediate tiers that cost more than they save
+CASCADE_TIERS = [5, 20]
+
+# How a material was matched: index hits (un_id / exact / prefix / mention), then the refinement of
+# semantic candidates (exact / un_id / contains / ranking)
+MATCH_KINDS = ["un_id", "exact", "prefix", "mention", "contains", "ranking"]
+# Features of a ranking-only hit (see ranking_features)
+RANKING_FEATURES = ["margin", "agree"]
+
+# Early stops may not cost more than this accuracy on the labeled queries (vs. always using the widest tier)
+MAX_ACCURACY_LOSS = 0.0
+# The labeled queries are split into this many folds: each is replayed by a calibration fitted on the others,
+# so the reported accuracy and the MAX_ACCURACY_LOSS check do not reuse the queries the threshold was chosen on
+CROSS_VALIDATION_FOLDS = 5
+CROSS_VALIDATION_SEED = 0
+# Never stop early below this score, however few labeled samples there are
+MIN_STOP_CONFIDENCE = 0.5
+# L2 penalty of the logistic fit (not applied to the bias); the labeled set is small
+L2_PENALTY = 1.0
+# Like the Laplace smoothing of the kind precisions, the fit sees one extra correct and one extra wrong
+# sample at the mean features, so an all-wrong (or all-correct) set does not push the bias to infinity
+PRIOR_WEIGHT = 1.0
+
+# (match kind, ranking features, correct) of one labeled query at one tier; None when the tier found no candidate
+TierResult = Optional[Tuple[str, Optional[List[float]], bool]]
+
+
+def ranking_features(distances: Sequence[float], vector_top: Optional[int], lexical_top: Optional[int]) -> List[float]:
+    """
+    Relative gap between the two nearest vectors (1.0 with a single result), and whether the
+    BM25 top hit is the same material as the vector top hit.
+    """
+    if len(distances) < 2 or distances[1] <= 0:
+        margin = 1.0
+    else:
+        margin = max(0.0, (distances[1] - distances[0]) / distances[1])
+    return [margin, float(vector_top is not None and vector_top == lexical_top)]
+
+
+def tier_label(k: int) -> str:
+    return f"semantic@{k}"
+
+
+class CascadeCalibration:
+    """
+    信心分數校正與候選層級設定：名稱/UN 編號匹配使用標註查詢集上各匹配方式的正確率；
+    只靠排名的結果以 logistic 模型 (向量距離差距、BM25 是否同意) 估計正確機率。
+    信心分數達到 stop_confidence 時提前結束，不再擴大候選數；tiers 為實際使用的向量候選層級。
+    """
+
+    def __init__(self, kind_precision: Dict[str, float], weights: List[float], stop_confidence: float,
+                 tiers: Optional[List[int]] = None, samples: int = 0):
+        self.kind_precision = kind_precision
+        self.weights = weights
+        self.stop_confidence = stop_confidence
+        self.tiers = list(tiers or CASCADE_TIERS)
+        self.samples = samples
+
+    def confidence(self, kind: str, features: Optional[List[float]] = None) -> float:
+        if kind != "ranking":
+            return self.kind_precision.get(kind, 0.5)
+        bias, *weights = self.weights
+        z = bias + sum(w * f for w, f in zip(weights, features or [0.0] * len(weights)))
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def accepts(self, confidence: float) -> bool:
+        return confidence >= self.stop_confidence
+
+    def simulate(self, records: List[Dict[str, TierResult]],
+                 tier_cost_ms: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """
+        Replays the cascade over labeled queries (tier label -> result, decided as in ERGEngine._semantic_cascade):
+        which tier answers each query, the accuracy against always using the widest tier, and the expected
+        latency when tier_cost_ms ("lexical", "embed" and each tier label) is given.
+        """
+        costs = tier_cost_ms or {}
+        labels = ["lexical"] + [tier_label(k) for k in self.tiers]
+        widest = tier_label(CASCADE_TIERS[-1])
+        answered = {label: 0 for label in labels}
+        correct = fixed_correct = 0
+        cost = 0.0
+        for record in records:
+            fixed_correct += bool(record[widest] and record[widest][2])
+            cost += costs.get("lexical", 0.0)
+            lexical = record["lexical"]
+            if lexical and lexical[0] != "ranking" and self.accepts(self.confidence(lexical[0])):
+                answered["lexical"] += 1
+                correct += lexical[2]
+                continue
+            cost += costs.get("embed", 0.0)
+            for label in labels[1:]:
+                cost += costs.get(label, 0.0)
+                found = record[label]
+                if found is None:
+                    break # No vector candidate: a wider tier finds none either
+                kind, features, is_correct = found
+                if label == labels[-1] or self.accepts(self.confidence(kind, features)):
+                    answered[label] += 1
+                    correct += is_correct
+                    break
+        count = max(len(records), 1)
+        return {"answered_by_tier": answered, "accuracy": round(correct / count, 4),
+                "fixed_accuracy": round(fixed_correct / count, 4), "expected_ms": round(cost / count, 3)}
+
+    @classmethod
+    def fit(cls, samples: List[Tuple[str, Optional[List[float]], bool]], records: List[Dict[str, TierResult]],
+            tier_cost_ms: Dict[str, float]) -> "CascadeCalibration":
+        """
+        samples: (match kind, ranking features or None, correct) of the index hits and of every labeled query at
+        every tier; records: the per-query tier results replayed by simulate().
+        Kind precisions are Laplace-smoothed; ranking hits get a penalized, smoothed logistic fit (Newton steps).
+        The stop threshold and the intermediate tiers are then chosen to minimize the expected latency
+        without losing more than MAX_ACCURACY_LOSS accuracy.
+        """
+        kind_precision = {}
+        for kind in MATCH_KINDS:
+            outcomes = [correct for k, _, correct in samples if k == kind]
+            if outcomes and kind != "ranking":
+                kind_precision[kind] = round((sum(outcomes) + 1) / (len(outcomes) + 2), 4)
+        for kind, value in DEFAULT_CALIBRATION.kind_precision.items():
+            kind_precision.setdefault(kind, value)
+
+        ranking = [(features, correct) for kind, features, correct in samples if kind == "ranking"]
+        weights = list(DEFAULT_CALIBRATION.weights)
+        if ranking:
+            features = np.array([f for f, _ in ranking], dtype=np.float64)
+            features = np.vstack([features, features.mean(axis=0), features.mean(axis=0)])
+            x = np.column_stack([np.ones(len(features)), features])
+            y = np.array([float(c) for _, c in ranking] + [1.0, 0.0])
+            sample_weight = np.array([1.0] * len(ranking) + [PRIOR_WEIGHT, PRIOR_WEIGHT])
+            penalty = np.diag([0.0] + [L2_PENALTY] * (x.shape[1] - 1))
+            w = np.zeros(x.shape[1])
+            for _ in range(50):
+                p = 1.0 / (1.0 + np.exp(-(x @ w)))
+                grad = x.T @ (sample_weight * (p - y)) + penalty @ w
+                hessian = x.T @ (x * (sample_weight * p * (1 - p))[:, None]) + penalty + 1e-6 * np.eye(x.shape[1])
+                step = np.linalg.solve(hessian, grad)
+                w -= step
+                if np.abs(step).max() < 1e-8:
+                    break
+            weights = [round(float(v), 4) for v in w]
+
+        probe = cls(kind_precision, weights, 1.0)
+        scores = {round(probe.confidence(kind, features), 4) for kind, features, _ in samples}
+        thresholds = sorted({score for score in scores if score >= MIN_STOP_CONFIDENCE} | {1.0})
+        # Threshold 1.0 with only the widest tier is the former fixed search, so there is always a feasible choice
+        best, best_key = None, None
+        for size in range(len(CASCADE_TIERS)):
+            for intermediate in itertools.combinations(CASCADE_TIERS[:-1], size):
+                for threshold in thresholds:
+                    candidate = cls(kind_precision, weights, threshold, list(intermediate) + CASCADE_TIERS[-1:],
+                                    len(samples))
+                    result = candidate.simulate(records, tier_cost_ms)
+                    if result["accuracy"] < result["fixed_accuracy"] - MAX_ACCURACY_LOSS:
+                        continue
+                    key = (result["expected_ms"], threshold)
+                    if best_key is None or key < best_key:
+                        best, best_key = candidate, key
+        return best
+
+    @classmethod
+    def cross_validate(cls, query_samples: List[List[Tuple[str, Optional[List[float]], bool]]],
+                       records: List[Dict[str, TierResult]], tier_cost_ms: Dict[str, float],
+                       folds: int = CROSS_VALIDATION_FOLDS) -> Dict[str, Any]:
+        """
+        Held-out version of simulate(): query_samples[i] are the samples of records[i]; every fold of queries is
+        replayed by a calibration fitted on the remaining folds. Returns the pooled simulate() figures.
+        """
+        folds = max(2, min(folds, len(records)))
+        assignment = np.random.default_rng(CROSS_VALIDATION_SEED).permutation(len(records)) % folds
+        answered: Dict[str, int] = {}
+        correct = fixed_correct = cost = 0.0
+        for fold in range(folds):
+            train = [pos for pos in range(len(records)) if assignment[pos] != fold]
+            held_out = [records[pos] for pos in range(len(records)) if assignment[pos] == fold]
+            calibration = cls.fit([sample for pos in train for sample in query_samples[pos]],
+                                  [records[pos] for pos in train], tier_cost_ms)
+            result = calibration.simulate(held_out, tier_cost_ms)
+            for label, count in result["answered_by_tier"].items():
+                answered[label] = answered.get(label, 0) + count
+            correct += result["accuracy"] * len(held_out)
+            fixed_correct += result["fixed_accuracy"] * len(held_out)
+            cost += result["expected_ms"] * len(held_out)
+        count = max(len(records), 1)
+        return {"folds": folds, "answered_by_tier": answered, "accuracy": round(correct / count, 4),
+                "fixed_accuracy": round(fixed_correct / count, 4), "expected_ms": round(cost / count, 3)}
+
+    def without_early_stops(self) -> "CascadeCalibration":
+        """Same confidence model, but every query goes to the widest tier (the former fixed search)."""
+        return CascadeCalibration(self.kind_precision, self.weights, 1.0, CASCADE_TIERS[-1:], self.samples)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"tiers": self.tiers, "kind_precision": self.kind_precision,
+                "weights": dict(zip(["bias"] + RANKING_FEATURES, self.weights)),
+                "stop_confidence": self.stop_confidence, "samples": self.samples}
+
+    def save(self, path: str, **extra):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({**self.to_dict(), **extra}, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "CascadeCalibration":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        weights = [data["weights"][name] for name in ["bias"] + RANKING_FEATURES]
+        # Tiers no longer offered (CASCADE_TIERS changed since calibrating) are dropped; the widest is always kept
+        tiers = [k for k in data.get("tiers", CASCADE_TIERS) if k in CASCADE_TIERS[:-1]] + CASCADE_TIERS[-1:]
+        return cls(data["kind_precision"], weights, data["stop_confidence"], tiers, data.get("samples", 0))
+
+
+# Used until calibrate_cascade.py has been run: lexical matches are trusted, a ranking-only hit stops
+# early only when the vector gap is clear and BM25 agrees
+DEFAULT_CALIBRATION = CascadeCalibration(
+    {"un_id": 0.99, "exact": 0.99, "prefix": 0.9, "mention": 0.9, "contains": 0.85},
+    [-1.5, 4.0, 2.0], 0.8)
@@ -0,0 +1,192 @@
+import bisect
+import json
+import os
+import re
+import unicodedata
+from typing import List, Dict, Any, Optional, Tuple
+
+# Saved next to the Chroma DB by build_rag_db_cn.py
+INDEX_FILENAME = "material_index.json"
+
+# Minimum query length before falling back to prefix matching
+# (CJK names are much shorter than their English counterparts)
+MIN_PREFIX_LEN = 3
+MIN_PREFIX_LEN_CJK = 2
+
+# Share of CJK characters among the letters of a query from which it is routed to the Chinese partition.
+# One CJK character carries about as much as a short English word, so the bar is well below one half.
+CJK_LANGUAGE_RATIO = 0.3
+
+CJK_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+LATIN_PATTERN = re.compile(r"[A-Za-z]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Index lines sharing a UN ID and guide are stored as one material; its other listed names are aliases,
+# kept in one metadata string (Chroma metadata values must be simple types)
+ALIAS_SEPARATOR = " | "
+
+
+def normalize_name(text: str) -> str:
+    # NFKC folds full-width characters (e.g. "（" -> "(") so CN input matches the index
+    text = unicodedata.normalize("NFKC", text)
+    return WHITESPACE_PATTERN.sub(" ", text).strip().lower()
+
+
+def material_names(meta: Dict[str, Any]) -> List[str]:
+    """Canonical name followed by the aliases of a material record."""
+    aliases = meta.get("aliases")
+    return [meta["name"]] + (aliases.split(ALIAS_SEPARATOR) if aliases else [])
+
+
+def material_key(meta: Dict[str, Any]) -> Tuple[str, str]:
+    """Index lines with the same UN ID and guide give the same answer (they are grouped as aliases of one material)."""
+    return str(meta["un_id"]), str(meta.get("guide_no"))
+
+
+def query_language(text: str) -> str:
+    """
+    依 CJK 字元比例判斷查詢語言: "cn" 或 "en"。只計算文字字元 (CJK 與英文字母)，數字與標點不影響判斷；
+    沒有任何文字字元時 (例如純 UN 編號) 回傳 "cn"。
+    """
+    cjk = len(CJK_PATTERN.findall(text))
+    latin = len(LATIN_PATTERN.findall(text))
+    if cjk + latin == 0:
+        return "cn"
+    return "cn" if cjk / (cjk + latin) >= CJK_LANGUAGE_RATIO else "en"
+
+
+def split_bilingual_name(name: str) -> Tuple[str, str]:
+    """
+    將 parse_erg_index 產生的 "Name (中文)" 拆成 (英文, 中文)。
+    英文名稱本身可能包含括號，例如 "Air, refrigerated liquid (cryogenic liquid) (空氣，冷凍液體 (極低溫液體))"，
+    因此從尾端反向配對最外層括號，且僅在括號內含中文時才視為中文名稱。
+    """
+    name = name.strip()
+    if not name.endswith(")"):
+        return name, ""
+
+    depth = 0
+    for pos in range(len(name) - 1, -1, -1):
+        if name[pos] == ")":
+            depth += 1
+        elif name[pos] == "(":
+            depth -= 1
+            if depth == 0:
+                inner = name[pos + 1:-1].strip()
+                if CJK_PATTERN.search(inner):
+                    return name[:pos].strip(), inner
+                return name, ""
+    return name, ""
+
+
+class MaterialIndexWriter:
+    """
+    Writes material_index.json one record at a time (same format as MaterialIndex.save), so a build never
+    holds the whole material list. The file is replaced atomically on close(); a failed build keeps the old one.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.count = 0
+        self._file = open(path + ".tmp", "w", encoding="utf-8")
+        self._file.write("[")
+
+    def add(self, meta: Dict[str, Any]):
+        self._file.write((", " if self.count else "") + json.dumps(meta, ensure_ascii=False))
+        self.count += 1
+
+    def close(self):
+        self._file.write("]")
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def discard(self):
+        self._file.close()
+        os.remove(self.path + ".tmp")
+
+
+class MaterialIndex:
+    """
+    物質查詢索引：UN 編號、英文名稱、中文名稱 (含別名) -> 物質 Metadata。
+    精確與前綴匹配完全在記憶體內完成，不需呼叫 embedding 模型或 ChromaDB。
+    """
+
+    def __init__(self, materials: List[Dict[str, Any]]):
+        self.materials = materials
+        self.by_un_id: Dict[str, List[int]] = {}
+        self.by_name: Dict[str, List[int]] = {}
+        # (UN ID, full name) -> row, used to line Chroma results up with the lexical index rows
+        self._positions: Dict[Tuple[str, str], int] = {}
+
+        for pos, meta in enumerate(materials):
+            self.by_un_id.setdefault(str(meta["un_id"]), []).append(pos)
+            for name in material_names(meta):
+                self._positions.setdefault((str(meta["un_id"]), name), pos)
+
+                en_name, cn_name = split_bilingual_name(name)
+                for key in {normalize_name(name), normalize_name(en_name), normalize_name(cn_name)}:
+                    if not key:
+                        continue
+                    rows = self.by_name.setdefault(key, [])
+                    if pos not in rows:
+                        rows.append(pos)
+
+        # Sorted keys allow prefix lookups with bisect instead of a linear scan
+        self._sorted_names = sorted(self.by_name)
+
+    def __len__(self) -> int:
+        return len(self.materials)
+
+    @classmethod
+    def load(cls, path: str) -> "MaterialIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.materials, f, ensure_ascii=False)
+
+    def position_of(self, meta: Dict[str, Any]) -> Optional[int]:
+        return self._positions.get((str(meta.get("un_id")), meta.get("name")))
+
+    def lookup_un_id(self, un_id: str) -> List[Dict[str, Any]]:
+        return [self.materials[pos] for pos in self.by_un_id.get(str(un_id), [])]
+
+    def lookup_exact(self, query: str) -> Optional[Dict[str, Any]]:
+        positions = self.by_name.get(normalize_name(query))
+        if not positions:
+            return None
+        return self.materials[positions[0]]
+
+    def lookup_prefix(self, query: str) -> Optional[Dict[str, Any]]:
+        key = normalize_name(query)
+        min_len = MIN_PREFIX_LEN_CJK if CJK_PATTERN.search(key) else MIN_PREFIX_LEN
+        if len(key) < min_len:
+            return None
+
+        start = bisect.bisect_left(self._sorted_names, key)
+        end = bisect.bisect_right(self._sorted_names, key + "\U0010ffff", lo=start)
+        if start == end:
+            return None
+        # Only a prefix of a single material (UN ID and guide) is an answer: "hydrogen" starts Hydrogen sulfide
+        # as well as "Hydrogen, compressed", and picking the shortest name would confidently return the wrong one.
+        # Ambiguous prefixes go to the semantic tiers, which rank all of them.
+        first = self.materials[self.by_name[self._sorted_names[start]][0]]
+        key = material_key(first)
+        for i in range(start, end):
+            if any(material_key(self.materials[pos]) != key for pos in self.by_name[self._sorted_names[i]]):
+                return None
+        return first
+
+    def lookup(self, query: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """回傳 (metadata, 匹配方式)；若需要向量搜尋則回傳 None。"""
+        meta = self.lookup_exact(query)
+        if meta:
+            return meta, f"精確名稱匹配 ('{meta['name']}')"
+
+        meta = self.lookup_prefix(query)
+        if meta:
+            return meta, f"前綴名稱匹配 ('{meta['name']}')"
+        return None
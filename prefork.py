@@ -0,0 +1,308 @@
+import asyncio
+import gc
+import mmap
+import os
+import selectors
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+import numpy as np
+
+# Latency histogram bucket upper bounds (ms) of the per-worker stats; the last bucket catches everything above
+LATENCY_BUCKETS_MS = [float(v) for v in np.geomspace(0.1, 30000.0, 45)]
+LATENCY_PERCENTILES = [50, 95, 99]
+
+# How often the dispatcher reaps exited workers when no connection arrives
+REAP_INTERVAL_SEC = 0.5
+# A worker that exits sooner than this after starting is restarted only after the same delay (crash loops)
+MIN_WORKER_LIFETIME_SEC = 5.0
+# Workers still running this long after SIGTERM are killed
+SHUTDOWN_TIMEOUT_SEC = 10.0
+
+# Columns of a worker's row in the shared stats table; each cell has a single writer
+PID, STARTED_AT_MS, RESTARTS, DISPATCHED = 0, 1, 2, 3  # written by the dispatcher
+CLOSED, IN_FLIGHT, REQUESTS, ERRORS, LATENCY_SUM_US = 4, 5, 6, 7, 8  # written by the worker
+HISTOGRAM = 9
+
+SERVICE_UNAVAILABLE = (b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                       b"Content-Length: 31\r\nConnection: close\r\n\r\n{\"error\": \"no worker available\"}")
+
+
+class WorkerStats:
+    """
+    Per-worker counters and latency histograms in an anonymous shared mapping, created before forking:
+    every worker updates its own row without locks or messages, and any worker can report all of them.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.width = HISTOGRAM + len(LATENCY_BUCKETS_MS) + 1
+        self._buffer = mmap.mmap(-1, workers * self.width * 8)
+        self.table = np.frombuffer(self._buffer, dtype=np.int64).reshape(workers, self.width)
+        self._bounds = np.array(LATENCY_BUCKETS_MS)
+
+    def slot(self, index: int) -> "WorkerSlot":
+        return WorkerSlot(self, index)
+
+    def alive(self) -> int:
+        return int(np.count_nonzero(self.table[:, PID]))
+
+    def open_connections(self) -> np.ndarray:
+        return self.table[:, DISPATCHED] - self.table[:, CLOSED]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now_ms = time.time() * 1000
+        table = self.table.copy()
+        workers = []
+        for index, row in enumerate(table):
+            requests = int(row[REQUESTS])
+            worker = {
+                "worker": index,
+                "pid": int(row[PID]) or None,
+                "alive": bool(row[PID]),
+                "uptime_sec": round((now_ms - row[STARTED_AT_MS]) / 1000, 1) if row[PID] else None,
+                "restarts": int(row[RESTARTS]),
+                "connections": int(row[DISPATCHED] - row[CLOSED]),
+                "in_flight": int(row[IN_FLIGHT]),
+                "requests": requests,
+                "errors": int(row[ERRORS]),
+                "mean_ms": round(row[LATENCY_SUM_US] / requests / 1000, 3) if requests else None,
+            }
+            histogram = row[HISTOGRAM:]
+            for q in LATENCY_PERCENTILES:
+                worker[f"p{q}_ms"] = self._percentile(histogram, q) if requests else None
+            worker.update(process_memory(int(row[PID])) if row[PID] else {})
+            workers.append(worker)
+        return workers
+
+    def _percentile(self, histogram: np.ndarray, q: float) -> float:
+        # Upper bound of the bucket holding the q-th percentile (the overflow bucket reports the last bound)
+        position = int(np.searchsorted(np.cumsum(histogram), histogram.sum() * q / 100.0))
+        return round(float(self._bounds[min(position, len(self._bounds) - 1)]), 3)
+
+
+class WorkerSlot:
+    """One worker's view of the shared stats: the hooks its server calls around connections and requests."""
+
+    def __init__(self, stats: WorkerStats, index: int):
+        self.stats = stats
+        self.index = index
+        self.row = stats.table[index]
+
+    def request_started(self):
+        self.row[IN_FLIGHT] += 1
+
+    def request_finished(self, elapsed_ms: float, error: bool):
+        self.row[IN_FLIGHT] -= 1
+        self.row[REQUESTS] += 1
+        self.row[ERRORS] += error
+        self.row[LATENCY_SUM_US] += int(elapsed_ms * 1000)
+        self.row[HISTOGRAM + int(np.searchsorted(self.stats._bounds, elapsed_ms))] += 1
+
+    def connection_closed(self):
+        self.row[CLOSED] += 1
+
+
+def process_memory(pid: int) -> Dict[str, Optional[float]]:
+    """RSS and PSS (shared pages divided among the processes mapping them) in MB; Linux only, else empty."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    return {name: round(int(fields[key].split()[0]) / 1024, 1)
+            for name, key in [("rss_mb", "Rss"), ("pss_mb", "Pss")] if key in fields}
+
+
+class PreforkDispatcher:
+    """
+    Parent side of the pre-fork server. Everything loaded before run() (model weights, indexes, lookup tables)
+    is shared copy-on-write by the forked workers. The parent accepts connections itself and hands each one
+    (its file descriptor, over a Unix socket pair) to the worker with the fewest open connections; workers that
+    exit are forked again from the same preloaded state.
+    run_worker(slot, channel) runs in the child and serves the connections arriving on channel until it closes.
+    """
+
+    def __init__(self, listener: socket.socket, workers: int,
+                 run_worker: Callable[[WorkerSlot, socket.socket], None]):
+        self.listener = listener
+        self.stats = WorkerStats(workers)
+        self.run_worker = run_worker
+        self._pids: List[Optional[int]] = [None] * workers
+        self._channels: List[Optional[socket.socket]] = [None] * workers
+        self._respawn_at: List[float] = [0.0] * workers
+        self._next = 0
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self.listener.setblocking(False)
+        # Objects loaded so far are left alone by the collector, so it does not dirty their pages in the workers
+        gc.collect()
+        gc.freeze()
+        for slot in range(len(self._pids)):
+            self._spawn(slot)
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.listener, selectors.EVENT_READ)
+        try:
+            while not self._stopping:
+                if selector.select(timeout=REAP_INTERVAL_SEC):
+                    self._accept()
+                self._reap()
+        finally:
+            selector.close()
+            self.listener.close()
+            self._shutdown()
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self, slot: int):
+        row = self.stats.table[slot]
+        # Counters of a previous worker in this slot (its connections died with it) start over
+        row[DISPATCHED:] = 0
+        row[STARTED_AT_MS] = int(time.time() * 1000)
+        parent_end, child_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                # Ctrl-C reaches the whole process group; the parent shuts the workers down
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                gc.enable()
+                self.listener.close()
+                parent_end.close()
+                for channel in self._channels:
+                    if channel is not None:
+                        channel.close()
+                self.run_worker(self.stats.slot(slot), child_end)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        child_end.close()
+        # A worker that stops reading must not block the dispatcher: the connection goes to another one
+        parent_end.setblocking(False)
+        row[PID] = pid
+        self._pids[slot] = pid
+        self._channels[slot] = parent_end
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            with conn:
+                self._dispatch(conn)
+
+    def _dispatch(self, conn: socket.socket):
+        # Least open connections; ties go round-robin so idle workers take turns
+        load = self.stats.open_connections()
+        count = len(self._pids)
+        order = sorted((slot for slot in range(count) if self._pids[slot] is not None),
+                       key=lambda slot: (load[slot], (slot - self._next) % count))
+        for slot in order:
+            try:
+                socket.send_fds(self._channels[slot], [b"c"], [conn.fileno()])
+            except OSError:
+                continue # Worker just exited (reaped on the next pass) or is not keeping up
+            self.stats.table[slot, DISPATCHED] += 1
+            self._next = (slot + 1) % count
+            return
+        try:
+            conn.sendall(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid not in self._pids:
+                continue
+            slot = self._pids.index(pid)
+            started = self.stats.table[slot, STARTED_AT_MS] / 1000
+            if not self._stopping:
+                print(f"[warning] 工作行程 {slot} (pid {pid}) 已結束 (結束代碼 {os.waitstatus_to_exitcode(status)})，"
+                      f"將重新啟動。", file=sys.stderr)
+            self._pids[slot] = None
+            self._channels[slot].close()
+            self._channels[slot] = None
+            self.stats.table[slot, PID] = 0
+            self._respawn_at[slot] = started + MIN_WORKER_LIFETIME_SEC
+        if self._stopping:
+            return
+        now = time.time()
+        for slot, pid in enumerate(self._pids):
+            if pid is None and now >= self._respawn_at[slot]:
+                self._spawn(slot)
+                self.stats.table[slot, RESTARTS] += 1
+
+    def _shutdown(self):
+        for channel in self._channels:
+            if channel is not None:
+                channel.close()
+        pids = [pid for pid in self._pids if pid is not None]
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + SHUTDOWN_TIMEOUT_SEC
+        while pids and time.time() < deadline:
+            pids = [pid for pid in pids if os.waitpid(pid, os.WNOHANG)[0] == 0]
+            time.sleep(0.05)
+        for pid in pids:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+
+async def serve_channel(channel: socket.socket, slot: WorkerSlot,
+                        handle_connection: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]):
+    """Worker side: serves every connection the dispatcher passes over channel; returns when the parent is gone."""
+    loop = asyncio.get_running_loop()
+    closed = loop.create_future()
+    tasks = set()
+
+    async def serve(conn: socket.socket):
+        try:
+            reader, writer = await asyncio.open_connection(sock=conn)
+            await handle_connection(reader, writer)
+        finally:
+            slot.connection_closed()
+
+    def on_readable():
+        while True:
+            try:
+                message, fds, _, _ = socket.recv_fds(channel, 16, 1)
+            except (BlockingIOError, InterruptedError):
+                return
+            if not message:
+                loop.remove_reader(channel.fileno())
+                if not closed.done():
+                    closed.set_result(None)
+                return
+            for fd in fds:
+                task = loop.create_task(serve(socket.socket(fileno=fd)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    channel.setblocking(False)
+    loop.add_reader(channel.fileno(), on_readable)
+    await closed
@@ -0,0 +1,959 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+# chromadb, sentence-transformers and scipy (lexical_index) are imported on first semantic query
+# (ERGEngine._load_semantic), so UN ID / name lookups start without them.
+from material_index import (MaterialIndex, INDEX_FILENAME, query_language, normalize_name, material_names,
+                            material_key)
+from entity_extractor import EntityExtractor, ENTITY_EXTRACTOR_FILENAME
+from match_confidence import (CascadeCalibration, DEFAULT_CALIBRATION, CASCADE_CALIBRATION_FILENAME, CASCADE_TIERS,
+                              LEXICAL_TIER_K, ranking_features, tier_label)
+from hazard_table import HazardTable, HAZARD_TABLE_FILENAME
+from distance_engine import ProtectiveDistanceEngine
+from guide_sections import route_question, order_sections
+from response_cache import ResponseCache, DBVersion, read_db_version, RESPONSE_CACHE_ENV_VAR
+from response_cards import ResponseCardStore, RESPONSE_CARDS_FILENAME
+from vector_store import (open_vector_store, ChromaVectorStore, VECTOR_STORE_DIRNAME, VECTOR_STORE_ENV_VAR,
+                          DEFAULT_VECTOR_STORE, HNSW_EF_ENV_VAR, DEFAULT_HNSW_EF)
+from rag_results import (MaterialHit, HazardFlags, DistanceInfo, GuideSection, GuideResult, Answer, IncidentAnswer,
+                         ResponseCard)
+from instrumentation import tracer
+
+# Configuration
+DB_DIR = "erg_chroma_db_cn"
+EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_CACHE_DIR = os.path.join(DB_DIR, "query_embedding_cache")
+
+# Language partitions; the English one only exists after `build_rag_db_cn.py --bilingual`
+COLLECTION_CN = "erg_cn"
+COLLECTION_EN = "erg_en"
+
+UN_ID_PATTERN = re.compile(r"(?:UN\s?|ID\s?)?(\d{4})\b", re.IGNORECASE)
+
+
+# Conjunctions and list marks between materials in an incident description ("氯氣與氨氣同時外洩")
+INCIDENT_SEPARATOR_PATTERN = re.compile(r"以及|與|和|及|跟|、|[/+&;；]|\band\b|\bwith\b", re.IGNORECASE)
+# Threads per incident query: semantic material lookups and guide retrievals run side by side
+INCIDENT_WORKERS = 4
+
+
+class ERGEngine:
+    """
+    ERG 檢索引擎核心：物質識別、綠色表格距離、指南章節檢索與整合式查詢。
+    所有查詢方法都回傳 rag_results 的結構化物件 (附各階段耗時)，不輸出任何訊息；
+    載入過程的狀態訊息經由 notify() 送出 (預設寫到 stderr)，主控台演示 (demo_rag_cn.py) 覆寫它以彩色輸出。
+    """
+
+    def __init__(self, embedding_cache_dir: Optional[str] = EMBEDDING_CACHE_DIR, warmup: bool = False,
+                 embedding_backend: Optional[str] = None, response_cache_path: Optional[str] = None,
+                 vector_store: Optional[str] = None, hnsw_ef: Optional[int] = None,
+                 embedding_threads: Optional[int] = None):
+        """
+        只載入記憶體索引與綠色表格 (UN 編號 / 名稱查詢立即可用)；ChromaDB、embedding 模型與 BM25 索引
+        在第一次語意查詢時才載入。warmup=True 時改由背景執行緒預先載入 (常駐服務、完整演示)。
+        embedding_backend 為 None 時使用 ERG_RAG_EMBEDDING_BACKEND 環境變數，未設定則沿用建置資料庫時記錄的後端。
+        response_cache_path 為共用回應快取的 SQLite 檔 (預設使用 ERG_RAG_RESPONSE_CACHE 環境變數，未設定則僅使用記憶體快取)。
+        vector_store 選擇向量查詢的實作 ("chroma" / "flat" / "hnsw"，預設使用 ERG_RAG_VECTOR_STORE 環境變數，未設定則為 chroma)；
+        hnsw_ef 為 hnsw 的搜尋廣度 (預設使用 ERG_RAG_HNSW_EF 環境變數)。
+        embedding_threads 限制 embedding 模型的運算執行緒數 (預設每個核心一個；多工作行程服務每個行程使用 1)。
+        """
+        if not os.path.exists(DB_DIR):
+            raise FileNotFoundError(f"database directory '{DB_DIR}' not found, run build_rag_db_cn.py first")
+        # Version stamp of the data loaded below; checked again once everything is loaded
+        loading_version = DBVersion(DB_DIR).current()
+
+        self.embedding_cache_dir = embedding_cache_dir
+        self.embedding_backend = embedding_backend
+        self.vector_store = vector_store or os.environ.get(VECTOR_STORE_ENV_VAR) or DEFAULT_VECTOR_STORE
+        self.hnsw_ef = hnsw_ef or int(os.environ.get(HNSW_EF_ENV_VAR) or DEFAULT_HNSW_EF)
+        self.embedding_threads = embedding_threads
+        self._semantic_lock = threading.Lock()
+        self._ef = None
+        self._partitions: Optional[Dict[str, Any]] = None
+        # Exported vector stores loaded before forking (preload_shared), by partition name
+        self._preloaded_stores: Dict[str, Any] = {}
+        self._lexical_index = None
+        self._extractor_lock = threading.Lock()
+        self._entity_extractor: Optional[EntityExtractor] = None
+
+        # 載入物質查詢索引 (UN 編號 / 中英文名稱)，精確查詢不需經過 embedding
+        index_path = os.path.join(DB_DIR, INDEX_FILENAME)
+        if os.path.exists(index_path):
+            self.material_index = MaterialIndex.load(index_path)
+        else:
+            # 舊版資料庫沒有索引檔，改從集合的 Metadata 建立 (不需計算 embedding)；
+            # 直接開啟集合，不經過語意層 (其載入過程需要已建立的物質索引)
+            import chromadb
+            collection = chromadb.PersistentClient(path=DB_DIR).get_collection(name=COLLECTION_CN,
+                                                                               embedding_function=None)
+            records = collection.get(where={"type": "material"}, include=["metadatas"])
+            self.material_index = MaterialIndex(records['metadatas'])
+        self.notify("info", f"物質查詢索引已載入 ({len(self.material_index)} 筆)。")
+
+        # 載入綠色表格數值資料 (隔離/防護距離、遇水產生氣體)，以 memory-map 開啟
+        hazard_path = os.path.join(DB_DIR, HAZARD_TABLE_FILENAME)
+        self.hazard_table = HazardTable.load(hazard_path) if os.path.exists(hazard_path) else None
+        if self.hazard_table is None:
+            self.notify("warning", f"找不到綠色表格資料 '{hazard_path}'，請重新執行 build_rag_db_cn.py。")
+        # 防護距離計算引擎 (依容器/日夜/風速直接選出距離，不經過 RAG)
+        self.distance_engine = ProtectiveDistanceEngine(self.hazard_table) if self.hazard_table is not None else None
+
+        # 語意搜尋候選層級的信心分數校正 (calibrate_cascade.py 以標註查詢集產生)，沒有時使用預設門檻
+        calibration_path = os.path.join(DB_DIR, CASCADE_CALIBRATION_FILENAME)
+        if os.path.exists(calibration_path):
+            self.calibration = CascadeCalibration.load(calibration_path)
+        else:
+            self.calibration = DEFAULT_CALIBRATION
+            self.notify("info", f"找不到信心分數校正檔 '{calibration_path}'，使用預設門檻 (可執行 calibrate_cascade.py 產生)。")
+
+        # 回應卡 (建置時依 UN 編號預先整理的物質、綠色表格與指南全文)：已知 UN 編號與關鍵字可判斷章節的指南問題直接讀取
+        cards_path = os.path.join(DB_DIR, RESPONSE_CARDS_FILENAME)
+        self.response_cards = ResponseCardStore(cards_path) if os.path.exists(cards_path) else None
+        if self.response_cards is None:
+            self.notify("warning", f"找不到回應卡 '{cards_path}'，指南問題一律經由語意檢索，請重新執行 build_rag_db_cn.py。")
+
+        # 資料的版本：載入期間資料庫被重建 (前後戳記不同) 時無法確定載入的是哪一版，視同沒有版本
+        self.db_version = loading_version if DBVersion(DB_DIR).current() == loading_version else None
+
+        # 回應快取 (整合式查詢、指南檢索)：以載入資料時的版本戳記為鍵的一部分，
+        # 不會把以舊資料算出的結果存到重建後的新版本下 (重建後請重新啟動以載入新資料)
+        self.response_cache = ResponseCache(
+            DB_DIR, self.db_version, shared_path=response_cache_path or os.environ.get(RESPONSE_CACHE_ENV_VAR) or None)
+        if self.db_version is None:
+            self.notify("warning", "資料庫沒有版本戳記 (或載入期間正在重建)，回應快取停用，請重新執行 build_rag_db_cn.py。")
+
+        if warmup:
+            self.warmup()
+
+    def notify(self, level: str, message: str):
+        """載入過程的狀態訊息 (level: "info" / "warning" / "error")。"""
+        print(f"[{level}] {message}", file=sys.stderr)
+
+    def warmup(self) -> threading.Thread:
+        """在背景執行緒載入物質名稱擷取器、ChromaDB、embedding 模型與 BM25 索引；第一筆語意查詢會等待載入完成。"""
+        def run():
+            try:
+                self.entity_extractor
+                self._load_semantic()
+            except Exception as e:
+                self.notify("warning", f"背景預先載入失敗 (將於第一次語意查詢時重試): {e}")
+
+        thread = threading.Thread(target=run, name="erg-rag-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def preload_shared(self):
+        """
+        在目前的執行緒預先載入可由 fork 出的工作行程以 copy-on-write 共用的部分：物質名稱擷取器、embedding 模型權重、
+        BM25 索引與匯出的 flat / hnsw 向量索引 (多工作行程服務的主行程在 fork 之前呼叫)。
+        ChromaDB 的 client 不能跨 fork 使用，因此這裡不開啟集合，
+        也不計算任何 embedding；各工作行程在 warmup 或第一次語意查詢時自行開啟集合，並沿用已載入的模型。
+        模型後端依資料庫版本戳記記錄的建置後端決定，工作行程開啟集合後仍會檢查相容性。
+        """
+        from embedding_backends import BackendEmbeddingFunction, BACKEND_ENV_VAR, DEFAULT_BACKEND, model_cache_dir
+
+        self.entity_extractor
+        with tracer.span("startup.preload"):
+            build_backend = read_db_version(DB_DIR).get("backend") or DEFAULT_BACKEND
+            backend = self.embedding_backend or os.environ.get(BACKEND_ENV_VAR) or build_backend
+            with tracer.span("startup.model"):
+                # Kept in the per-process model table, where _load_semantic picks it up after the fork
+                BackendEmbeddingFunction(EMBEDDING_MODEL, backend, threads=self.embedding_threads,
+                                         cache_dir=model_cache_dir(DB_DIR))
+            if self._lexical_index is None:
+                self._lexical_index = self._load_lexical_index()
+            if self.vector_store != DEFAULT_VECTOR_STORE:
+                with tracer.span("startup.vector_store"):
+                    self._preloaded_stores = self._preload_vector_stores()
+
+    def _load_semantic(self):
+        with self._semantic_lock:
+            if self._partitions is not None:
+                return
+            with tracer.span("startup.semantic"):
+                import chromadb
+                from embedding_cache import CachedEmbeddingFunction
+                from embedding_backends import (BackendEmbeddingFunction, BACKEND_ENV_VAR, recorded_backend,
+                                                check_compatible, embedding_id, model_cache_dir)
+
+                client = chromadb.PersistentClient(path=DB_DIR)
+                try:
+                    # 先不指定 embedding function 取得集合，讀取建置時記錄的後端
+                    collection = client.get_collection(name=COLLECTION_CN, embedding_function=None)
+                except Exception as e:
+                    self.notify("error", f"載入集合時發生錯誤: {e}")
+                    raise RuntimeError(f"cannot load collection '{COLLECTION_CN}' from '{DB_DIR}'") from e
+                build_backend = recorded_backend(collection.metadata)
+                backend = self.embedding_backend or os.environ.get(BACKEND_ENV_VAR) or build_backend
+                check_compatible(build_backend, backend)
+
+                # 使用與建立資料庫時相同的 Embedding 模型 (相容的後端)，並加上查詢快取 (重複的查詢字句不需重新計算)
+                # embedding_cache_dir=None 時僅使用記憶體快取 (例如效能測試需要從空快取開始)
+                with tracer.span("startup.model"):
+                    ef = CachedEmbeddingFunction(BackendEmbeddingFunction(EMBEDDING_MODEL, backend,
+                                                                          threads=self.embedding_threads,
+                                                                          cache_dir=model_cache_dir(DB_DIR)),
+                                                 model_name=embedding_id(EMBEDDING_MODEL, backend),
+                                                 cache_dir=self.embedding_cache_dir)
+                collection = client.get_collection(name=COLLECTION_CN, embedding_function=ef)
+                self.notify("info", f"資料庫連接成功。集合 '{COLLECTION_CN}' 包含 {collection.count()} 筆文件 "
+                                    f"(embedding 後端: {backend})。")
+
+                # 語言分區: 有英文集合時，依查詢的 CJK 字元比例只搜尋對應語言的分區 (兩者共用同一個 embedding)
+                partitions = {"cn": collection}
+                try:
+                    en_collection = client.get_collection(name=COLLECTION_EN, embedding_function=ef)
+                except Exception:
+                    en_collection = None
+                if en_collection is not None and recorded_backend(en_collection.metadata) != build_backend:
+                    self.notify("warning", "英文分區的 embedding 後端與中文分區不同，請以 --bilingual 重新建置。"
+                                           "暫不使用英文分區。")
+                elif en_collection is not None:
+                    partitions["en"] = en_collection
+                    self.notify("info", f"英文分區 '{COLLECTION_EN}' 包含 {en_collection.count()} 筆文件，"
+                                        f"查詢將依語言分流。")
+                with tracer.span("startup.vector_store"):
+                    partitions = self._open_vector_stores(partitions)
+
+                lexical_index = self._lexical_index if self._lexical_index is not None else self._load_lexical_index()
+
+            # Publish the partitions last: they mark the semantic stack as loaded
+            if self._ef is None:
+                self._ef = ef
+            self._lexical_index = lexical_index
+            self._partitions = partitions
+
+    def _load_lexical_index(self):
+        """載入 BM25 關鍵字索引 (與物質查詢索引同列順序)；舊版資料庫沒有此檔時僅使用向量搜尋。"""
+        from lexical_index import LexicalIndex, LEXICAL_INDEX_FILENAME
+
+        lexical_path = os.path.join(DB_DIR, LEXICAL_INDEX_FILENAME)
+        lexical_index = LexicalIndex.load(lexical_path) if os.path.exists(lexical_path) else None
+        if lexical_index is not None and len(lexical_index) != len(self.material_index):
+            self.notify("warning", "關鍵字索引與物質索引不一致，請重新執行 build_rag_db_cn.py。僅使用向量搜尋。")
+            lexical_index = None
+        if lexical_index is not None:
+            self.notify("info", "關鍵字索引已載入，啟用混合檢索 (BM25 + 向量)。")
+        return lexical_index
+
+    def _preload_vector_stores(self) -> Dict[str, Any]:
+        """
+        在 fork 之前載入匯出的向量索引 (不需開啟 ChromaDB)：float16 匯出轉成的 float32 矩陣與 HNSW 索引只佔一份記憶體，
+        由各工作行程共用。無法載入的分區略過，由工作行程開啟集合時改用 ChromaDB 並提示。
+        """
+        store_dir = os.path.join(DB_DIR, VECTOR_STORE_DIRNAME)
+        stores = {}
+        for name in (COLLECTION_CN, COLLECTION_EN):
+            try:
+                stores[name] = open_vector_store(self.vector_store, None, store_dir, name, self.db_version,
+                                                 hnsw_ef=self.hnsw_ef)
+            except (ImportError, OSError, ValueError):
+                continue
+        return stores
+
+    def _open_vector_stores(self, collections: Dict[str, Any]) -> Dict[str, Any]:
+        """依設定包裝各分區的向量查詢 (Chroma 或建置時匯出的 flat / hnsw 索引)；無法使用時退回 Chroma。"""
+        store_dir = os.path.join(DB_DIR, VECTOR_STORE_DIRNAME)
+        # Exports are stamped with the DB version they were taken from (a stale export is not used)
+        version = DBVersion(DB_DIR).current()
+        if version != self.db_version:
+            self.notify("warning", "資料庫已在本行程啟動後重建，請重新啟動以載入新資料。")
+        stores = {}
+        for lang, collection in collections.items():
+            preloaded = self._preloaded_stores.get(collection.name)
+            if preloaded is not None and version == self.db_version:
+                stores[lang] = preloaded
+                continue
+            try:
+                stores[lang] = open_vector_store(self.vector_store, collection, store_dir, collection.name, version,
+                                                 hnsw_ef=self.hnsw_ef)
+            except (ImportError, OSError, ValueError) as e:
+                self.notify("warning", f"無法使用 '{self.vector_store}' 向量索引 ({e})，改用 ChromaDB 查詢。"
+                                       f"請重新執行 build_rag_db_cn.py 匯出向量。")
+                stores[lang] = ChromaVectorStore(collection)
+        if self.vector_store != DEFAULT_VECTOR_STORE and all(store.kind == self.vector_store for store in stores.values()):
+            self.notify("info", f"向量查詢使用匯出的 '{self.vector_store}' 索引。")
+        return stores
+
+    @property
+    def entity_extractor(self) -> EntityExtractor:
+        """問句中的物質名稱擷取器 (建置時編譯)，第一次使用時載入。"""
+        if self._entity_extractor is None:
+            with self._extractor_lock:
+                if self._entity_extractor is None:
+                    self._entity_extractor = self._load_entity_extractor()
+        return self._entity_extractor
+
+    def _load_entity_extractor(self) -> EntityExtractor:
+        path = os.path.join(DB_DIR, ENTITY_EXTRACTOR_FILENAME)
+        with tracer.span("startup.entity_extractor"):
+            extractor = EntityExtractor.load(path) if os.path.exists(path) else None
+            if extractor is None or len(extractor) != len(self.material_index):
+                # 舊版資料庫沒有擷取器 (或與物質索引不一致)，改從物質索引編譯
+                self.notify("warning", "物質名稱擷取器不存在或與物質索引不一致，暫時從物質索引編譯，"
+                                       "請重新執行 build_rag_db_cn.py。")
+                extractor = EntityExtractor.build(self.material_index.materials)
+        return extractor
+
+    def find_mentions(self, text: str) -> List[Tuple[Dict[str, Any], int, int]]:
+        """
+        找出問句中提到的所有物質 (例如「氯與無水氨同時外洩」)，回傳 [(metadata, 起點, 終點)]，依出現順序排列。
+        位置為 normalize_name(text) 中的字元位置。
+        """
+        key = normalize_name(text)
+        return [(self.material_index.materials[row], start, end)
+                for row, start, end in self.entity_extractor.extract(key)]
+
+    @property
+    def semantic_loaded(self) -> bool:
+        return self._partitions is not None
+
+    @property
+    def ef(self):
+        if self._ef is None:
+            self._load_semantic()
+        return self._ef
+
+    @ef.setter
+    def ef(self, value):
+        # Allows wrapping the embedding function (e.g. benchmark timers)
+        self._ef = value
+
+    @property
+    def partitions(self) -> Dict[str, Any]:
+        if self._partitions is None:
+            self._load_semantic()
+        return self._partitions
+
+    @partitions.setter
+    def partitions(self, value: Dict[str, Any]):
+        self._load_semantic()
+        self._partitions = value
+
+    @property
+    def collection(self):
+        return self.partitions["cn"]
+
+    @property
+    def lexical_index(self):
+        if self._partitions is None:
+            self._load_semantic()
+        return self._lexical_index
+
+    def hazard_info(self, un_id: str) -> Optional[DistanceInfo]:
+        """依 UN 編號取得綠色表格 (Table 1/2/3) 的數值資料 (O(1) 查表)，無資料時回傳 None。"""
+        if self.hazard_table is None:
+            return None
+        return DistanceInfo.from_lookup(self.hazard_table.lookup(un_id))
+
+    def response_card(self, un_id: str) -> Optional[ResponseCard]:
+        """
+        依 UN 編號讀取回應卡：此編號下的所有物質、綠色表格數值與各指南全文，一次鍵值讀取，不經過 embedding 或向量查詢。
+        編號不在資料庫中 (或沒有回應卡檔) 時回傳 None。
+        """
+        if self.response_cards is None:
+            return None
+        with tracer.span("card.read"):
+            card = self.response_cards.card(un_id)
+            if card is None:
+                return None
+            question = f"UN {card['un_id']}"
+            confidence = self.calibration.confidence("un_id")
+            materials = [MaterialHit.from_meta(question, meta, "UN ID 精確匹配 (回應卡)", tier="card", confidence=confidence)
+                         for meta in card["materials"]]
+            guides = [self._stored_guide(guide_no, question) or GuideResult(guide_no, question, [], None)
+                      for guide_no in card["guide_nos"]]
+            return ResponseCard(card["un_id"], materials, DistanceInfo.from_lookup(card["hazard"]), guides)
+
+    def protective_distance(self, un_id: str, large_spill: bool = True, container: Optional[str] = None,
+                            night: bool = False, wind_kmh: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """依現場條件 (洩漏規模、容器、日/夜、風速 km/h) 計算初始隔離與防護距離，無綠色表格資料時回傳 None。"""
+        if self.distance_engine is None:
+            return None
+        with tracer.span("distance.evaluate"):
+            return self.distance_engine.protective_distance(un_id, large_spill, container, night, wind_kmh)
+
+    def _partition(self, text: str) -> str:
+        """依查詢語言選擇分區 ("cn" / "en")；沒有英文分區時一律使用中文分區。"""
+        lang = query_language(text)
+        partition = lang if lang in self.partitions else "cn"
+        tracer.count(f"route.{partition}")
+        return partition
+
+    def _resolve_from_index(self, query: str,
+                            extract_mentions: bool = False) -> Tuple[Optional[Tuple[Dict[str, Any], str, str]], Optional[str]]:
+        """
+        策略 1/2/3: UN 編號、名稱精確/前綴匹配、問句中的物質名稱擷取 (extract_mentions=True)，完全在記憶體內完成。
+        回傳 (索引命中結果 (metadata, 匹配方式, 匹配類型), UN 編號)；UN 編號不在索引中時需改用 Chroma 的 un_id 過濾查詢。
+        匹配類型 ("un_id" / "exact" / "prefix" / "mention") 用於計算信心分數。
+        """
+        un_id_match = UN_ID_PATTERN.search(query)
+
+        if un_id_match and "Guide" not in query and "指南" not in query:
+            un_id = un_id_match.group(1)
+            metas = self.material_index.lookup_un_id(un_id)
+            if metas:
+                return (metas[0], "UN ID 精確匹配", "un_id"), un_id
+            return None, un_id
+
+        # 名稱精確/前綴匹配，命中時不需計算 embedding
+        index_hit = self.material_index.lookup(query)
+        if index_hit is not None:
+            return (*index_hit, "exact" if self.material_index.lookup_exact(query) is not None else "prefix"), None
+        if extract_mentions:
+            # 口語化問句：取第一個提到的物質名稱 (整句 embedding 會被其餘字詞稀釋)
+            mentions = self.find_mentions(query)
+            if mentions:
+                meta = mentions[0][0]
+                return (meta, f"問句名稱擷取 ('{meta['name']}')", "mention"), None
+        return None, None
+
+    def find_material(self, query: str, include_candidates: bool = False,
+                      extract_mentions: bool = False) -> Optional[MaterialHit]:
+        """
+        物質搜尋：
+        1. 優先檢查是否為 UN 編號 (直接查詢記憶體索引)
+        2. 名稱精確/前綴匹配 (直接查詢記憶體索引)
+        3. extract_mentions=True 時 (整合式查詢)，擷取問句中提到的已知物質名稱或同義詞 (Aho-Corasick 自動機)
+        4. 若以上皆未命中，則依候選層級遞增搜尋 (見 _semantic_cascade)：先以 BM25 候選做名稱匹配，不確定時才計算 embedding，
+           進行語意搜尋 + 關鍵字過濾 (只搜尋查詢語言對應的分區)，候選數由少到多
+        找不到時回傳 None。timings_ms 為各階段耗時 (filter: 記憶體索引, embed, query: 向量查詢, refine: 融合與篩選排序)；
+        tier 為回答的層級，confidence 為校正後的信心分數。
+        include_candidates=True 時另附 candidates: 依排名排序的候選物質 (第一筆即為識別結果)，供評估 top-k 召回率使用。
+        """
+        start_time = time.perf_counter()
+        timings: Dict[str, float] = {}
+
+        with tracer.span("material.filter", timings):
+            index_hit, un_id = self._resolve_from_index(query, extract_mentions)
+        if index_hit:
+            tracer.count("material.index_hit")
+            meta, match_method, kind = index_hit
+            candidates = self.material_index.lookup_un_id(meta['un_id']) if un_id else [meta]
+            return self._material_hit(query, meta, match_method, "index", self.calibration.confidence(kind),
+                                      time.perf_counter() - start_time,
+                                      timings, candidates if include_candidates else None)
+
+        if un_id:
+            with tracer.span("material.embed", timings):
+                embedding = self.ef([query])
+            with tracer.span("material.query", timings):
+                results = self.partitions[self._partition(query)].query(
+                    query_embeddings=embedding,
+                    n_results=5,
+                    where={"$and": [{"un_id": un_id}, {"type": "material"}]}
+                )
+            if not results or not results['ids'] or not results['ids'][0]:
+                tracer.count("material.not_found")
+                return None
+            tracer.count("material.un_filter_hit")
+            # From UN ID query types
+            return self._material_hit(query, results['metadatas'][0][0], "UN ID 精確匹配", "un_filter",
+                                      self.calibration.confidence("un_id"), time.perf_counter() - start_time,
+                                      timings, results['metadatas'][0] if include_candidates else None)
+
+        found = self._semantic_cascade([query], self._partition(query), "material", timings)[0]
+        if found is None:
+            return None
+        meta, match_method, tier, confidence, candidates = found
+        return self._material_hit(query, meta, match_method, tier, confidence, time.perf_counter() - start_time,
+                                  timings, candidates if include_candidates else None)
+
+    @staticmethod
+    def _material_hit(query: str, meta: Dict[str, Any], match_method: str, tier: str, confidence: float,
+                      elapsed: float, timings: Dict[str, float],
+                      candidates: Optional[List[Dict[str, Any]]]) -> MaterialHit:
+        if candidates is not None:
+            # The refined pick goes first; the remaining candidates keep their retrieval order
+            candidates = [meta] + [c for c in candidates if c != meta]
+        return MaterialHit.from_meta(query, meta, match_method, elapsed,
+                                     {stage: round(ms, 3) for stage, ms in timings.items()}, candidates,
+                                     tier, round(confidence, 4))
+
+    def _semantic_cascade(self, queries: List[str], partition: str, span_prefix: str,
+                          timings: Dict[str, float]) -> List[Optional[Tuple[Dict[str, Any], str, str, float, List[Dict[str, Any]]]]]:
+        """
+        候選層級遞增的物質搜尋，每個層級依匹配方式計算校正後的信心分數，達到門檻即回答：
+        1. lexical: 只以 BM25 前幾筆篩選排序，名稱匹配 (精確 / 部分名稱) 可直接回答，不需計算 embedding
+        2. semantic@5、semantic@20 (校正時選定的向量候選層級，預設為 CASCADE_TIERS): 向量前 k 筆與 BM25 前 k 筆融合後篩選排序；
+           只有不確定的查詢才以更多候選重新查詢向量資料庫，最後一個層級一律回答
+        回傳每個查詢的 (metadata, 匹配方式, 層級, 信心分數, 候選)，找不到時為 None。
+        """
+        results: List[Optional[Tuple[Dict[str, Any], str, str, float, List[Dict[str, Any]]]]] = [None] * len(queries)
+        with tracer.span(f"{span_prefix}.refine", timings, size=len(queries), tier="lexical"):
+            lexical_hits = self._lexical_candidates(queries)
+            pending = []
+            for pos, found in enumerate(self._lexical_tier(queries, lexical_hits)):
+                # A ranking-only pick needs the vector tiers
+                confidence = self.calibration.confidence(found[2]) if found and found[2] != "ranking" else 0.0
+                if found and self.calibration.accepts(confidence):
+                    results[pos] = (found[0], found[1], "lexical", confidence, found[4])
+                    tracer.count("material.tier.lexical")
+                else:
+                    pending.append(pos)
+        if not pending:
+            return results
+
+        collection = self.partitions[partition]
+        # Embed explicitly (instead of query_texts) so embedding and vector search are separate steps
+        with tracer.span(f"{span_prefix}.embed", timings, size=len(pending)):
+            embeddings = dict(zip(pending, self.ef([queries[pos] for pos in pending])))
+        for k in self.calibration.tiers:
+            tier = tier_label(k)
+            tier_results = self._cascade_tier(collection, [queries[pos] for pos in pending],
+                                              [embeddings[pos] for pos in pending],
+                                              [lexical_hits[pos] for pos in pending], k, span_prefix, timings)
+            ambiguous = []
+            for pos, found in zip(pending, tier_results):
+                # Without any candidate a wider tier cannot help either: the query is not found
+                if found is None:
+                    continue
+                meta, match_method, kind, features, candidates = found
+                confidence = self.calibration.confidence(kind, features)
+                if k == self.calibration.tiers[-1] or self.calibration.accepts(confidence):
+                    results[pos] = (meta, match_method, tier, confidence, candidates)
+                    tracer.count(f"material.tier.{tier}")
+                    if kind == "ranking":
+                        tracer.count("material.ranking_fallback")
+                else:
+                    ambiguous.append(pos)
+            pending = ambiguous
+            if not pending:
+                break
+
+        tracer.count("material.not_found", sum(1 for result in results if result is None))
+        return results
+
+    def _lexical_candidates(self, queries: List[str]) -> List[List[Tuple[int, float]]]:
+        """BM25 前幾名 (最寬的候選層級)；BM25 一次計算全部物質的分數，各層級只取其前 k 筆。"""
+        if self.lexical_index is None:
+            return [[] for _ in queries]
+        return self.lexical_index.search_batch(queries, k=CASCADE_TIERS[-1])
+
+    def _lexical_tier(self, queries: List[str], lexical_hits: List[List[Tuple[int, float]]]
+                      ) -> List[Optional[Tuple[Dict[str, Any], str, str, None, List[Dict[str, Any]]]]]:
+        """BM25 前 LEXICAL_TIER_K 筆篩選排序；回傳格式同 _cascade_tier (沒有排名特徵)。"""
+        candidate_lists = [[self.material_index.materials[pos] for pos, _ in hits[:LEXICAL_TIER_K]] for hits in lexical_hits]
+        rows = [row for row, metas in enumerate(candidate_lists) if metas]
+        refined = self._refine_batch([queries[row] for row in rows], [candidate_lists[row] for row in rows],
+                                     "BM25 關鍵字 (最相關結果)") if rows else []
+        results = [None] * len(queries)
+        for row, (meta, match_method, kind) in zip(rows, refined):
+            results[row] = (meta, match_method, kind, None, candidate_lists[row])
+        return results
+
+    def _cascade_tier(self, collection, queries: List[str], embeddings: List[Any],
+                      lexical_hits: List[List[Tuple[int, float]]], k: int, span_prefix: str = "material",
+                      timings: Optional[Dict[str, float]] = None
+                      ) -> List[Optional[Tuple[Dict[str, Any], str, str, Optional[List[float]], List[Dict[str, Any]]]]]:
+        """
+        候選層級 k：向量前 k 筆與 BM25 前 k 筆融合後篩選排序。
+        回傳每個查詢的 (metadata, 匹配方式, 匹配類型, 排名特徵 (只靠排名時), 候選)，沒有任何候選時為 None。
+        """
+        tier = tier_label(k)
+        with tracer.span(f"{span_prefix}.query", timings, size=len(queries), tier=tier):
+            found = collection.query(
+                query_embeddings=embeddings,
+                n_results=k,
+                where={"type": "material"}
+            )
+
+        with tracer.span(f"{span_prefix}.refine", timings, size=len(queries), tier=tier):
+            # 向量候選與 BM25 候選融合 (向量結果不含正確物質時，關鍵字索引仍可找到)
+            candidate_lists = self._fuse_candidates(found['metadatas'], [hits[:k] for hits in lexical_hits], k)
+            rows = [row for row, metas in enumerate(candidate_lists) if metas]
+            refined = self._refine_batch([queries[row] for row in rows], [candidate_lists[row] for row in rows],
+                                         self._fallback_method()) if rows else []
+            results = [None] * len(queries)
+            for row, (meta, match_method, kind) in zip(rows, refined):
+                features = None
+                if kind == "ranking":
+                    vector_metas = found['metadatas'][row]
+                    vector_top = self.material_index.position_of(vector_metas[0]) if vector_metas else None
+                    lexical_top = lexical_hits[row][0][0] if lexical_hits[row] else None
+                    features = ranking_features(found['distances'][row], vector_top, lexical_top)
+                results[row] = (meta, match_method, kind, features, candidate_lists[row])
+        return results
+
+    def _fuse_candidates(self, vector_metas: List[List[Dict[str, Any]]], lexical_hits: List[List[Tuple[int, float]]],
+                         k: int) -> List[List[Dict[str, Any]]]:
+        """
+        混合檢索：BM25 關鍵字索引 (稀疏矩陣一次計算全部物質分數) 的前 k 筆與 Chroma 向量結果
+        以 Reciprocal Rank Fusion 合併排序，取前 k 筆。未載入關鍵字索引時直接回傳向量結果。
+        """
+        if self.lexical_index is None:
+            return vector_metas
+
+        from lexical_index import reciprocal_rank_fusion # Already imported by _load_semantic
+
+        fused = []
+        for metas, hits in zip(vector_metas, lexical_hits):
+            vector_ranking = [pos for pos in map(self.material_index.position_of, metas) if pos is not None]
+            ranking = reciprocal_rank_fusion([vector_ranking, [pos for pos, _ in hits]])
+            fused.append([self.material_index.materials[pos] for pos in ranking[:k]])
+        return fused
+
+    def _fallback_method(self) -> str:
+        if self.lexical_index is not None:
+            return "混合檢索 (BM25 + 向量語意, 最相關結果)"
+        return "向量語意相似度 (最相關結果)"
+
+    @staticmethod
+    def _refine_batch(queries: List[str], candidate_metas: List[List[Dict[str, Any]]],
+                      fallback_method: str = "向量語意相似度 (最相關結果)") -> List[Tuple[Dict[str, Any], str, str]]:
+        """
+        Refinement Logic (向量化處理整批查詢)：
+        將每個查詢的候選名稱 (含別名) 排成 (查詢數 x 候選名稱數) 矩陣，一次計算所有比對條件：
+        1. 精確名稱匹配 2. UN ID 匹配 (查詢為純數字時) 3. 部分名稱匹配 (優先較短名稱；僅在包含查詢的名稱都屬於同一物質時)
+        4. 融合排序 (或向量相似度) 最高者
+        回傳 (metadata, 匹配方式, 匹配類型)；匹配類型 ("exact" / "un_id" / "contains" / "ranking") 用於計算信心分數。
+        """
+        # One column per listed name (canonical name and aliases), in candidate order
+        columns = [[(meta, name) for meta in metas for name in material_names(meta)] for metas in candidate_metas]
+        width = max(len(cols) for cols in columns)
+        pad = [({'un_id': ''}, '')] * width
+        rows = [cols + pad[len(cols):] for cols in columns]
+
+        query_clean = np.array([q.replace("UN", "").replace("ID", "").strip().lower() for q in queries])[:, None]
+        names = np.array([[name.strip().lower() for _, name in row] for row in rows])
+        un_ids = np.array([[str(meta['un_id']) for meta, _ in row] for row in rows])
+        valid = np.array([[pos < len(cols) for pos in range(width)] for cols in columns])
+
+        exact = (names == query_clean) & valid
+        un_match = (un_ids == query_clean) & valid & np.char.isdigit(query_clean)
+        contains = (np.char.find(names, np.broadcast_to(query_clean, names.shape)) >= 0) & valid
+        # Shortest containing name wins; argmin keeps the earlier (more similar) candidate on ties
+        contains_len = np.where(contains, np.char.str_len(names), np.iinfo(np.int64).max)
+
+        refined = []
+        for row, (metas, cols) in enumerate(zip(candidate_metas, columns)):
+            if exact[row].any():
+                meta, name = cols[int(exact[row].argmax())]
+                refined.append((meta, f"精確名稱匹配 ('{name}')", "exact"))
+            elif un_match[row].any():
+                refined.append((cols[int(un_match[row].argmax())][0], "UN ID 匹配", "un_id"))
+            elif contains[row].any() and len({material_key(cols[i][0]) for i in np.flatnonzero(contains[row])}) == 1:
+                # Several materials containing the query ("hydrogen") are left to the ranking, like ambiguous prefixes
+                meta, name = cols[int(contains_len[row].argmin())]
+                refined.append((meta, f"部分名稱匹配 ('{name}')", "contains"))
+            else:
+                refined.append((metas[0], fallback_method, "ranking"))
+        return refined
+
+
+    def search_materials_batch(self, queries: List[str]) -> List[Optional[MaterialHit]]:
+        """
+        批次搜尋物質 (例如列車貨單上的數十個 UN 編號)：
+        索引可回答的查詢直接回傳；其餘查詢依過濾條件分組，每組一次計算 embedding、每個層級只發出一次 Chroma 查詢
+        (語意搜尋先以 BM25 候選回答名稱匹配，只有不確定的查詢才計算 embedding 並進入下一個候選層級)。
+        結果順序與輸入相同 (找不到的物質為 None)。各結果的 elapsed / timings_ms 為整批的耗時。
+        """
+        start_time = time.perf_counter()
+        timings: Dict[str, float] = {}
+        # (metadata, 匹配方式, 層級, 信心分數)
+        found_metas: List[Optional[Tuple[Dict[str, Any], str, str, float]]] = [None] * len(queries)
+
+        # 1. 記憶體索引 (UN 編號 / 名稱精確或前綴匹配)
+        pending: List[int] = []
+        pending_un_ids: Dict[int, str] = {}
+        with tracer.span("material_batch.filter", timings, size=len(queries)):
+            for pos, query in enumerate(queries):
+                index_hit, un_id = self._resolve_from_index(query)
+                if index_hit:
+                    meta, match_method, kind = index_hit
+                    found_metas[pos] = (meta, match_method, "index", self.calibration.confidence(kind))
+                else:
+                    pending.append(pos)
+                    if un_id:
+                        pending_un_ids[pos] = un_id
+        tracer.count("material.index_hit", len(queries) - len(pending))
+
+        # 2. 依語言分區與過濾條件分組: 語意搜尋共用一個 filter；索引外的 UN 編號各自一組
+        groups: Dict[Tuple[str, Optional[str]], List[int]] = {}
+        for pos in pending:
+            groups.setdefault((self._partition(queries[pos]), pending_un_ids.get(pos)), []).append(pos)
+
+        # 3. 語意搜尋: 整組查詢共用一次 BM25 稀疏矩陣運算、一次 embedding 與各候選層級的向量查詢
+        for (partition, un_id), positions in groups.items():
+            if not un_id:
+                cascade = self._semantic_cascade([queries[pos] for pos in positions], partition, "material_batch", timings)
+                for pos, hit in zip(positions, cascade):
+                    if hit:
+                        found_metas[pos] = hit[:4]
+
+        # 4. 索引外的 UN 編號: 一次批次計算 embedding，每個編號以 un_id 過濾查詢
+        un_positions = [pos for (_, un_id), positions in groups.items() if un_id for pos in positions]
+        if un_positions:
+            with tracer.span("material_batch.embed", timings, size=len(un_positions)):
+                embeddings = dict(zip(un_positions, self.ef([queries[pos] for pos in un_positions])))
+            for (partition, un_id), positions in groups.items():
+                if not un_id:
+                    continue
+                with tracer.span("material_batch.query", timings, size=len(positions)):
+                    group_results = self.partitions[partition].query(
+                        query_embeddings=[embeddings[pos] for pos in positions],
+                        n_results=5,
+                        where={"$and": [{"un_id": un_id}, {"type": "material"}]}
+                    )
+                found = [(pos, metas) for pos, metas in zip(positions, group_results['metadatas']) if metas]
+                tracer.count("material.un_filter_hit", len(found))
+                tracer.count("material.not_found", len(positions) - len(found))
+                for pos, metas in found:
+                    found_metas[pos] = (metas[0], "UN ID 精確匹配", "un_filter", self.calibration.confidence("un_id"))
+
+        elapsed = time.perf_counter() - start_time
+        timings_ms = {stage: round(ms, 3) for stage, ms in timings.items()}
+        return [MaterialHit.from_meta(query, hit[0], hit[1], elapsed, timings_ms, tier=hit[2],
+                                      confidence=round(hit[3], 4)) if hit else None
+                for query, hit in zip(queries, found_metas)]
+
+    @staticmethod
+    def _guide_query(guide_no: str, specific_question: str) -> Tuple[Dict[str, Any], int]:
+        """
+        依問題決定要檢索的章節：關鍵字可判斷章節時 (例如「吸入」-> 急救) 只在這些章節內搜尋；
+        否則在該指南所有章節中以語意相似度取前兩個章節。回傳 (where 過濾條件, n_results)。
+        """
+        sections = route_question(specific_question)
+        conditions = [{"guide_no": guide_no}, {"type": "guide"}]
+        if sections:
+            tracer.count("guide.section_routed")
+            conditions.append({"section": {"$in": sections}})
+            return {"$and": conditions}, len(sections)
+        tracer.count("guide.section_semantic")
+        return {"$and": conditions}, 2
+
+    @staticmethod
+    def _collect_sections(guide_no: str, specific_question: str, metas: List[Dict[str, Any]], docs: List[str]) -> Optional[GuideResult]:
+        if not docs:
+            return None
+        sections = order_sections([(meta.get('section', ''), doc) for meta, doc in zip(metas, docs)])
+        return GuideResult(
+            guide_no=guide_no,
+            question=specific_question,
+            sections=[GuideSection(section, text) for section, text in sections],
+            text="\n\n".join(text for _, text in sections)
+        )
+
+    def find_guide(self, guide_no: str, specific_question: str) -> Optional[GuideResult]:
+        """
+        指南檢索：在指定指南範圍內只檢索與問題相關的章節 (急救、火災、洩漏、公共安全、潛在危害)，
+        找不到時回傳 None。結果存入回應快取，相同的 (指南, 問題) 在資料庫重建前不需重新檢索。
+        """
+        # 處理指南編號格式 (例如去除 'P' 後綴)
+        search_guide_no = guide_no.rstrip('P')
+        return self.response_cache.get_or_compute(
+            "guide", (search_guide_no, specific_question),
+            lambda: self._retrieve_guide(search_guide_no, specific_question), decode=GuideResult.from_dict)
+
+    def _stored_guide(self, guide_no: str, specific_question: str,
+                      sections: Optional[List[str]] = None) -> Optional[GuideResult]:
+        """從回應卡檔讀取指南 (問題語言對應的分區，沒有時使用中文)；sections 為 None 時取全文。"""
+        lang = query_language(specific_question)
+        stored = self.response_cards.guide(guide_no, lang if lang in self.response_cards.languages else "cn")
+        if stored is None:
+            return None
+        if sections is not None:
+            stored = [(section, text) for section, text in stored if section in sections]
+        metas = [{"section": section} for section, _ in stored]
+        return self._collect_sections(guide_no, specific_question, metas, [text for _, text in stored])
+
+    def _is_material_reference(self, text: str) -> bool:
+        """問題只是 UN 編號或物質名稱 (沒有其他要問的內容)。"""
+        return not UN_ID_PATTERN.sub("", text).strip() or self.material_index.lookup(text) is not None
+
+    def _card_guide(self, guide_no: str, specific_question: str) -> Optional[GuideResult]:
+        """
+        不需語意檢索即可決定答案的指南問題，直接由回應卡檔回答：
+        關鍵字可判斷章節時回傳這些章節 (與在章節內檢索的結果相同)；問題只是 UN 編號或物質名稱時回傳指南全文。
+        其餘開放式問題回傳 None，改由 RAG 檢索。
+        """
+        if self.response_cards is None:
+            return None
+        sections = route_question(specific_question)
+        if not sections and not self._is_material_reference(specific_question):
+            return None
+        with tracer.span("guide.card"):
+            result = self._stored_guide(guide_no, specific_question, sections or None)
+        if result is not None:
+            tracer.count("guide.card_hit")
+        return result
+
+    def _retrieve_guide(self, search_guide_no: str, specific_question: str) -> Optional[GuideResult]:
+        result = self._card_guide(search_guide_no, specific_question)
+        if result is not None:
+            return result
+        with tracer.span("guide.filter"):
+            where, n_results = self._guide_query(search_guide_no, specific_question)
+        with tracer.span("guide.embed"):
+            embedding = self.ef([f"Guide {search_guide_no} {specific_question}"])
+        with tracer.span("guide.query"):
+            results = self.partitions[self._partition(specific_question)].query(
+                query_embeddings=embedding,
+                n_results=n_results, 
+                where=where
+            )
+        
+        with tracer.span("guide.refine"):
+            return self._collect_sections(search_guide_no, specific_question, results['metadatas'][0], results['documents'][0])
+
+    def find_guides_batch(self, pairs: List[Tuple[str, str]]) -> List[GuideResult]:
+        """
+        批次檢索指南內容：pairs 為 (指南編號, 問題) 列表。
+        所有問題一次計算 embedding，並依 (指南編號, 相關章節) 分組查詢。結果順序與輸入相同
+        (找不到內容的指南 sections 為空、text 為 None)。
+        """
+        # 處理指南編號格式 (例如去除 'P' 後綴)
+        guide_nos = [str(guide_no).rstrip('P') for guide_no, _ in pairs]
+        questions = [question for _, question in pairs]
+        # Questions answered from the response cards skip embedding and vector search
+        results: List[Optional[GuideResult]] = [self._card_guide(g, question) for g, question in zip(guide_nos, questions)]
+        pending = [pos for pos, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+
+        query_texts = [f"Guide {guide_nos[pos]} {questions[pos]}" for pos in pending]
+        with tracer.span("guide_batch.embed", size=len(pending)):
+            embeddings = dict(zip(pending, self.ef(query_texts)))
+
+        groups: Dict[Tuple[str, str], Tuple[Dict[str, Any], int, List[int]]] = {}
+        with tracer.span("guide_batch.filter", size=len(pending)):
+            for pos in pending:
+                where, n_results = self._guide_query(guide_nos[pos], questions[pos])
+                key = (self._partition(questions[pos]), json.dumps(where, sort_keys=True))
+                groups.setdefault(key, (where, n_results, []))[2].append(pos)
+
+        for (partition, _), (where, n_results, positions) in groups.items():
+            with tracer.span("guide_batch.query", size=len(positions)):
+                group_results = self.partitions[partition].query(
+                    query_embeddings=[embeddings[pos] for pos in positions],
+                    n_results=n_results,
+                    where=where
+                )
+            with tracer.span("guide_batch.refine", size=len(positions)):
+                for pos, metas, docs in zip(positions, group_results['metadatas'], group_results['documents']):
+                    results[pos] = self._collect_sections(guide_nos[pos], questions[pos], metas, docs)
+
+        return [
+            result or GuideResult(guide_no=g, question=q, sections=[], text=None)
+            for result, g, q in zip(results, guide_nos, questions)
+        ]
+
+    def answer_question(self, user_question: str) -> Answer:
+        """
+        整合式查詢：識別物質 -> 綠色表格距離 -> 查詢對應指南。
+        未識別出物質時 material/hazard/guide 為 None。整個結果存入回應快取 (資料庫重建後自動失效)。
+        """
+        return self.response_cache.get_or_compute("answer", (user_question,),
+                                                  lambda: self._answer_question(user_question),
+                                                  decode=Answer.from_dict)
+
+    def _answer_question(self, user_question: str) -> Answer:
+        material = self.find_material(user_question, extract_mentions=True)
+        hazard = guide = None
+        if material:
+            hazard = self.hazard_info(material.un_id)
+            guide = self.find_guide(material.guide_no, user_question)
+        return Answer(question=user_question, material=material, hazard=hazard, guide=guide)
+
+    def answer_incident(self, user_question: str) -> IncidentAnswer:
+        """
+        多物質事故查詢 (例如「氯氣與氨氣同時外洩」)：找出問題中提到的所有物質並同時解析，
+        各物質的指南去重後平行檢索，TIH / 遇水反應 / 聚合危害合併為一份結果。整個結果存入回應快取。
+        """
+        return self.response_cache.get_or_compute("incident", (user_question,),
+                                                  lambda: self._answer_incident(user_question),
+                                                  decode=IncidentAnswer.from_dict)
+
+    def _incident_mentions(self, user_question: str) -> List[Tuple[str, Optional[Tuple[Dict[str, Any], str, str]]]]:
+        """
+        依出現順序列出問題中的物質：[(查詢文字, 索引命中結果或 None)]；None 表示需語意搜尋。
+        UN 編號與物質名稱由記憶體索引找出；以連接詞 (與、和、及、、...) 分開且未提到任何已知名稱的片段改用語意搜尋。
+        問題中完全沒有 UN 編號或已知名稱時，整句作為一個語意查詢 (與 answer_question 相同)。
+        """
+        key = normalize_name(user_question)
+        found: List[Tuple[int, int, str, Optional[Tuple[Dict[str, Any], str, str]]]] = []
+
+        if "guide" not in key and "指南" not in key:
+            for match in UN_ID_PATTERN.finditer(key):
+                metas = self.material_index.lookup_un_id(match.group(1))
+                # UN IDs missing from the index go to the Chroma un_id filter (search_materials_batch)
+                found.append((match.start(), match.end(), match.group(0),
+                              (metas[0], "UN ID 精確匹配", "un_id") if metas else None))
+        for meta, start, end in self.find_mentions(user_question):
+            if not any(start < s_end and s_start < end for s_start, s_end, _, _ in found):
+                found.append((start, end, key[start:end],
+                              (meta, f"問句名稱擷取 ('{meta['name']}')", "mention")))
+        if not found:
+            return [(user_question, None)]
+
+        # Segments between conjunctions (outside matched names, which may contain "與" themselves)
+        cuts = [m for m in INCIDENT_SEPARATOR_PATTERN.finditer(key)
+                if not any(m.start() < s_end and s_start < m.end() for s_start, s_end, _, _ in found)]
+        bounds = [0] + [pos for m in cuts for pos in (m.start(), m.end())] + [len(key)]
+        for start, end in zip(bounds[::2], bounds[1::2]):
+            segment = key[start:end].strip()
+            if any(ch.isalpha() for ch in segment) and not any(start < s_end and s_start < end for s_start, s_end, _, _ in found):
+                found.append((start, end, segment, None))
+
+        found.sort(key=lambda item: item[0])
+        return [(text, hit) for _, _, text, hit in found]
+
+    def _answer_incident(self, user_question: str) -> IncidentAnswer:
+        start_time = time.perf_counter()
+        timings: Dict[str, float] = {}
+        with tracer.span("incident.filter", timings):
+            mentions = self._incident_mentions(user_question)
+        semantic_queries = [text for text, hit in mentions if hit is None]
+
+        with ThreadPoolExecutor(max_workers=INCIDENT_WORKERS, thread_name_prefix="erg-incident") as pool:
+            guide_futures: Dict[str, "Future[Optional[GuideResult]]"] = {}
+
+            def fetch_guide(guide_no: str):
+                # Materials sharing a guide (e.g. 124 for chlorine and fluorine) retrieve it once
+                if guide_no.rstrip('P') not in guide_futures:
+                    guide_futures[guide_no.rstrip('P')] = pool.submit(self.find_guide, guide_no, user_question)
+
+            # Semantic lookups start first; guides of index hits are retrieved while they run
+            semantic = pool.submit(self.search_materials_batch, semantic_queries) if semantic_queries else None
+            elapsed = time.perf_counter() - start_time
+            timings_ms = {stage: round(ms, 3) for stage, ms in timings.items()}
+            hits: List[Optional[MaterialHit]] = [
+                MaterialHit.from_meta(text, hit[0], hit[1], elapsed, timings_ms, tier="index",
+                                      confidence=self.calibration.confidence(hit[2])) if hit else None
+                for text, hit in mentions
+            ]
+            for hit in hits:
+                if hit:
+                    fetch_guide(hit.guide_no)
+
+            if semantic is not None:
+                semantic_hits = iter(semantic.result())
+                hits = [hit if index_hit else next(semantic_hits) for hit, (_, index_hit) in zip(hits, mentions)]
+
+            materials: List[MaterialHit] = []
+            for hit in hits:
+                if hit and all(hit.un_id != known.un_id for known in materials):
+                    materials.append(hit)
+                    fetch_guide(hit.guide_no)
+            tracer.count("incident.materials", len(materials))
+
+            guides = []
+            for guide_no in dict.fromkeys(hit.guide_no.rstrip('P') for hit in materials):
+                guides.append(guide_futures[guide_no].result()
+                              or GuideResult(guide_no=guide_no, question=user_question, sections=[], text=None))
+
+        hazards = [self.hazard_info(hit.un_id) for hit in materials]
+        flags = HazardFlags(any(hit.flags.is_tih for hit in materials),
+                            any(hit.flags.is_water_reactive for hit in materials),
+                            any(hit.flags.is_polymerization for hit in materials))
+        gases = list(dict.fromkeys(gas for hazard in hazards if hazard for gas in hazard.water_reactive_gases))
+        return IncidentAnswer(question=user_question, materials=materials, hazards=hazards, guides=guides,
+                              flags=flags, water_reactive_gases=gases)
@@ -0,0 +1,179 @@
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional
+
+from material_index import material_names
+
+# Result objects returned by rag_engine.ERGEngine. They carry no formatting; demo_rag_cn.py renders them
+# for the console and serve_rag_cn.py serializes them with to_dict(). from_dict() restores them from
+# JSON (e.g. the shared response cache).
+
+
+@dataclass(slots=True)
+class HazardFlags:
+    is_tih: bool = False
+    is_water_reactive: bool = False
+    is_polymerization: bool = False
+
+    @classmethod
+    def from_meta(cls, meta: Dict[str, Any]) -> "HazardFlags":
+        return cls(bool(meta.get("is_tih", False)), bool(meta.get("is_water_reactive", False)),
+                   bool(meta.get("is_polymerization", False)))
+
+    @property
+    def has_hazard(self) -> bool:
+        return self.is_tih or self.is_water_reactive or self.is_polymerization
+
+
+@dataclass(slots=True)
+class MaterialHit:
+    """
+    識別出的物質。elapsed (秒) 與 timings_ms (各階段毫秒) 為查詢耗時；candidates 為依排名排序的候選物質 Metadata；
+    aliases 為同一 UN 編號與指南的其他列名。tier 為回答的層級 ("index"、"un_filter" 或語意搜尋的候選數 "semantic@5" ...)，
+    confidence 為校正後的正確機率 (0-1)。
+    """
+    query: str
+    un_id: str
+    name: str
+    guide_no: str
+    match_method: str
+    flags: HazardFlags
+    elapsed: float = 0.0
+    timings_ms: Dict[str, float] = field(default_factory=dict)
+    candidates: Optional[List[Dict[str, Any]]] = None
+    aliases: List[str] = field(default_factory=list)
+    tier: str = ""
+    confidence: Optional[float] = None
+
+    @classmethod
+    def from_meta(cls, query: str, meta: Dict[str, Any], match_method: str, elapsed: float = 0.0,
+                  timings_ms: Optional[Dict[str, float]] = None, candidates: Optional[List[Dict[str, Any]]] = None,
+                  tier: str = "", confidence: Optional[float] = None) -> "MaterialHit":
+        return cls(query, str(meta["un_id"]), meta["name"], str(meta["guide_no"]), match_method,
+                   HazardFlags.from_meta(meta), elapsed, dict(timings_ms or {}), candidates, material_names(meta)[1:],
+                   tier, confidence)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "MaterialHit":
+        return cls(**{**data, "flags": HazardFlags(**data["flags"])})
+
+
+@dataclass(slots=True)
+class SpillDistance:
+    """Green Table 1 distances for one spill size; None = not listed."""
+    iso_m: Optional[float] = None
+    iso_ft: Optional[float] = None
+    day_km: Optional[float] = None
+    day_mi: Optional[float] = None
+    night_km: Optional[float] = None
+    night_mi: Optional[float] = None
+
+
+@dataclass(slots=True)
+class Table3Row:
+    """Green Table 3 row: one container type, protective distances (km) per wind class."""
+    container: str
+    initial_isolation_m: Optional[float]
+    day_km: Dict[str, Optional[float]]
+    night_km: Dict[str, Optional[float]]
+
+
+@dataclass(slots=True)
+class DistanceInfo:
+    """綠色表格的數值資料：小量/大量洩漏的隔離與防護距離、表3 容器資料、遇水產生的氣體。"""
+    un_id: str
+    small_spill: Optional[SpillDistance]
+    large_spill: Optional[SpillDistance]
+    large_spill_see_table3: bool
+    water_reactive_gases: List[str]
+    table3: List[Table3Row]
+
+    @classmethod
+    def from_lookup(cls, data: Optional[Dict[str, Any]]) -> Optional["DistanceInfo"]:
+        """From HazardTable.lookup() (or a to_dict() result); None stays None."""
+        if data is None:
+            return None
+        spill = lambda value: SpillDistance(**value) if value else None
+        return cls(data["un_id"], spill(data["small_spill"]), spill(data["large_spill"]),
+                   bool(data["large_spill_see_table3"]), list(data["water_reactive_gases"]),
+                   [Table3Row(**row) for row in data["table3"]])
+
+    from_dict = from_lookup
+
+
+@dataclass(slots=True)
+class GuideSection:
+    section: str
+    text: str
+
+
+@dataclass(slots=True)
+class GuideResult:
+    """指南檢索結果：依顯示順序排列的相關章節；text 為各章節合併後的全文 (找不到內容時為 None)。"""
+    guide_no: str
+    question: str
+    sections: List[GuideSection]
+    text: Optional[str]
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "GuideResult":
+        return cls(data["guide_no"], data["question"], [GuideSection(**s) for s in data["sections"]], data["text"])
+
+
+@dataclass(slots=True)
+class Answer:
+    """整合式查詢結果；未識別出物質時 material/hazard/guide 為 None。"""
+    question: str
+    material: Optional[MaterialHit]
+    hazard: Optional[DistanceInfo]
+    guide: Optional[GuideResult]
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Answer":
+        optional = lambda value, parse: parse(value) if value is not None else None
+        return cls(data["question"], optional(data["material"], MaterialHit.from_dict),
+                   optional(data["hazard"], DistanceInfo.from_dict), optional(data["guide"], GuideResult.from_dict))
+
+
+def to_dict(result: Any) -> Any:
+    """JSON-ready form of a result object (or a list of them); None stays None."""
+    if isinstance(result, list):
+        return [to_dict(item) for item in result]
+    return asdict(result) if result is not None else None
+
+
+@dataclass(slots=True)
+class IncidentAnswer:
+    """
+    多物質事故查詢結果：materials 為問題中提到的所有物質 (依出現順序、依 UN 編號去重)，hazards 與之一一對應；
+    guides 為去重後的各指南 (同一指南只檢索一次)；flags 與 water_reactive_gases 為所有物質合併後的危害。
+    """
+    question: str
+    materials: List[MaterialHit]
+    hazards: List[Optional[DistanceInfo]]
+    guides: List[GuideResult]
+    flags: HazardFlags
+    water_reactive_gases: List[str]
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "IncidentAnswer":
+        return cls(data["question"], [MaterialHit.from_dict(m) for m in data["materials"]],
+                   [DistanceInfo.from_dict(h) for h in data["hazards"]],
+                   [GuideResult.from_dict(g) for g in data["guides"]], HazardFlags(**data["flags"]),
+                   list(data["water_reactive_gases"]))
+
+
+@dataclass(slots=True)
+class ResponseCard:
+    """
+    回應卡：建置時為每個 UN 編號預先整理的完整結果 (此編號下的物質、綠色表格數值、各指南全文)，
+    查詢時只需鍵值讀取，不經過 embedding 或向量查詢。
+    """
+    un_id: str
+    materials: List[MaterialHit]
+    hazard: Optional[DistanceInfo]
+    guides: List[GuideResult]
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ResponseCard":
+        return cls(data["un_id"], [MaterialHit.from_dict(m) for m in data["materials"]],
+                   DistanceInfo.from_dict(data["hazard"]), [GuideResult.from_dict(g) for g in data["guides"]])
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, is_dataclass
+from typing import Dict, Any, Optional, Callable, Sequence, Tuple
+
+from instrumentation import tracer
+
+# Written by build_rag_db_cn.py at the end of every build; cached answers are only valid for one version
+DB_VERSION_FILENAME = "db_version.json"
+
+# Share answers between worker processes, e.g. ERG_RAG_RESPONSE_CACHE=erg_chroma_db_cn/response_cache.sqlite
+RESPONSE_CACHE_ENV_VAR = "ERG_RAG_RESPONSE_CACHE"
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_SHARED_MAX_ENTRIES = 16384
+# Answers only change on rebuild; the TTL just bounds how long a rarely repeated question is kept
+DEFAULT_TTL_SEC = 24 * 3600
+# Shared store housekeeping (expired / old-version / least recently used rows) runs every N writes
+SHARED_PRUNE_INTERVAL = 64
+SQLITE_TIMEOUT_SEC = 5.0
+
+_MISS = object()
+
+
+def normalize_question(text: str) -> str:
+    # Same folding as embedding_cache.normalize_text (which pulls in chromadb): width/whitespace, case is kept
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def _encode(value: Any) -> Any:
+    # Result objects (rag_results dataclasses) are stored as plain JSON
+    if is_dataclass(value) and not isinstance(value, type):
+        return asdict(value)
+    raise TypeError(f"cannot cache a {type(value).__name__}")
+
+
+def write_db_version(db_dir: str, **info) -> str:
+    """Stamp the database with a new version id (atomic replace, so readers never see a partial file)."""
+    version = uuid.uuid4().hex
+    path = os.path.join(db_dir, DB_VERSION_FILENAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": version, "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **info}, f)
+    os.replace(path + ".tmp", path)
+    return version
+
+
+def read_db_version(db_dir: str) -> Dict[str, Any]:
+    """Everything write_db_version stamped (version, build time, embedding backend, ...); {} without a stamp."""
+    try:
+        with open(os.path.join(db_dir, DB_VERSION_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def clear_db_version(db_dir: str):
+    """Called before a build modifies the database: no version means nothing is cached meanwhile."""
+    path = os.path.join(db_dir, DB_VERSION_FILENAME)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class DBVersion:
+    """Current version stamp of a database directory; re-read only when the stamp file changes (one stat per check)."""
+
+    def __init__(self, db_dir: str):
+        self.path = os.path.join(db_dir, DB_VERSION_FILENAME)
+        self._stat: Optional[Tuple[int, int, int]] = None
+        self._version: Optional[str] = None
+
+    def current(self) -> Optional[str]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self._stat = self._version = None
+            return None
+        stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stat != self._stat:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._version = json.load(f).get("version")
+            except (OSError, ValueError):
+                self._version = None # Replaced while reading: checked again on the next call
+                return None
+            self._stat = stat
+        return self._version
+
+
+class SQLiteResponseStore:
+    """
+    Shared tier: one SQLite file (WAL mode) that several worker processes read and write.
+    Rows carry their DB version, creation time (TTL) and last access time (LRU pruning).
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_SHARED_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection must not cross a fork: reopen in each worker process
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT_SEC, check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, version TEXT NOT NULL, "
+                         "created REAL NOT NULL, accessed REAL NOT NULL, value TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key: str, min_created: float) -> Any:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM responses WHERE key = ? AND created >= ?",
+                               (key, min_created)).fetchone()
+            if row is None:
+                return _MISS
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, version: str, value: Any, min_created: float):
+        text = json.dumps(value, ensure_ascii=False, default=_encode)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO responses (key, version, created, accessed, value) "
+                         "VALUES (?, ?, ?, ?, ?)", (key, version, now, now, text))
+            self._writes += 1
+            if self._writes % SHARED_PRUNE_INTERVAL == 0:
+                self._prune(conn, version, min_created)
+
+    def prune(self, version: str, min_created: float):
+        with self._lock:
+            self._prune(self._connection(), version, min_created)
+
+    def _prune(self, conn: sqlite3.Connection, version: str, min_created: float):
+        conn.execute("DELETE FROM responses WHERE version != ? OR created < ?", (version, min_created))
+        excess = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute("DELETE FROM responses WHERE key IN "
+                         "(SELECT key FROM responses ORDER BY accessed LIMIT ?)", (excess,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """
+    回應快取：以「DB 版本 + 查詢類型 + 正規化參數」為鍵，快取完整的查詢結果 (例如整合式查詢、指南檢索)。
+    記憶體層為 TTL + LRU；可選擇搭配 SQLite 共用層，讓多個服務行程共用彼此的結果。
+    version 為呼叫者載入資料時的版本戳記 (DBVersion.current())，結果一律以此版本為鍵：資料庫重建後，
+    仍使用舊資料的行程只用自己的記憶體層，不讀寫共用層 (其他行程已使用新版本)；沒有版本時不使用快取。
+    快取的結果由多個呼叫者共用，請勿修改回傳的物件。
+    """
+
+    def __init__(self, db_dir: str, version: Optional[str], max_entries: int = DEFAULT_MAX_ENTRIES,
+                 ttl_sec: float = DEFAULT_TTL_SEC, shared_path: Optional[str] = None,
+                 shared_max_entries: int = DEFAULT_SHARED_MAX_ENTRIES):
+        self.db_version = DBVersion(db_dir)
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._shared_pruned = False
+        self._shared = SQLiteResponseStore(shared_path, shared_max_entries) if shared_path else None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stale = 0
+
+    @staticmethod
+    def _key(version: str, kind: str, args: Sequence[Any]) -> str:
+        normalized = [normalize_question(a) if isinstance(a, str) else a for a in args]
+        text = json.dumps([version, kind, normalized], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def get_or_compute(self, kind: str, args: Sequence[Any], compute: Callable[[], Any],
+                       decode: Optional[Callable[[Any], Any]] = None) -> Any:
+        """
+        Return the cached result of `compute()` for (kind, args) under the pinned DB version, computing it on a miss.
+        `decode` rebuilds a result object from its JSON form on a shared-tier hit (None results are never decoded).
+        """
+        version = self.version
+        if version is None:
+            self.bypassed += 1
+            tracer.count("response_cache.bypass")
+            return compute()
+
+        key = self._key(version, kind, args)
+        min_created = time.time() - self.ttl_sec
+        shared = self._shared
+        if shared is not None and self.db_version.current() != version:
+            # Database rebuilt (or being rebuilt) since our data was loaded: the shared tier belongs to the
+            # processes using the new data, and pruning it under our version would delete their answers
+            shared = None
+            self.stale += 1
+            tracer.count("response_cache.stale", kind=kind)
+        with self._lock:
+            if shared is not None and not self._shared_pruned:
+                # Rows of older builds are dead once, on first use
+                shared.prune(version, min_created)
+                self._shared_pruned = True
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] >= min_created:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                tracer.count("response_cache.hit", kind=kind)
+                return entry[1]
+
+        value = shared.get(key, min_created) if shared is not None else _MISS
+        if value is not _MISS:
+            shared_hit = True
+            if decode is not None and value is not None:
+                value = decode(value)
+            tracer.count("response_cache.shared_hit", kind=kind)
+        else:
+            shared_hit = False
+            tracer.count("response_cache.miss", kind=kind)
+            value = compute()
+            if shared is not None:
+                shared.put(key, version, value, min_created)
+
+        with self._lock:
+            if shared_hit:
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+            self._memory[key] = (time.time(), value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def cache_info(self) -> Dict[str, Any]:
+        total = self.hits + self.shared_hits + self.misses
+        return {
+            "version": self.version,
+            "on_disk_version": self.db_version.current(),
+            "stale": self.stale,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": (self.hits + self.shared_hits) / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "shared_entries": len(self._shared) if self._shared is not None else 0,
+        }
@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional, Callable, Tuple
+
+# Written by build_rag_db_cn.py next to the Chroma DB
+RESPONSE_CARDS_FILENAME = "response_cards.sqlite"
+
+SQLITE_TIMEOUT_SEC = 5.0
+
+
+class ResponseCardWriter:
+    """
+    Builds the response card file as records stream past: one card per UN ID (the materials listed under it,
+    their green-table data and guide numbers) and the sections of every guide, per language partition.
+    Cards are written as soon as the next UN ID starts (the index is sorted by UN ID), so nothing accumulates;
+    the file is built under a temporary name and replaced atomically on close(), a failed build keeps the old one.
+    """
+
+    def __init__(self, path: str, hazard_lookup: Callable[[str], Optional[Dict[str, Any]]]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.hazard_lookup = hazard_lookup
+        self.cards = 0
+        self.guides = 0
+        if os.path.exists(path + ".tmp"):
+            os.remove(path + ".tmp")
+        self._conn = sqlite3.connect(path + ".tmp", isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=OFF")
+        self._conn.execute("BEGIN")
+        self._conn.execute("CREATE TABLE cards (un_id TEXT PRIMARY KEY, card TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE guides (lang TEXT NOT NULL, guide_no TEXT NOT NULL, sections TEXT NOT NULL, "
+                           "PRIMARY KEY (lang, guide_no))")
+        self._materials: List[Dict[str, Any]] = []
+        self._guide: Optional[Tuple[str, str]] = None
+        self._sections: List[Tuple[str, str]] = []
+
+    def add_material(self, meta: Dict[str, Any]):
+        if self._materials and self._materials[0]["un_id"] != meta["un_id"]:
+            self._flush_card()
+        self._materials.append({key: value for key, value in meta.items() if key != "content_hash"})
+
+    def add_guide_section(self, lang: str, guide_no: str, section: str, text: str):
+        if self._guide != (lang, guide_no):
+            self._flush_guide()
+            self._guide = (lang, guide_no)
+        self._sections.append((section, text))
+
+    def _flush_card(self):
+        if not self._materials:
+            return
+        un_id = str(self._materials[0]["un_id"])
+        row = self._conn.execute("SELECT card FROM cards WHERE un_id = ?", (un_id,)).fetchone()
+        # A UN ID listed again further down the index joins its earlier card
+        materials = (json.loads(row[0])["materials"] if row else []) + self._materials
+        card = {
+            "un_id": un_id,
+            "materials": materials,
+            "hazard": self.hazard_lookup(un_id),
+            "guide_nos": list(dict.fromkeys(str(meta["guide_no"]).rstrip("P") for meta in materials)),
+        }
+        self._conn.execute("INSERT OR REPLACE INTO cards (un_id, card) VALUES (?, ?)",
+                           (un_id, json.dumps(card, ensure_ascii=False)))
+        self.cards += row is None
+        self._materials = []
+
+    def _flush_guide(self):
+        if not self._sections:
+            return
+        lang, guide_no = self._guide
+        row = self._conn.execute("SELECT sections FROM guides WHERE lang = ? AND guide_no = ?",
+                                 (lang, guide_no)).fetchone()
+        sections = (json.loads(row[0]) if row else []) + self._sections
+        self._conn.execute("INSERT OR REPLACE INTO guides (lang, guide_no, sections) VALUES (?, ?, ?)",
+                           (lang, guide_no, json.dumps(sections, ensure_ascii=False)))
+        self.guides += row is None
+        self._sections = []
+
+    def close(self):
+        self._flush_card()
+        self._flush_guide()
+        self._conn.execute("COMMIT")
+        self._conn.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def discard(self):
+        self._conn.close()
+        os.remove(self.path + ".tmp")
+
+
+class ResponseCardStore:
+    """Read side of the response card file: keyed reads over a read-only connection, reopened in each process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._languages: Optional[List[str]] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # A connection must not cross a fork: reopen in each worker process
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=SQLITE_TIMEOUT_SEC,
+                                         check_same_thread=False)
+            self._pid = os.getpid()
+        return self._conn
+
+    def card(self, un_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection().execute("SELECT card FROM cards WHERE un_id = ?", (str(un_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def guide(self, guide_no: str, lang: str) -> Optional[List[Tuple[str, str]]]:
+        """(section, text) pairs of a guide in the given partition's language, in guide order; None if not stored."""
+        with self._lock:
+            row = self._connection().execute("SELECT sections FROM guides WHERE lang = ? AND guide_no = ?",
+                                             (lang, str(guide_no))).fetchone()
+        return [tuple(section) for section in json.loads(row[0])] if row else None
+
+    @property
+    def languages(self) -> List[str]:
+        if self._languages is None:
+            with self._lock:
+                self._languages = [lang for lang, in self._connection().execute("SELECT DISTINCT lang FROM guides")]
+        return self._languages
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM cards").fetchone()[0]
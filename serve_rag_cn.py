@@ -0,0 +1,388 @@
+"""
+ERG RAG 常駐查詢服務 (asyncio HTTP/JSON)
+
+模型與 ChromaDB 集合只在啟動時載入一次，之後的查詢直接重用，避免每次執行 demo_rag_cn.py 的冷啟動成本。
+Embedding 與向量查詢在工作執行緒池中執行，事件迴圈在突發流量下仍可持續接收連線。
+--workers N 時改為 pre-fork 多工作行程：主行程載入 embedding 模型權重與各查詢索引後 fork 出 N 個工作行程
+(以 copy-on-write 共用這些記憶體，不必各自載入模型)，由主行程接受連線並交給目前連線數最少的工作行程，
+embedding 與篩選排序因此可使用所有 CPU 核心。各工作行程自行開啟 ChromaDB (其 client 不能跨 fork 使用)。
+
+啟動:
+    python3 serve_rag_cn.py --port 8765
+    python3 serve_rag_cn.py --unix /tmp/erg_rag.sock
+    python3 serve_rag_cn.py --response-cache erg_chroma_db_cn/response_cache.sqlite   # 多個服務行程共用回應快取
+    python3 serve_rag_cn.py --vector-store hnsw --hnsw-ef 128   # 使用建置時匯出的向量索引
+    python3 serve_rag_cn.py --workers 4 --response-cache erg_chroma_db_cn/response_cache.sqlite   # 4 個工作行程
+
+查詢:
+    curl -s localhost:8765/search_material -d '{"query": "UN 1017"}'
+    curl -s localhost:8765/consult_guide -d '{"guide_no": "124", "question": "吸入時的急救措施為何？"}'
+    curl -s localhost:8765/unified_query -d '{"question": "附近發生氯氣大量外洩，我該怎麼辦？"}'
+    curl -s localhost:8765/unified_query -d '{"question": "氯氣與氨氣同時外洩", "incident": true}'   # 多物質事故模式
+    curl -s localhost:8765/card -d '{"un_id": "1017"}'   # 預先整理的回應卡 (物質、綠色表格、指南全文)，不經過 embedding
+    curl -s localhost:8765/protective_distance -d '{"un_id": "1017", "container": "rail", "night": true, "wind_kmh": 15}'
+    curl -s localhost:8765/protective_distance -d '{"scenarios": [{"un_id": "1005"}, {"un_id": "1017", "wind_kmh": 30}]}'
+
+監控:
+    curl -s localhost:8765/stats      # 各階段耗時百分位數與計數器 (JSON)
+    curl -s localhost:8765/metrics    # Prometheus 文字格式
+    curl -s localhost:8765/workers    # 各工作行程的狀態、連線數、延遲百分位數與記憶體 (RSS / PSS)，僅 --workers 模式
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import numpy as np
+
+from rag_engine import ERGEngine
+from rag_results import to_dict
+from vector_store import VECTOR_STORES
+from prefork import PreforkDispatcher, WorkerSlot, serve_channel
+from instrumentation import tracer, configure_from_env, HistogramExporter, PrometheusExporter
+
+MAX_BODY_BYTES = 1 << 20
+DEFAULT_THREADS = min(8, (os.cpu_count() or 1) + 2)
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class RAGServer:
+    def __init__(self, rag: ERGEngine, threads: int = DEFAULT_THREADS, worker: Optional[WorkerSlot] = None):
+        self.rag = rag
+        # Set in pre-fork mode: this process's row in the stats shared by all workers
+        self.worker = worker
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="erg-rag")
+        self.started_at = time.time()
+        self.request_count = 0
+        # /stats and /metrics always have data, whatever ERG_RAG_TRACE adds on top
+        self.histogram = tracer.find_exporter(HistogramExporter) or tracer.add_exporter(HistogramExporter())
+        self.prometheus = tracer.find_exporter(PrometheusExporter) or tracer.add_exporter(PrometheusExporter())
+        self.routes = {
+            "/search_material": self._search_material,
+            "/consult_guide": self._consult_guide,
+            "/unified_query": self._unified_query,
+            "/protective_distance": self._protective_distance,
+            "/card": self._card,
+        }
+
+    async def _run(self, func, *args):
+        # Embedding + Chroma queries block, so they go to the worker thread pool
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _search_material(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        query = _require(body, "query")
+        hit = await self._run(self.rag.find_material, query)
+        hazard = self.rag.hazard_info(hit.un_id) if hit else None
+        return {"result": to_dict(hit), "hazard": to_dict(hazard)}
+
+    async def _consult_guide(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        guide_no = str(_require(body, "guide_no"))
+        question = _require(body, "question")
+        return {"result": to_dict(await self._run(self.rag.find_guide, guide_no, question))}
+
+    async def _unified_query(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        question = _require(body, "question")
+        answer = self.rag.answer_incident if body.get("incident") else self.rag.answer_question
+        return {"result": to_dict(await self._run(answer, question))}
+
+    async def _card(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        if self.rag.response_cards is None:
+            raise RequestError(404, "response cards not built, rebuild the database")
+        # Key reads from SQLite, no embedding; still file I/O, so off the event loop
+        card = await self._run(self.rag.response_card, str(_require(body, "un_id")))
+        if card is None:
+            raise RequestError(404, f"UN ID '{body['un_id']}' not found")
+        return {"result": to_dict(card)}
+
+    async def _protective_distance(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        # Pure array lookups (no embedding), cheap enough to run on the event loop
+        engine = self.rag.distance_engine
+        if engine is None:
+            raise RequestError(404, "hazard table not loaded, rebuild the database")
+        scenarios = body.get("scenarios")
+        if scenarios is None:
+            return {"result": _evaluate_scenarios(engine, [body])[0]}
+        if not isinstance(scenarios, list) or not all(isinstance(item, dict) for item in scenarios):
+            raise RequestError(400, "scenarios must be a list of objects")
+        return {"results": _evaluate_scenarios(engine, scenarios)}
+
+    def _health(self) -> Dict[str, Any]:
+        health = {
+            "status": "ok",
+            "uptime_sec": round(time.time() - self.started_at, 1),
+            "requests": self.request_count,
+            "semantic_loaded": self.rag.semantic_loaded,
+            "response_cache": self.rag.response_cache.cache_info(),
+            "response_cards": len(self.rag.response_cards) if self.rag.response_cards is not None else None,
+        }
+        # Runs on the event loop: never wait here for the background warmup
+        if self.rag.semantic_loaded:
+            health["documents"] = self.rag.collection.count()
+            health["partitions"] = {lang: collection.count() for lang, collection in self.rag.partitions.items()}
+            health["vector_store"] = {lang: store.kind for lang, store in self.rag.partitions.items()}
+            health["embedding_cache"] = self.rag.ef.cache_info()
+        if self.worker is not None:
+            health["worker"] = self.worker.index
+            health["pid"] = os.getpid()
+            health["workers"] = self.worker.stats.workers
+            health["workers_alive"] = self.worker.stats.alive()
+        return health
+
+    def _workers(self) -> Dict[str, Any]:
+        if self.worker is None:
+            raise RequestError(404, "not running with --workers")
+        return {"served_by": self.worker.index, "workers": self.worker.stats.snapshot()}
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Union[Dict[str, Any], str]]:
+        self.request_count += 1
+        try:
+            if path == "/health":
+                return 200, self._health()
+            if path == "/stats":
+                return 200, self.histogram.summary()
+            if path == "/metrics":
+                return 200, self.prometheus.render()
+            if path == "/workers":
+                return 200, self._workers()
+
+            handler = self.routes.get(path)
+            if handler is None:
+                raise RequestError(404, f"unknown endpoint: {path}")
+            if method != "POST":
+                raise RequestError(405, "use POST with a JSON body")
+            try:
+                payload = json.loads(body.decode("utf-8") or "{}")
+            except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                raise RequestError(400, f"invalid JSON body: {e}")
+            if not isinstance(payload, dict):
+                raise RequestError(400, "JSON body must be an object")
+
+            timings: Dict[str, float] = {}
+            endpoint = path.strip("/")
+            with tracer.span(f"request.{endpoint}", timings):
+                response = await handler(payload)
+            response["elapsed_ms"] = round(timings[endpoint], 3)
+            return 200, response
+        except RequestError as e:
+            tracer.count(f"request.error_{e.status}")
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            tracer.count("request.error_500")
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except RequestError as e:
+                    _write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                method, path, keep_alive, body = request
+                if self.worker is not None:
+                    self.worker.request_started()
+                start = time.perf_counter()
+                status, payload = await self.dispatch(method, path, body)
+                if self.worker is not None:
+                    self.worker.request_finished((time.perf_counter() - start) * 1000, status >= 500)
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _require(body: Dict[str, Any], key: str) -> Any:
+    value = body.get(key)
+    if value is None or value == "":
+        raise RequestError(400, f"missing field: {key}")
+    return value
+
+
+def _flag(body: Dict[str, Any], key: str, default: bool) -> bool:
+    # Only JSON true / false: bool("false") is True and would silently select the other table
+    value = body.get(key, default)
+    if not isinstance(value, bool):
+        raise RequestError(400, f"{key} must be true or false")
+    return value
+
+
+def _evaluate_scenarios(engine, scenarios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Evaluate all scenarios of a request in one vectorized engine call."""
+    un_ids = [str(_require(item, "un_id")) for item in scenarios]
+    large_spill = [_flag(item, "large_spill", True) for item in scenarios]
+    night = [_flag(item, "night", False) for item in scenarios]
+    try:
+        wind = [np.nan if item.get("wind_kmh") is None else float(item["wind_kmh"]) for item in scenarios]
+    except (TypeError, ValueError) as e:
+        raise RequestError(400, f"invalid wind_kmh: {e}")
+    with tracer.span("distance.evaluate", scenarios=len(scenarios)):
+        result = engine.evaluate(
+            un_ids,
+            large_spill=large_spill,
+            container=[engine.resolve_container(item.get("container")) for item in scenarios],
+            night=night,
+            wind_kmh=wind,
+        )
+    records = engine.to_records(result)
+    for un_id, record in zip(un_ids, records):
+        record["un_id"] = un_id
+    return records
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, bool, bytes]]:
+    request_line = await reader.readline()
+    if not request_line:
+        return None # Client closed a keep-alive connection
+
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise RequestError(400, "malformed request line")
+    method, target, version = parts
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    value = headers.get("content-length", "0") or "0"
+    # int() alone would also take "-5", "+5" and "1_0"
+    if not (value.isascii() and value.isdigit()):
+        raise RequestError(400, f"invalid Content-Length: {value!r}")
+    length = int(value)
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, "request body too large")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        return None # Client closed the connection before sending the whole body
+
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+    return method.upper(), target.split("?", 1)[0], keep_alive, body
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload: Union[Dict[str, Any], str], keep_alive: bool):
+    if isinstance(payload, str):
+        # Prometheus text exposition format
+        body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+    head = (
+        f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'OK')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode("latin-1") + body)
+
+
+async def serve(host: str, port: int, unix_path: Optional[str], threads: int, backend: Optional[str] = None,
+                response_cache: Optional[str] = None, vector_store: Optional[str] = None, hnsw_ef: Optional[int] = None,
+                embedding_threads: Optional[int] = None):
+    configure_from_env()
+    rag = ERGEngine(warmup=True, embedding_backend=backend, response_cache_path=response_cache,
+                    vector_store=vector_store, hnsw_ef=hnsw_ef, embedding_threads=embedding_threads)
+    server = RAGServer(rag, threads=threads)
+
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        listener = await asyncio.start_unix_server(server.handle_connection, path=unix_path)
+        print(f"ERG RAG 服務已啟動: unix:{unix_path} ({threads} 個工作執行緒)")
+    else:
+        listener = await asyncio.start_server(server.handle_connection, host=host, port=port)
+        print(f"ERG RAG 服務已啟動: http://{host}:{port} ({threads} 個工作執行緒)")
+
+    async with listener:
+        await listener.serve_forever()
+
+
+def serve_prefork(host: str, port: int, unix_path: Optional[str], workers: int, threads: int,
+                  backend: Optional[str] = None, response_cache: Optional[str] = None,
+                  vector_store: Optional[str] = None, hnsw_ef: Optional[int] = None, embedding_threads: int = 1):
+    """主行程預先載入共用的模型與索引後 fork 出工作行程，並負責分派連線與重新啟動結束的工作行程。"""
+    configure_from_env()
+    # Objects allocated while loading stay packed and untouched by the collector (frozen before forking)
+    gc.disable()
+    rag = ERGEngine(embedding_backend=backend, response_cache_path=response_cache, vector_store=vector_store,
+                    hnsw_ef=hnsw_ef, embedding_threads=embedding_threads)
+    rag.preload_shared()
+    embedding_cache_dir = rag.embedding_cache_dir
+
+    def run_worker(slot: WorkerSlot, channel: socket.socket):
+        # The on-disk embedding cache is not safe for concurrent writers: one directory per worker slot
+        if embedding_cache_dir is not None:
+            rag.embedding_cache_dir = os.path.join(embedding_cache_dir, f"worker{slot.index}")
+        rag.warmup()
+        server = RAGServer(rag, threads=threads, worker=slot)
+        asyncio.run(serve_channel(channel, slot, server.handle_connection))
+
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(unix_path)
+        listener.listen(socket.SOMAXCONN)
+        address = f"unix:{unix_path}"
+    else:
+        listener = socket.create_server((host, port), backlog=socket.SOMAXCONN)
+        address = f"http://{host}:{port}"
+    print(f"ERG RAG 服務已啟動: {address} ({workers} 個工作行程，各 {threads} 個工作執行緒、"
+          f"{embedding_threads} 個 embedding 運算執行緒)", flush=True)
+    PreforkDispatcher(listener, workers, run_worker).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ERG RAG 常駐查詢服務 (HTTP/JSON)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", dest="unix_path", help="改用 Unix domain socket 監聽")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="embedding/查詢工作執行緒數量")
+    parser.add_argument("--backend", help="embedding 後端 (torch / onnx / onnx-int8)；預設沿用建置時的後端")
+    parser.add_argument("--response-cache", help="共用回應快取的 SQLite 檔 (多個服務行程共用)；預設僅使用記憶體快取")
+    parser.add_argument("--vector-store", choices=VECTOR_STORES,
+                        help="向量查詢實作 (chroma / flat / hnsw)；預設使用 ERG_RAG_VECTOR_STORE 環境變數，未設定則為 chroma")
+    parser.add_argument("--hnsw-ef", type=int, help="hnsw 的搜尋廣度 ef (越大召回率越高、越慢)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="pre-fork 工作行程數量 (例如 CPU 核心數)；預設 0 為單一行程")
+    parser.add_argument("--embedding-threads", type=int,
+                        help="每個行程的 embedding 運算執行緒數；單一行程預設每個核心一個，--workers 模式預設 1")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        serve_prefork(args.host, args.port, args.unix_path, args.workers, args.threads, args.backend,
+                      args.response_cache, args.vector_store, args.hnsw_ef, args.embedding_threads or 1)
+        return
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix_path, args.threads, args.backend, args.response_cache,
+                          args.vector_store, args.hnsw_ef, args.embedding_threads))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distance_engine import ProtectiveDistanceEngine  # noqa: E402
+from hazard_table import HazardTable  # noqa: E402
+
+# Excerpt of the green tables (values as in Prepared Data_CN): chlorine refers large spills to Table 3,
+# boron trifluoride has Table 1 large-spill distances, dimethyldichlorosilane is water-reactive.
+GT1 = {
+    "1008": {"small_spill": {"isolation_distance": "30 m (100 ft)", "protect_day": "0.2 km (0.1 mi)",
+                             "protect_night": "0.7 km (0.5 mi)"},
+             "large_spill": {"isolation_distance": "400 m (1250 ft)", "protect_day": "2.4 km (1.5 mi)",
+                             "protect_night": "4.7 km (2.9 mi)"}},
+    "1017": {"small_spill": {"isolation_distance": "60 m (200 ft)", "protect_day": "0.3 km (0.2 mi)",
+                             "protect_night": "1.5 km (0.9 mi)"},
+             "large_spill": {"note": "Refer to Table 3 (請參閱表3)"}},
+    "1162": {"small_spill": {"isolation_distance": "30 m (100 ft)", "protect_day": "0.1 km (0.1 mi)",
+                             "protect_night": "0.1 km (0.1 mi)"},
+             "large_spill": {"isolation_distance": "30 m (100 ft)", "protect_day": "0.4 km (0.2 mi)",
+                             "protect_night": "1.2 km (0.8 mi)"}},
+}
+GT2 = {"1162": [{"guide_no": "155", "tih_gases": ["HCl"]}]}
+GT3 = {"chemicals": [{"un_number": "UN1017", "containers": [
+    {"type": "Rail tank car (鐵路槽車)", "initial_isolation_m": 1000,
+     "day_km": {"low_wind": 9.6, "moderate_wind": 6.3, "high_wind": 5.1},
+     "night_km": {"low_wind": 11.0, "moderate_wind": 8.9, "high_wind": 6.5}},
+    {"type": "Highway tank truck or trailer (公路槽車或拖車)", "initial_isolation_m": 600,
+     "day_km": {"low_wind": 5.6, "moderate_wind": 3.3, "high_wind": 2.5},
+     "night_km": {"low_wind": 6.4, "moderate_wind": 4.7, "high_wind": 3.8}},
+    {"type": "Multiple small cylinders or single ton cylinder (多個小型鋼瓶或單個噸級鋼瓶)", "initial_isolation_m": 150,
+     "day_km": {"low_wind": 1.3, "moderate_wind": 0.7, "high_wind": 0.5},
+     "night_km": {"low_wind": 2.4, "moderate_wind": 1.2, "high_wind": 0.6}},
+]}]}
+
+
+@pytest.fixture(scope="session")
+def hazard_table():
+    return HazardTable.build(GT1, GT2, GT3)
+
+
+@pytest.fixture(scope="session")
+def distance_engine(hazard_table):
+    return ProtectiveDistanceEngine(hazard_table)
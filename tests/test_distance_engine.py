@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+import pytest
+
+from distance_engine import ProtectiveDistanceEngine, wind_class
+from hazard_table import HazardTable, parse_distance, format_distance
+
+
+def test_parse_and_format_distance():
+    assert parse_distance("30 m (100 ft)") == (30.0, 100.0)
+    assert parse_distance("0.2 km (0.1 mi)") == (0.2, 0.1)
+    assert all(math.isnan(v) for v in parse_distance("Refer to Table 3"))
+    assert format_distance(0.2, 0.1, "km", "mi") == "0.2 km (0.1 mi)"
+    assert format_distance(float("nan"), None, "m", "ft") == ""
+
+
+@pytest.mark.parametrize("wind, expected", [
+    (0.0, 0), (9.9, 0), (10.0, 1), (15.0, 1), (20.0, 1), (20.1, 2), (60.0, 2), (float("nan"), -1),
+])
+def test_wind_classes(wind, expected):
+    assert wind_class(np.array([wind]))[0] == expected
+
+
+def test_chlorine_rail_night_moderate_wind(distance_engine):
+    record = distance_engine.protective_distance("UN 1017", container="rail", night=True, wind_kmh=15)
+    assert record == {"found": True, "isolation_m": 1000.0, "protective_km": 8.9, "source": "table3",
+                      "container": "Rail tank car (鐵路槽車)", "wind_class": "moderate_wind", "worst_case": False}
+
+
+@pytest.mark.parametrize("container, night, wind, isolation, protective", [
+    ("rail", False, 5, 1000.0, 9.6),
+    ("rail", True, 25, 1000.0, 6.5),
+    ("槽車", False, 10, 600.0, 3.3),
+    ("truck", True, 20, 600.0, 4.7),
+    ("small cylinder", True, 3, 150.0, 2.4),
+])
+def test_table3_selection(distance_engine, container, night, wind, isolation, protective):
+    record = distance_engine.protective_distance("1017", container=container, night=night, wind_kmh=wind)
+    assert (record["isolation_m"], record["protective_km"], record["worst_case"]) == (isolation, protective, False)
+
+
+@pytest.mark.parametrize("container, wind, protective", [
+    (None, 15, 8.9),          # Unknown container: largest distance over all containers at that wind
+    ("bicycle", 15, 8.9),     # Unrecognized container name counts as unknown
+    ("truck", None, 6.4),     # Unknown wind: largest distance over all wind classes for that container
+    (None, None, 11.0),       # Both unknown: largest in the table
+])
+def test_unknown_inputs_fall_back_to_worst_case(distance_engine, container, wind, protective):
+    record = distance_engine.protective_distance("1017", container=container, night=True, wind_kmh=wind)
+    assert record["protective_km"] == protective
+    assert record["worst_case"] is True
+    assert record["isolation_m"] == (600.0 if container == "truck" else 1000.0)
+
+
+def test_table1_day_and_night(distance_engine):
+    small_day = distance_engine.protective_distance("1017", large_spill=False, night=False)
+    small_night = distance_engine.protective_distance("1017", large_spill=False, night=True)
+    assert (small_day["isolation_m"], small_day["protective_km"], small_day["source"]) == (60.0, 0.3, "table1")
+    assert small_night["protective_km"] == 1.5
+    # Large spill with its own Table 1 row: container and wind do not apply
+    large = distance_engine.protective_distance("1008", large_spill=True, container="rail", night=True, wind_kmh=30)
+    assert (large["isolation_m"], large["protective_km"], large["source"]) == (400.0, 4.7, "table1")
+    assert large["worst_case"] is False and large["wind_class"] is None
+
+
+def test_unknown_un_id(distance_engine):
+    record = distance_engine.protective_distance("9999")
+    assert record["found"] is False
+    assert record["isolation_m"] is None and record["protective_km"] is None and record["source"] is None
+
+
+def test_vectorized_matches_single_scenarios(distance_engine):
+    scenarios = [("1017", True, "rail", True, 15.0), ("1017", False, None, False, np.nan),
+                 ("1008", True, None, True, 5.0), ("9999", True, None, False, 12.0)]
+    un_ids, large, container, night, wind = map(list, zip(*scenarios))
+    result = distance_engine.evaluate(un_ids, large, [distance_engine.resolve_container(c) for c in container], night, wind)
+    batch = distance_engine.to_records(result)
+    single = [distance_engine.protective_distance(u, l, c, n, None if np.isnan(w) else w) for u, l, c, n, w in scenarios]
+    assert batch == single
+
+
+def test_packed_table_round_trip(hazard_table, tmp_path):
+    path = str(tmp_path / "hazard_table.bin")
+    hazard_table.save(path)
+    loaded = HazardTable.load(path)
+    assert len(loaded) == len(hazard_table) == 3
+    for un_id in ["1008", "1017", "1162", "9999"]:
+        assert loaded.lookup(un_id) == hazard_table.lookup(un_id)
+    assert loaded.lookup("1162")["water_reactive_gases"] == ["HCl"]
+    assert loaded.lookup("1017")["large_spill_see_table3"] is True
+    assert ProtectiveDistanceEngine(loaded).protective_distance("1017", container="rail", night=True,
+                                                                wind_kmh=15)["protective_km"] == 8.9
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a_table.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        HazardTable.load(str(path))
@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+from embedding_cache import DiskEmbeddingStore, DISK_KEYS_FILE, DISK_VECTORS_FILE
+
+MODEL = "test-model"
+
+
+def vector(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def log_lines(cache_dir):
+    with open(os.path.join(cache_dir, DISK_KEYS_FILE), "r", encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_reopen_compacts_the_key_log_and_continues_the_ring(tmp_path):
+    cache_dir = str(tmp_path)
+    store = DiskEmbeddingStore(cache_dir, MODEL, capacity=3)
+    for i in range(5):
+        store.put(f"k{i}", vector(i + 1))
+    store.flush()
+    assert len(log_lines(cache_dir)) == 5
+
+    reopened = DiskEmbeddingStore(cache_dir, MODEL, capacity=3)
+    # One line per live row, oldest first
+    assert log_lines(cache_dir) == ["k2\t2", "k3\t0", "k4\t1"]
+    assert sorted(reopened.rows) == ["k2", "k3", "k4"]
+    assert np.array_equal(reopened.get("k4"), vector(5))
+    # The next write evicts the oldest key, not the newest
+    reopened.put("k5", vector(6))
+    assert "k2" not in reopened.rows and "k4" in reopened.rows
+
+
+def test_the_key_log_is_compacted_while_running(tmp_path):
+    cache_dir = str(tmp_path)
+    store = DiskEmbeddingStore(cache_dir, MODEL, capacity=2)
+    for i in range(20):
+        store.put(f"k{i}", vector(i + 1))
+        store.flush()
+        assert len(log_lines(cache_dir)) <= 4
+    assert sorted(store.rows) == ["k18", "k19"]
+
+
+def test_keys_without_a_stored_vector_are_dropped(tmp_path):
+    cache_dir = str(tmp_path)
+    store = DiskEmbeddingStore(cache_dir, MODEL, capacity=4)
+    for i in range(3):
+        store.put(f"k{i}", vector(i + 1))
+    store.flush()
+    # Interrupted run: a key line reached the log, its vector never reached the matrix
+    with open(os.path.join(cache_dir, DISK_KEYS_FILE), "a", encoding="utf-8") as f:
+        f.write("k3\t3\n")
+    reopened = DiskEmbeddingStore(cache_dir, MODEL, capacity=4)
+    assert sorted(reopened.rows) == ["k0", "k1", "k2"]
+    reopened.put("k3", vector(4))
+    reopened.flush()
+    assert reopened.rows["k3"] == 3 and "k0" in reopened.rows
+
+    # Matrix file cut short: only the rows it still holds keep their keys
+    with open(os.path.join(cache_dir, DISK_VECTORS_FILE), "r+b") as f:
+        f.truncate(4 * 4 * 2)
+    reopened = DiskEmbeddingStore(cache_dir, MODEL, capacity=4)
+    assert sorted(reopened.rows) == ["k0", "k1"]
+    assert os.path.getsize(os.path.join(cache_dir, DISK_VECTORS_FILE)) == 4 * 4 * 4
+    reopened.put("k4", vector(9))
+    assert reopened.rows["k4"] == 2
+    assert np.array_equal(reopened.get("k4"), vector(9))
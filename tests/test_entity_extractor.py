@@ -0,0 +1,114 @@
+import pytest
+
+from entity_extractor import EntityExtractor, common_names
+from material_index import normalize_name
+
+# Excerpt of the material index (names and guides as in Prepared Data_CN)
+MATERIALS = [
+    {"un_id": "1005", "name": "Ammonia, anhydrous (無水氨)", "guide_no": "125",
+     "aliases": "Anhydrous ammonia (無水氨)"},
+    {"un_id": "1017", "name": "Chlorine (氯)", "guide_no": "124"},
+    {"un_id": "1049", "name": "Hydrogen, compressed (氫，壓縮的)", "guide_no": "115"},
+    {"un_id": "1050", "name": "Hydrogen chloride, anhydrous (無水氯化氫)", "guide_no": "125"},
+    {"un_id": "2672", "name": "Ammonia solution, with more than 10% but not more than 35% ammonia "
+                             "(氨水溶液，氨含量超過 10% 但不超過 35%)", "guide_no": "154"},
+    {"un_id": "3318", "name": "Ammonia solution, with more than 50% ammonia (氨水溶液，氨含量超過 50%)",
+     "guide_no": "125"},
+    {"un_id": "1350", "name": "Sulfur (硫)", "guide_no": "133"},
+    {"un_id": "1830", "name": "Sulfuric acid (硫酸)", "guide_no": "137"},
+    {"un_id": "1831", "name": "Sulfuric acid, fuming (發煙硫酸)", "guide_no": "137"},
+    {"un_id": "1361", "name": "Carbon, animal or vegetable origin (碳，動物或植物來源)", "guide_no": "133"},
+    {"un_id": "1401", "name": "Calcium (鈣)", "guide_no": "138"},
+    {"un_id": "1428", "name": "Sodium (鈉)", "guide_no": "138"},
+    {"un_id": "1038", "name": "Ethylene, refrigerated liquid (乙烯，冷凍液體)", "guide_no": "115"},
+    {"un_id": "2055", "name": "Styrene monomer, stabilized (苯乙烯單體，穩定化的)", "guide_no": "128P"},
+    # Not an index entry: a short English name for the word-boundary rule
+    {"un_id": "9999", "name": "Tin (錫)", "guide_no": "171"},
+]
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return EntityExtractor.build(MATERIALS)
+
+
+def mentions(extractor, text):
+    key = normalize_name(text)
+    return [(MATERIALS[row]["un_id"], key[start:end]) for row, start, end in extractor.extract(key)]
+
+
+def test_common_names():
+    assert common_names("hydrogen, compressed") == ["hydrogen"]
+    assert common_names("無水氨") == ["氨"]
+    assert common_names("無水氯化氫") == ["氯化氫"]
+    assert common_names("苯乙烯單體,穩定化的") == ["苯乙烯單體", "苯乙烯"]
+    assert common_names("chlorine") == []
+
+
+def test_common_chinese_names_of_both_materials(extractor):
+    assert mentions(extractor, "氯氣與氨氣同時外洩") == [("1017", "氯"), ("1005", "氨")]
+    assert mentions(extractor, "液氨槽車翻覆") == [("1005", "氨")]
+    assert mentions(extractor, "氯化氫外洩") == [("1050", "氯化氫")]
+    assert mentions(extractor, "苯乙烯外洩") == [("2055", "苯乙烯")]
+    assert mentions(extractor, "乙烯外洩") == [("1038", "乙烯")]
+
+
+def test_bare_one_character_common_names_need_an_affix(extractor):
+    # The common name 氨 is registered, but on its own inside CJK text it may be part of another name
+    assert mentions(extractor, "氨外洩") == []
+    assert mentions(extractor, "氨基化合物") == []
+    assert mentions(extractor, "氨、氯") == [("1005", "氨"), ("1017", "氯")]
+
+
+def test_synonym_shared_across_guides_blocks_shorter_names(extractor):
+    # 氨水溶液 covers guides 125 and 154: neither it nor the 氨 inside it names a material
+    assert mentions(extractor, "氨水溶液外洩") == []
+    assert mentions(extractor, "氨水溶液，氨含量超過 50%") == [("3318", "氨水溶液,氨含量超過 50%")]
+
+
+def test_leftmost_longest(extractor):
+    assert mentions(extractor, "發煙硫酸外洩") == [("1831", "發煙硫酸")]
+    assert mentions(extractor, "硫酸槽車") == [("1830", "硫酸")]
+    assert mentions(extractor, "sulfuric acid, fuming and sulfur") == [("1831", "sulfuric acid, fuming"),
+                                                                        ("1350", "sulfur")]
+
+
+def test_ascii_names_match_whole_words_only(extractor):
+    assert mentions(extractor, "testing the tank") == []
+    assert mentions(extractor, "tin2 or tinned goods") == []
+    assert mentions(extractor, "Tin spill") == [("9999", "tin")]
+    assert mentions(extractor, "(tin)") == [("9999", "tin")]
+    assert mentions(extractor, "sulfurous smell") == []
+    # CJK characters next to an English name are not part of the word
+    assert mentions(extractor, "tin錫") == [("9999", "tin"), ("9999", "錫")]
+
+
+def test_overlapping_cjk_names(extractor):
+    # 氯, 氯化氫 and 氫 all match inside "氯化氫": the leftmost match is kept, and the longest at that start
+    assert mentions(extractor, "氯化氫") == [("1050", "氯化氫")]
+    # A one-character name run into other CJK characters is not a name of its own
+    assert mentions(extractor, "氫氯化氫") == [("1050", "氯化氫")]
+    assert mentions(extractor, "氯氫") == []
+    assert mentions(extractor, "硫酸與硫") == [("1830", "硫酸"), ("1350", "硫")]
+    assert mentions(extractor, "(硫)") == [("1350", "硫")]
+
+
+@pytest.mark.parametrize("text", ["食鹽水(氯化鈉)外洩", "碳酸鈣粉末灑出", "硫酸銅溶液", "硫酸鈉"])
+def test_element_names_inside_compound_names(extractor, text):
+    # Table salt, chalk and copper sulfate: not chlorine / sodium, carbon / calcium or sulfuric acid
+    assert mentions(extractor, text) == []
+
+
+def test_acid_before_a_word_that_is_not_a_cation(extractor):
+    assert mentions(extractor, "硫酸鐵路槽車翻覆") == [("1830", "硫酸")]
+
+
+def test_save_load_round_trip(extractor, tmp_path):
+    path = str(tmp_path / "entity_extractor.npz")
+    extractor.save(path)
+    loaded = EntityExtractor.load(path)
+    assert len(loaded) == len(extractor) == len(MATERIALS)
+    assert loaded.states == extractor.states
+    for text in ["氯氣與氨氣同時外洩", "氨水溶液外洩", "氫氯化氫", "Tin spill while testing", "發煙硫酸與硫"]:
+        key = normalize_name(text)
+        assert loaded.extract(key) == extractor.extract(key)
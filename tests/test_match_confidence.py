@@ -0,0 +1,47 @@
+from match_confidence import CascadeCalibration, CASCADE_TIERS, tier_label
+
+TIER_COSTS = {"lexical": 0.1, "embed": 1.0, tier_label(5): 5.0, tier_label(20): 10.0}
+
+
+def labeled_queries(wrong_lexical):
+    """Every query's exact BM25 name match is right except at the given positions; the vector tiers always are."""
+    records, query_samples = [], []
+    for pos in range(10):
+        lexical = ("exact", None, pos not in wrong_lexical)
+        ranking = ("ranking", [0.5, 1.0], True)
+        records.append({"lexical": lexical, tier_label(5): ranking, tier_label(20): ranking})
+        query_samples.append([lexical, ranking, ranking])
+    return query_samples, records
+
+
+def fit(query_samples, records):
+    return CascadeCalibration.fit([s for per_query in query_samples for s in per_query], records, TIER_COSTS)
+
+
+def test_fit_stops_early_when_it_costs_no_accuracy():
+    query_samples, records = labeled_queries(wrong_lexical=set())
+    result = fit(query_samples, records).simulate(records, TIER_COSTS)
+    assert result["answered_by_tier"]["lexical"] == 10
+    assert result["accuracy"] == result["fixed_accuracy"] == 1.0
+
+
+def test_cross_validation_replays_queries_the_fit_has_not_seen():
+    query_samples, records = labeled_queries(wrong_lexical={0})
+    # On the full set the wrong lexical answer rules out trusting exact matches, so nothing is lost in-sample
+    in_sample = fit(query_samples, records).simulate(records, TIER_COSTS)
+    assert in_sample["accuracy"] == in_sample["fixed_accuracy"] == 1.0
+    # The fold holding query 0 is calibrated on queries whose exact matches were all right
+    held_out = CascadeCalibration.cross_validate(query_samples, records, TIER_COSTS, folds=5)
+    assert held_out["folds"] == 5
+    assert sum(held_out["answered_by_tier"].values()) == len(records)
+    assert held_out["fixed_accuracy"] == 1.0
+    assert held_out["accuracy"] == 0.9
+
+
+def test_without_early_stops_is_the_fixed_search():
+    query_samples, records = labeled_queries(wrong_lexical={0})
+    calibration = fit(query_samples, records).without_early_stops()
+    assert calibration.tiers == CASCADE_TIERS[-1:]
+    result = calibration.simulate(records, TIER_COSTS)
+    assert result["answered_by_tier"] == {"lexical": 0, tier_label(CASCADE_TIERS[-1]): len(records)}
+    assert result["accuracy"] == result["fixed_accuracy"]
@@ -0,0 +1,59 @@
+import pytest
+
+from material_index import MaterialIndex
+from rag_engine import ERGEngine
+
+# Excerpt of the material index (names and guides as in Prepared Data_CN)
+MATERIALS = [
+    {"un_id": "1049", "name": "Hydrogen, compressed (氫，壓縮的)", "guide_no": "115"},
+    {"un_id": "1053", "name": "Hydrogen sulfide (硫化氫)", "guide_no": "117", "aliases": "Hydrogen sulphide (硫化氫)"},
+    {"un_id": "1076", "name": "Phosgene (光氣)", "guide_no": "125"},
+    # Index lines of one UN ID and guide that were not merged into aliases are still one material
+    {"un_id": "1075", "name": "Liquefied petroleum gas (液化石油氣)", "guide_no": "115"},
+    {"un_id": "1075", "name": "LPG (液化石油氣)", "guide_no": "115"},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return MaterialIndex(MATERIALS)
+
+
+def matched(index, query):
+    hit = index.lookup(query)
+    return hit and hit[0]["un_id"]
+
+
+def test_exact_names(index):
+    assert matched(index, "Hydrogen sulphide") == "1053"
+    assert matched(index, "硫化氫") == "1053"
+    assert matched(index, "HYDROGEN, COMPRESSED") == "1049"
+
+
+def test_prefix_of_a_single_material(index):
+    assert matched(index, "phosg") == "1076"
+    assert matched(index, "hydrogen sul") == "1053"
+    assert matched(index, "液化石油") == "1075"
+
+
+def test_ambiguous_prefix_is_left_to_the_semantic_tiers(index):
+    # Also the start of "Hydrogen sulfide": the shortest name would win over "Hydrogen, compressed"
+    assert index.lookup_prefix("hydrogen") is None
+    assert matched(index, "hydrogen") is None
+
+
+def test_short_prefixes_are_not_matched(index):
+    assert matched(index, "ph") is None
+    assert matched(index, "光") is None
+
+
+def test_refinement_leaves_ambiguous_partial_names_to_the_ranking():
+    hydrogen, sulfide, phosgene = MATERIALS[:3]
+    # Candidates in ranking order: the shortest name containing "hydrogen" would be Hydrogen sulfide
+    (meta, _, kind), = ERGEngine._refine_batch(["hydrogen"], [[phosgene, hydrogen, sulfide]])
+    assert (meta["un_id"], kind) == ("1076", "ranking")
+    (meta, _, kind), = ERGEngine._refine_batch(["sulph"], [[phosgene, hydrogen, sulfide]])
+    assert (meta["un_id"], kind) == ("1053", "contains")
+    # Two index lines of one material are not ambiguous
+    (meta, _, kind), = ERGEngine._refine_batch(["石油"], [[phosgene] + MATERIALS[3:]])
+    assert (meta["un_id"], kind) == ("1075", "contains")
@@ -0,0 +1,47 @@
+from response_cache import ResponseCache, DBVersion, write_db_version
+
+
+def answer(value):
+    calls = []
+
+    def compute():
+        calls.append(value)
+        return value
+    return compute, calls
+
+
+def test_results_are_keyed_by_the_version_the_data_was_loaded_from(tmp_path):
+    db_dir = str(tmp_path)
+    shared = str(tmp_path / "response_cache.sqlite")
+    write_db_version(db_dir)
+    old = ResponseCache(db_dir, DBVersion(db_dir).current(), shared_path=shared)
+    compute, calls = answer("old answer")
+    assert old.get_or_compute("answer", ("氯氣外洩",), compute) == "old answer"
+    assert old.get_or_compute("answer", ("氯氣外洩",), compute) == "old answer"
+    assert calls == ["old answer"]
+
+    # Rebuilt: a process started now loads the new data
+    write_db_version(db_dir)
+    new = ResponseCache(db_dir, DBVersion(db_dir).current(), shared_path=shared)
+    compute, calls = answer("new answer")
+    assert new.get_or_compute("answer", ("氯氣外洩",), compute) == "new answer"
+    assert calls == ["new answer"]
+
+    # The old process keeps answering from its own data, and never stores that under the new version
+    compute, calls = answer("old answer")
+    assert old.get_or_compute("answer", ("氨氣外洩",), compute) == "old answer"
+    assert old.cache_info()["stale"] == 1
+    # Only the new process's answer is shared (the old build's row was pruned on the new version's first use)
+    assert new.cache_info()["shared_entries"] == 1
+    compute, calls = answer("new answer")
+    assert new.get_or_compute("answer", ("氨氣外洩",), compute) == "new answer"
+    assert calls == ["new answer"]
+
+
+def test_no_version_disables_the_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path), None)
+    compute, calls = answer(1)
+    cache.get_or_compute("answer", ("q",), compute)
+    cache.get_or_compute("answer", ("q",), compute)
+    assert calls == [1, 1]
+    assert cache.cache_info()["bypassed"] == 2
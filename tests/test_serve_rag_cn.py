@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from serve_rag_cn import RequestError, _evaluate_scenarios, _read_request
+
+
+def test_scenarios_use_json_booleans(distance_engine):
+    small, large = _evaluate_scenarios(distance_engine, [
+        {"un_id": "1017", "large_spill": False, "night": True},
+        {"un_id": "1017", "container": "rail", "night": True, "wind_kmh": 15},
+    ])
+    assert (small["source"], small["protective_km"]) == ("table1", 1.5)
+    assert (large["source"], large["protective_km"], large["un_id"]) == ("table3", 8.9, "1017")
+
+
+@pytest.mark.parametrize("field, value", [
+    ("large_spill", "false"), ("large_spill", "0"), ("large_spill", 0), ("night", "true"), ("night", None),
+])
+def test_non_boolean_flags_are_rejected(distance_engine, field, value):
+    with pytest.raises(RequestError) as error:
+        _evaluate_scenarios(distance_engine, [{"un_id": "1017", field: value}])
+    assert error.value.status == 400
+
+
+def test_invalid_wind_is_rejected(distance_engine):
+    with pytest.raises(RequestError) as error:
+        _evaluate_scenarios(distance_engine, [{"un_id": "1017", "wind_kmh": "windy"}])
+    assert error.value.status == 400
+
+
+def read_request(raw: bytes):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await _read_request(reader)
+    return asyncio.run(run())
+
+
+def test_request_with_body():
+    request = read_request(b"POST /query?x=1 HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}")
+    assert request == ("POST", "/query", True, b"{}")
+
+
+@pytest.mark.parametrize("length", [b"abc", b"-5", b"+2", b"1_0", b"2.0"])
+def test_invalid_content_length_is_rejected(length):
+    with pytest.raises(RequestError) as error:
+        read_request(b"POST /query HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n{}")
+    assert error.value.status == 400
+
+
+def test_body_cut_short_closes_the_connection():
+    assert read_request(b"POST /query HTTP/1.1\r\nContent-Length: 10\r\n\r\n{}") is None
@@ -0,0 +1,309 @@
+import json
+import os
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+# hnswlib is optional: only the "hnsw" store (and its build-time index) needs it
+
+# Exported next to the Chroma DB by build_rag_db_cn.py, one set of files per partition (collection name):
+#   <name>.vectors.npy   (rows x dim) float16/float32, normalized for cosine space
+#   <name>.records.jsonl one {"id", "metadata", "document"} line per row
+#   <name>.hnsw.bin      hnswlib index over the same rows (label = row)
+#   <name>.json          manifest: DB version, row count, dim, space, dtype, HNSW parameters
+VECTOR_STORE_DIRNAME = "vector_store"
+
+VECTOR_STORE_ENV_VAR = "ERG_RAG_VECTOR_STORE"
+HNSW_EF_ENV_VAR = "ERG_RAG_HNSW_EF"
+
+VECTOR_STORES = ["chroma", "flat", "hnsw"]
+DEFAULT_VECTOR_STORE = "chroma"
+VECTOR_DTYPES = ["float16", "float32"]
+DEFAULT_VECTOR_DTYPE = "float16"
+
+DEFAULT_HNSW_M = 16
+DEFAULT_HNSW_EF_CONSTRUCTION = 200
+DEFAULT_HNSW_EF = 64
+
+# Rows read from Chroma per page while exporting
+EXPORT_PAGE_SIZE = 1000
+# Filters selecting at most this many rows (e.g. one guide's sections) are scanned exactly, also by the HNSW store
+EXACT_SCAN_ROWS = 1024
+# Cached filter masks per store (one per distinct where clause)
+MASK_CACHE_SIZE = 1024
+
+
+def collection_space(collection) -> str:
+    """Distance space of a Chroma collection ("cosine" / "l2" / "ip"); older collections keep it in metadata."""
+    config = getattr(collection, "configuration_json", None) or {}
+    space = (config.get("hnsw") or {}).get("space") or (collection.metadata or {}).get("hnsw:space")
+    return space or "l2"
+
+
+def _paths(store_dir: str, name: str) -> Dict[str, str]:
+    base = os.path.join(store_dir, name)
+    return {"vectors": base + ".vectors.npy", "records": base + ".records.jsonl",
+            "hnsw": base + ".hnsw.bin", "manifest": base + ".json"}
+
+
+def export_collection(collection, store_dir: str, name: str, version: str, dtype: str = DEFAULT_VECTOR_DTYPE,
+                      hnsw_m: int = DEFAULT_HNSW_M, hnsw_ef_construction: int = DEFAULT_HNSW_EF_CONSTRUCTION) -> Dict[str, Any]:
+    """
+    Export the vectors, ids, metadata and documents of a Chroma collection for the flat / HNSW stores.
+    Rows are read page by page into a memory-mapped matrix; the HNSW index is built when hnswlib is installed.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    paths = _paths(store_dir, name)
+    space = collection_space(collection)
+    total = collection.count()
+
+    vectors = None
+    with open(paths["records"] + ".tmp", "w", encoding="utf-8") as records:
+        for offset in range(0, total, EXPORT_PAGE_SIZE):
+            page = collection.get(include=["embeddings", "metadatas", "documents"], limit=EXPORT_PAGE_SIZE, offset=offset)
+            block = np.asarray(page["embeddings"], dtype=np.float32)
+            if space == "cosine":
+                block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(paths["vectors"] + ".tmp", mode="w+", dtype=dtype,
+                                                    shape=(total, block.shape[1]))
+            vectors[offset:offset + len(block)] = block
+            for record_id, meta, doc in zip(page["ids"], page["metadatas"], page["documents"]):
+                records.write(json.dumps({"id": record_id, "metadata": meta, "document": doc}, ensure_ascii=False) + "\n")
+    if vectors is None:
+        raise ValueError(f"collection '{name}' is empty, nothing to export")
+    dim = vectors.shape[1]
+    vectors.flush()
+    del vectors
+    os.replace(paths["vectors"] + ".tmp", paths["vectors"])
+    os.replace(paths["records"] + ".tmp", paths["records"])
+
+    manifest = {"version": version, "count": total, "dim": dim, "space": space, "dtype": dtype, "hnsw": None}
+    try:
+        import hnswlib
+    except ImportError:
+        hnswlib = None # Flat store only; `pip install hnswlib` enables the "hnsw" store
+    if hnswlib is not None:
+        index = hnswlib.Index(space=space, dim=dim)
+        index.init_index(max_elements=total, ef_construction=hnsw_ef_construction, M=hnsw_m)
+        index.add_items(np.load(paths["vectors"], mmap_mode="r").astype(np.float32), np.arange(total))
+        index.save_index(paths["hnsw"] + ".tmp")
+        os.replace(paths["hnsw"] + ".tmp", paths["hnsw"])
+        manifest["hnsw"] = {"M": hnsw_m, "ef_construction": hnsw_ef_construction}
+
+    # Manifest last: it marks the export as complete for this DB version
+    with open(paths["manifest"] + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(paths["manifest"] + ".tmp", paths["manifest"])
+    return manifest
+
+
+class ChromaVectorStore:
+    """Default store: queries go to the Chroma collection (its built-in HNSW index with Chroma's settings)."""
+    kind = "chroma"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self.collection.query(query_embeddings=query_embeddings, n_results=n_results, where=where)
+
+    def get(self, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        return self.collection.get(where=where, include=include or ["metadatas"])
+
+    def count(self) -> int:
+        return self.collection.count()
+
+
+class FlatVectorStore:
+    """
+    Exact search: one matrix product over the exported (memory-mapped) vectors, so results are deterministic.
+    NumPy has no float16 matrix kernels, so a float16 export is converted to float32 once at load
+    (the pre-fork server loads the store before forking, so its workers share that copy);
+    a float32 export is used directly from the memory map.
+    """
+    kind = "flat"
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], metadatas: List[Dict[str, Any]], documents: List[str],
+                 space: str):
+        self.vectors = vectors
+        self.ids = ids
+        self.metadatas = metadatas
+        self.documents = documents
+        self.space = space
+        self._columns: Dict[str, np.ndarray] = {}
+        self._masks: Dict[str, np.ndarray] = {}
+        # Squared norms for the l2 space (Chroma reports squared L2 distances)
+        self._sq_norms = np.einsum("ij,ij->i", vectors, vectors) if space == "l2" else None
+
+    @classmethod
+    def load(cls, store_dir: str, name: str, version: Optional[str]) -> "FlatVectorStore":
+        """Raises FileNotFoundError without an export, ValueError when it belongs to another DB version."""
+        paths = _paths(store_dir, name)
+        with open(paths["manifest"], "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if version is None or manifest.get("version") != version:
+            raise ValueError(f"exported vectors of '{name}' do not match the current database version")
+        vectors = np.load(paths["vectors"], mmap_mode="r")
+        if vectors.dtype != np.float32:
+            vectors = vectors.astype(np.float32)
+        ids, metadatas, documents = [], [], []
+        with open(paths["records"], "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                metadatas.append(record["metadata"])
+                documents.append(record["document"])
+        if len(ids) != len(vectors):
+            raise ValueError(f"exported vectors and records of '{name}' differ in length")
+        store = cls(vectors, ids, metadatas, documents, manifest["space"])
+        store.manifest = manifest
+        return store
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def _column(self, key: str) -> np.ndarray:
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(len(self.metadatas), dtype=object)
+            column[:] = [meta.get(key) for meta in self.metadatas]
+            self._columns[key] = column
+        return column
+
+    def _mask(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Row mask for a Chroma where clause ($and / $or, equality, $eq / $ne / $in / $nin); None = all rows."""
+        if not where:
+            return None
+        key = json.dumps(where, sort_keys=True, default=str)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._evaluate(where)
+            if len(self._masks) >= MASK_CACHE_SIZE:
+                self._masks.clear()
+            self._masks[key] = mask
+        return mask
+
+    def _evaluate(self, where: Dict[str, Any]) -> np.ndarray:
+        masks = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                parts = [self._evaluate(part) for part in condition]
+                masks.append(np.logical_and.reduce(parts) if key == "$and" else np.logical_or.reduce(parts))
+                continue
+            column = self._column(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, value in condition.items():
+                if op == "$eq":
+                    masks.append(column == value)
+                elif op == "$ne":
+                    masks.append(column != value)
+                elif op in ("$in", "$nin"):
+                    found = np.logical_or.reduce([column == v for v in value]) if value else np.zeros(len(column), bool)
+                    masks.append(found if op == "$in" else ~found)
+                else:
+                    raise ValueError(f"unsupported where operator for the exported vector store: {op}")
+        return np.logical_and.reduce(masks).astype(bool)
+
+    def _distances(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        dots = queries @ vectors.T
+        if self.space == "l2":
+            sq_norms = self._sq_norms if rows is None else self._sq_norms[rows]
+            return np.einsum("ij,ij->i", queries, queries)[:, None] + sq_norms[None, :] - 2.0 * dots
+        return 1.0 - dots # cosine (normalized rows and queries) and ip
+
+    def _prepare(self, query_embeddings) -> np.ndarray:
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        if self.space == "cosine":
+            queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        return queries
+
+    def _exact(self, queries: np.ndarray, n_results: int, mask: Optional[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        rows = None if mask is None else np.flatnonzero(mask)
+        if rows is not None and len(rows) > len(self.ids) // 4:
+            # Large filters: scan everything and exclude the rest (cheaper than gathering the rows)
+            distances = self._distances(queries, None)
+            distances[:, ~mask] = np.inf
+            rows = None
+        else:
+            distances = self._distances(queries, rows)
+        available = distances.shape[1] if mask is None or rows is not None else int(mask.sum())
+        k = min(n_results, available)
+        if k == 0:
+            return [np.empty(0, dtype=np.int64)] * len(queries), [np.empty(0, dtype=np.float32)] * len(queries)
+
+        top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(distances, top, axis=1).argsort(axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        labels = top if rows is None else rows[top]
+        return list(labels), list(top_distances)
+
+    def _search(self, queries: np.ndarray, n_results: int, mask: Optional[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        return self._exact(queries, n_results, mask)
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Same call and result layout as Chroma's collection.query (ids / metadatas / documents / distances per query)."""
+        labels, distances = self._search(self._prepare(query_embeddings), n_results, self._mask(where))
+        return {
+            "ids": [[self.ids[i] for i in rows] for rows in labels],
+            "metadatas": [[self.metadatas[i] for i in rows] for rows in labels],
+            "documents": [[self.documents[i] for i in rows] for rows in labels],
+            "distances": [[float(d) for d in dist] for dist in distances],
+        }
+
+    def get(self, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        mask = self._mask(where)
+        rows = range(len(self.ids)) if mask is None else np.flatnonzero(mask)
+        return {"ids": [self.ids[i] for i in rows], "metadatas": [self.metadatas[i] for i in rows],
+                "documents": [self.documents[i] for i in rows]}
+
+
+class HNSWVectorStore(FlatVectorStore):
+    """
+    Approximate search on the exported hnswlib index, with M / ef_construction chosen at build time and
+    ef (search breadth: higher = better recall, slower) at load. Small filtered sets are scanned exactly.
+    """
+    kind = "hnsw"
+
+    @classmethod
+    def load(cls, store_dir: str, name: str, version: Optional[str], ef: int = DEFAULT_HNSW_EF) -> "HNSWVectorStore":
+        """Raises ImportError without hnswlib, FileNotFoundError / ValueError like FlatVectorStore.load."""
+        import hnswlib
+
+        store = super().load(store_dir, name, version)
+        if store.manifest.get("hnsw") is None:
+            raise FileNotFoundError(f"no HNSW index exported for '{name}' (install hnswlib and rebuild)")
+        store.index = hnswlib.Index(space=store.space, dim=store.vectors.shape[1])
+        store.index.load_index(_paths(store_dir, name)["hnsw"], max_elements=store.count())
+        # hnswlib searches with max(ef, k), so ef is set once here (set_ef is not safe during concurrent queries)
+        store.index.set_ef(ef)
+        store.ef = ef
+        return store
+
+    def _search(self, queries: np.ndarray, n_results: int, mask: Optional[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        selected = len(self.ids) if mask is None else int(mask.sum())
+        k = min(n_results, selected)
+        if k == 0 or selected <= EXACT_SCAN_ROWS:
+            return self._exact(queries, n_results, mask)
+        allowed = None if mask is None else mask.tolist().__getitem__
+        try:
+            labels, distances = self.index.knn_query(queries, k=k, num_threads=1, filter=allowed)
+        except RuntimeError:
+            # Fewer than k filtered neighbours reachable with this ef: fall back to the exact scan
+            return self._exact(queries, n_results, mask)
+        return list(labels.astype(np.int64)), list(distances)
+
+
+def open_vector_store(kind: str, collection, store_dir: str, name: str, version: Optional[str],
+                      hnsw_ef: int = DEFAULT_HNSW_EF):
+    """Store for one partition; the exported stores raise (ImportError / OSError / ValueError) when unavailable."""
+    if kind == "flat":
+        return FlatVectorStore.load(store_dir, name, version)
+    if kind == "hnsw":
+        return HNSWVectorStore.load(store_dir, name, version, ef=hnsw_ef)
+    if kind == "chroma":
+        return ChromaVectorStore(collection)
+    raise ValueError(f"unknown vector store '{kind}', expected one of {', '.join(VECTOR_STORES)}")